@@ -0,0 +1,282 @@
+import logging
+import multiprocessing
+import queue
+import time
+import traceback
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from motion_detector import MotionDetector
+
+# seconds a worker waits for the previous frame's motion image before giving up on the frame
+PREVIOUS_FRAME_TIMEOUT_SECONDS = 10
+PREVIOUS_FRAME_POLL_SECONDS = 0.0005
+# seconds between worker checks while waiting for a result; a worker that exits (ex: killed when out of memory)
+# never returns its result
+RESULT_POLL_SECONDS = 1
+SEQUENCE_EMPTY = -1
+
+
+class AnalysisResult(NamedTuple):
+    sequence: int
+    slot: int
+    context: Any  # passed to submit()
+    diff_score: Optional[int]  # None for the first frame, or after a failed previous frame
+    cell_scores: Optional[List[List[int]]]
+    error: str  # traceback text; '' on success
+    preprocess_seconds: float
+    diff_seconds: float
+
+
+class AnalysisPipeline:
+    """
+    motion checks in worker processes, for multi-core devices
+    frames are copied into a shared memory ring of slot_count fixed-size slots, and workers receive slot indexes;
+    each worker writes the motion frame into a matching motion ring slot, then waits for the previous frame's
+    motion frame to compute the diff score, so scores always compare consecutive frames
+    results are returned in submission order. A slot is reused only after the next frame's result is returned,
+    so the frame and motion frame of the last result stay valid for saving
+    """
+
+    def __init__(self, worker_count: int = 2, slot_count: int = 8, detector_settings: Optional[Dict[str, Any]] = None,
+                 log: Optional[Callable[..., None]] = None):
+        self.worker_count: int = max(1, worker_count)
+        self.slot_count: int = max(3, slot_count)
+        self.detector_settings: Dict[str, Any] = detector_settings if detector_settings is not None else {}
+        self._log: Callable[..., None] = log if log is not None else (lambda message, level=logging.NOTSET: None)
+
+        self.frame_shape: Optional[Tuple[int, ...]] = None
+        self.motion_shape: Tuple[int, int] = (0, 0)
+        self._frame_memory: Optional[shared_memory.SharedMemory] = None
+        self._motion_memory: Optional[shared_memory.SharedMemory] = None
+        self._frames: Any = None  # slot_count x frame_shape view of the frame ring
+        self._motion_images: Any = None
+        self._motion_sequences: Any = None  # per slot: sequence of its finished motion frame
+        self._task_queue: Any = None
+        self._result_queue: Any = None
+        self._workers: List[Any] = []
+        self._next_sequence: int = 0
+        self._next_result_sequence: int = 0
+        self._contexts: Dict[int, Any] = {}
+        self._results: Dict[int, AnalysisResult] = {}
+
+    def is_running(self) -> bool:
+        return self.frame_shape is not None
+
+    def start(self, frame_shape: Tuple[int, ...]) -> None:
+        """
+        allocate the rings for frames of frame_shape (uint8) and start the workers
+        """
+        if self.is_running():
+            return
+
+        motion_shape = MotionDetector(**self.detector_settings).get_motion_shape(frame_shape)
+        frame_bytes = int(np.prod(frame_shape))
+        motion_bytes = motion_shape[0] * motion_shape[1]
+
+        try:
+            self._frame_memory = shared_memory.SharedMemory(create=True, size=frame_bytes * self.slot_count)
+            self._motion_memory = shared_memory.SharedMemory(create=True, size=motion_bytes * self.slot_count)
+            self._frames = np.ndarray((self.slot_count,) + tuple(frame_shape), dtype=np.uint8,
+                                      buffer=self._frame_memory.buf)
+            self._motion_images = np.ndarray((self.slot_count,) + motion_shape, dtype=np.uint8,
+                                             buffer=self._motion_memory.buf)
+
+            # spawn: forking a process with running writer threads can copy locks in a held state
+            context = multiprocessing.get_context('spawn')
+            self._motion_sequences = context.Array('q', [SEQUENCE_EMPTY] * self.slot_count)
+            self._task_queue = context.Queue()
+            self._result_queue = context.Queue()
+            self._workers = [context.Process(target=_run_worker, name=f'analysis-worker-{worker_index}',
+                                             daemon=True,
+                                             args=(self.detector_settings, self._frame_memory.name,
+                                                   self._motion_memory.name, tuple(frame_shape), motion_shape,
+                                                   self.slot_count, self._motion_sequences, self._task_queue,
+                                                   self._result_queue))
+                             for worker_index in range(self.worker_count)]
+            for worker in self._workers:
+                worker.start()
+        except Exception:
+            self._release()
+            raise
+
+        self.frame_shape = tuple(frame_shape)
+        self.motion_shape = motion_shape
+        self._next_sequence = 0
+        self._next_result_sequence = 0
+        self._log(f'Analysis pipeline: {self.worker_count} workers, {self.slot_count} slots, '
+                  f'{(frame_bytes + motion_bytes) * self.slot_count / 1024 / 1024:0.1f} MB shared', logging.INFO)
+
+    def stop(self) -> None:
+        """
+        stop the workers and free shared memory; results not yet returned are discarded
+        frames and motion frames from get_frame() and get_motion_image() must not be used after this
+        """
+        if not self.is_running():
+            return
+
+        for _ in self._workers:
+            self._task_queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout=PREVIOUS_FRAME_TIMEOUT_SECONDS)
+        self._release()
+        self._contexts = {}
+        self._results = {}
+        self._next_sequence = 0
+        self._next_result_sequence = 0
+        self.frame_shape = None
+
+    def _release(self) -> None:
+        """
+        terminate remaining workers, then close and unlink the shared memory; also used when start() fails
+        """
+        for worker in self._workers:
+            if worker.pid is not None and worker.is_alive():
+                worker.terminate()
+                worker.join()
+        self._workers = []
+
+        self._frames = None
+        self._motion_images = None
+        for memory in [self._frame_memory, self._motion_memory]:
+            if memory is not None:
+                memory.close()
+                memory.unlink()
+        self._frame_memory = None
+        self._motion_memory = None
+
+    def get_pending_count(self) -> int:
+        return self._next_sequence - self._next_result_sequence
+
+    def has_free_slot(self) -> bool:
+        # the last returned frame and motion frame stay valid (for saving), so at most slot_count - 1 are in flight
+        return self.get_pending_count() < self.slot_count - 1
+
+    def submit(self, image_array: Any, context: Any = None) -> None:
+        """
+        copy image_array into the next slot for the workers; requires has_free_slot()
+        """
+        sequence = self._next_sequence
+        slot = sequence % self.slot_count
+
+        np.copyto(self._frames[slot], image_array)
+        self._contexts[sequence] = context
+        self._task_queue.put((sequence, slot))
+        self._next_sequence += 1
+
+    def get_result(self, block: bool) -> Optional[AnalysisResult]:
+        """
+        the next result in submission order, or None if nothing is pending (or not ready, when not blocking)
+        raises RuntimeError if a worker has exited while waiting
+        """
+        while self._next_result_sequence not in self._results:
+            if self.get_pending_count() == 0:
+                return None
+            try:
+                result = self._result_queue.get(block=block, timeout=RESULT_POLL_SECONDS if block else None)
+            except queue.Empty:
+                if not block:
+                    return None
+                self._check_workers()
+                continue
+            self._results[result.sequence] = result._replace(context=self._contexts.pop(result.sequence, None))
+
+        self._next_result_sequence += 1
+        return self._results.pop(self._next_result_sequence - 1)
+
+    def _check_workers(self) -> None:
+        for worker in self._workers:
+            if not worker.is_alive():
+                raise RuntimeError(f'Analysis worker {worker.name} exited with code {worker.exitcode}')
+
+    def get_frame(self, slot: int) -> Any:
+        return self._frames[slot]
+
+    def get_motion_image(self, slot: int) -> Any:
+        return self._motion_images[slot]
+
+
+def _run_worker(detector_settings: Dict[str, Any], frame_memory_name: str, motion_memory_name: str,
+                frame_shape: Tuple[int, ...], motion_shape: Tuple[int, int], slot_count: int, motion_sequences: Any,
+                task_queue: Any, result_queue: Any) -> None:
+    # spawned workers share the supervisor's resource tracker; only the supervisor unlinks the segments
+    frame_memory = shared_memory.SharedMemory(name=frame_memory_name)
+    motion_memory = shared_memory.SharedMemory(name=motion_memory_name)
+    frames = np.ndarray((slot_count,) + frame_shape, dtype=np.uint8, buffer=frame_memory.buf)
+    motion_images = np.ndarray((slot_count,) + motion_shape, dtype=np.uint8, buffer=motion_memory.buf)
+    motion_detector = MotionDetector(**detector_settings)
+
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            result_queue.put(_analyze_frame(motion_detector, frames, motion_images, motion_sequences, *task))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        del frames, motion_images
+        frame_memory.close()
+        motion_memory.close()
+
+
+def _analyze_frame(motion_detector: MotionDetector, frames: Any, motion_images: Any, motion_sequences: Any,
+                   sequence: int, slot: int) -> AnalysisResult:
+    perf_start_time = time.perf_counter()
+
+    try:
+        motion_detector.preprocess(frames[slot], motion_images[slot])
+    except Exception:
+        _set_motion_sequence(motion_sequences, slot, _get_failed_sequence(sequence))
+        return AnalysisResult(sequence, slot, None, None, None, traceback.format_exc(), 0, 0)
+    _set_motion_sequence(motion_sequences, slot, sequence)
+    preprocess_seconds = time.perf_counter() - perf_start_time
+
+    try:
+        if sequence == 0:
+            return AnalysisResult(sequence, slot, None, None, None, '', preprocess_seconds, 0)
+
+        previous_slot = (sequence - 1) % len(motion_images)
+        if not _wait_for_motion_sequence(motion_sequences, previous_slot, sequence - 1):
+            # nothing to compare against: handled like a first frame
+            return AnalysisResult(sequence, slot, None, None, None, '', preprocess_seconds, 0)
+
+        perf_diff_start_time = time.perf_counter()
+        diff_score = motion_detector.score(motion_images[previous_slot], motion_images[slot])
+        cell_scores = motion_detector.cell_scores.tolist() if motion_detector.cell_scores is not None else None
+        return AnalysisResult(sequence, slot, None, diff_score, cell_scores, '', preprocess_seconds,
+                              time.perf_counter() - perf_diff_start_time)
+    except Exception:
+        return AnalysisResult(sequence, slot, None, None, None, traceback.format_exc(), preprocess_seconds, 0)
+
+
+def _get_failed_sequence(sequence: int) -> int:
+    # failures are stored per sequence, so an old failure in a reused slot isn't mistaken for a new one
+    return SEQUENCE_EMPTY - 1 - sequence
+
+
+def _set_motion_sequence(motion_sequences: Any, slot: int, sequence: int) -> None:
+    # the lock also orders the motion frame writes before the sequence, for other processes
+    with motion_sequences.get_lock():
+        motion_sequences[slot] = sequence
+
+
+def _wait_for_motion_sequence(motion_sequences: Any, slot: int, sequence: int) -> bool:
+    """
+    wait until slot holds the motion frame of sequence; False if that frame failed
+    raises TimeoutError if it never arrives
+    """
+    timeout_time = time.perf_counter() + PREVIOUS_FRAME_TIMEOUT_SECONDS
+
+    while True:
+        with motion_sequences.get_lock():
+            slot_sequence = motion_sequences[slot]
+        if slot_sequence == sequence:
+            return True
+        if slot_sequence == _get_failed_sequence(sequence):
+            return False
+        if time.perf_counter() > timeout_time:
+            raise TimeoutError(f'Motion frame {sequence} not ready after {PREVIOUS_FRAME_TIMEOUT_SECONDS} seconds')
+        time.sleep(PREVIOUS_FRAME_POLL_SECONDS)
@@ -0,0 +1,457 @@
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from fractions import Fraction
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from frame_sources import SyntheticFrameSource
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+RESULTS_VERSION = 1
+RESOLUTIONS = [(640, 480), (1024, 768), (1920, 1080)]
+MOTION_IMAGE_PERCENTS = [100, 50, 25]
+CROP_FULL = 'full'
+CROP_CENTER = 'center'
+CROPS = [CROP_FULL, CROP_CENTER]
+# distinct synthetic frames, replayed in a loop; motion during [6, 12)
+SYNTHETIC_FRAME_COUNT = 16
+SYNTHETIC_MOTION_FRAMES = [[6, 12]]
+WARMUP_FRAMES = 5
+DEFAULT_FRAME_COUNT = 100
+DEFAULT_IMAGE_COUNT = 40
+DEFAULT_TOLERANCE_PERCENT = 10
+# allocation changes below this are noise, whatever the percentage
+MIN_ALLOCATION_CHANGE_MB = 0.5
+BYTES_PER_MB = 1024 * 1024
+
+# (metric path, True if higher is better)
+COMPARED_METRICS = [('fps', True), ('latency_ms.p50', False), ('latency_ms.p95', False),
+                    ('peak_allocated_mb', False)]
+
+
+class MockPiCamera:
+    """
+    stands in for picamera.PiCamera: settings are accepted as plain attributes,
+    and capture() copies the next synthetic frame into the output buffer
+    """
+
+    def __init__(self, frames: Optional[List[Any]] = None):
+        self.frames: List[Any] = frames if frames is not None else []
+        self.frame_index: int = 0
+        self.awb_gains: Tuple[Fraction, Fraction] = (Fraction(1), Fraction(1))
+        self.exposure_speed: int = 0
+
+    def capture(self, output: Any, format: str = 'bgr', use_video_port: bool = False) -> None:
+        frame = self.frames[self.frame_index % len(self.frames)]
+        self.frame_index += 1
+        output[:frame.shape[0], :frame.shape[1]] = frame
+
+    def close(self) -> None:
+        pass
+
+
+def install_picamera_mock() -> None:
+    """
+    benchmarks always use the mock, so results don't depend on camera hardware
+    """
+    picamera_module = types.ModuleType('picamera')
+    picamera_module.PiCamera = MockPiCamera
+    picamera_module.Color = lambda color: color
+    sys.modules['picamera'] = picamera_module
+
+
+class BenchmarkSuite:
+    """
+    capture-to-save pipeline (Camera with a mocked PiCamera) and offline utilities (MotionProcessor,
+    VideoProcessor), driven by deterministic synthetic frames
+    each scenario runs twice: timed, then traced with tracemalloc, since tracing slows everything down
+    """
+
+    def __init__(self, frame_count: int = DEFAULT_FRAME_COUNT, image_count: int = DEFAULT_IMAGE_COUNT,
+                 resolutions: Optional[List[Tuple[int, int]]] = None, scenario_filter: str = ''):
+        self.frame_count: int = max(WARMUP_FRAMES + 1, frame_count)
+        self.image_count: int = max(2, image_count)
+        self.resolutions: List[Tuple[int, int]] = resolutions if resolutions is not None else RESOLUTIONS
+        self.scenario_filter: str = scenario_filter
+
+    def run(self) -> Dict[str, Any]:
+        install_picamera_mock()
+        scenarios: Dict[str, Any] = {}
+
+        for resolution in self.resolutions:
+            frames = get_synthetic_frames(resolution)
+
+            for motion_image_percent in MOTION_IMAGE_PERCENTS:
+                for crop in CROPS:
+                    name = f'camera/{resolution[0]}x{resolution[1]}/motion{motion_image_percent}/{crop}'
+                    self._run_scenario(scenarios, name, lambda: self._run_camera_pipeline(
+                        frames, resolution, motion_image_percent, crop))
+
+            images_directory = tempfile.mkdtemp(prefix='camknows-benchmark-')
+            try:
+                image_paths = write_synthetic_images(images_directory, frames, self.image_count)
+
+                for scale, decode_strategy in [(1, 'full'), (4, 'reduced')]:
+                    name = f'motion_processor/{resolution[0]}x{resolution[1]}/scale{scale}-{decode_strategy}'
+                    self._run_scenario(scenarios, name, lambda: self._run_motion_processor(
+                        images_directory, scale, decode_strategy))
+
+                for video_format in ['mp4', 'avi']:
+                    name = f'video_processor/{resolution[0]}x{resolution[1]}/{video_format}'
+                    self._run_scenario(scenarios, name, lambda: self._run_video_processor(
+                        images_directory, image_paths, video_format))
+            finally:
+                shutil.rmtree(images_directory, ignore_errors=True)
+
+        return {
+            'version': RESULTS_VERSION,
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'frame_count': self.frame_count,
+            'image_count': self.image_count,
+            'scenarios': scenarios,
+        }
+
+    def _run_scenario(self, scenarios: Dict[str, Any], name: str,
+                      run: Callable[[], Tuple[List[float], float]]) -> None:
+        if self.scenario_filter not in name:
+            return
+
+        frame_seconds, total_seconds = run()
+
+        tracemalloc.start()
+        start_bytes, _ = tracemalloc.get_traced_memory()
+        run()
+        end_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        scenarios[name] = get_scenario_result(frame_seconds, total_seconds, peak_bytes - start_bytes,
+                                              end_bytes - start_bytes)
+        result = scenarios[name]
+        print(f'{name:<48}{result["fps"]:>9.1f} fps\tp50 {result["latency_ms"]["p50"]:0.3f} ms\t'
+              f'p95 {result["latency_ms"]["p95"]:0.3f} ms\tpeak allocated {result["peak_allocated_mb"]:0.2f} MB')
+
+    def _run_camera_pipeline(self, frames: List[Any], resolution: Tuple[int, int], motion_image_percent: float,
+                             crop: str) -> Tuple[List[float], float]:
+        """
+        capture, crop, motion check and saves through Camera._run_camera, one frame per call
+        """
+        from camera import Camera
+
+        main_directory = tempfile.mkdtemp(prefix='camknows-benchmark-')
+        camera = Camera(config=get_camera_config(main_directory, resolution, motion_image_percent, crop))
+        picamera = MockPiCamera(frames)
+        frame_seconds: List[float] = []
+
+        try:
+            camera.image_writer.start()
+            # warmup frames allocate buffers and save the first image
+            for _ in range(WARMUP_FRAMES):
+                camera._run_camera(picamera)
+
+            perf_start_time = time.perf_counter()
+            for _ in range(self.frame_count - WARMUP_FRAMES):
+                perf_frame_start_time = time.perf_counter()
+                camera._run_camera(picamera)
+                frame_seconds.append(time.perf_counter() - perf_frame_start_time)
+            # queued saves are part of the pipeline
+            camera.image_writer.stop()
+            total_seconds = time.perf_counter() - perf_start_time
+        finally:
+            camera.image_writer.stop()
+            for handler in list(camera.logger.handlers):
+                camera.logger.removeHandler(handler)
+                handler.close()
+            shutil.rmtree(main_directory, ignore_errors=True)
+
+        return frame_seconds, total_seconds
+
+    @staticmethod
+    def _run_motion_processor(images_directory: str, scale: int,
+                              decode_strategy: str) -> Tuple[List[float], float]:
+        """
+        one chunk on one worker; MotionProcessor only reports a total, so frame times are the mean
+        """
+        from motion_processor import OUTPUT_DIRECTORY, MotionProcessor
+
+        image_count = len([file_name for file_name in os.listdir(images_directory) if file_name.endswith('.jpg')])
+        motion_processor = MotionProcessor(worker_count=1, scale=scale, decode_strategy=decode_strategy)
+
+        perf_start_time = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            motion_processor.detect_motion_from_images(images_directory, 'jpg')
+        total_seconds = time.perf_counter() - perf_start_time
+
+        shutil.rmtree(os.path.join(images_directory, OUTPUT_DIRECTORY), ignore_errors=True)
+        return [total_seconds / image_count] * image_count, total_seconds
+
+    @staticmethod
+    def _run_video_processor(images_directory: str, image_paths: List[str],
+                             video_format: str) -> Tuple[List[float], float]:
+        """
+        frame times are measured between reads of the lazy image path iterable, in write order
+        """
+        from video_processor import VideoProcessor
+
+        output_file = os.path.join(images_directory, f'benchmark.{video_format}')
+        frame_seconds: List[float] = []
+
+        perf_start_time = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            VideoProcessor().convert_to_video(timed_iterable(image_paths, frame_seconds), output_file,
+                                              video_format=video_format, frames_per_second=10)
+        total_seconds = time.perf_counter() - perf_start_time
+
+        for file_name in os.listdir(images_directory):
+            if file_name.startswith('benchmark'):
+                os.remove(os.path.join(images_directory, file_name))
+        return frame_seconds, total_seconds
+
+
+def get_synthetic_frames(resolution: Tuple[int, int]) -> List[Any]:
+    with SyntheticFrameSource(resolution, SYNTHETIC_FRAME_COUNT, SYNTHETIC_MOTION_FRAMES, max_speed=True) as source:
+        return list(source.frames())
+
+
+def write_synthetic_images(images_directory: str, frames: List[Any], image_count: int) -> List[str]:
+    """
+    jpeg files named like saved images, one second apart
+    """
+    start_time = datetime.datetime(2021, 7, 19, 8, 0, 0)
+    image_paths: List[str] = []
+
+    for image_index in range(image_count):
+        timestamp = start_time + datetime.timedelta(seconds=image_index)
+        image_path = os.path.join(images_directory, f'camknows-{timestamp.strftime("%Y-%m-%d-%H-%M-%S-%f")}.jpg')
+        cv2.imwrite(image_path, frames[image_index % len(frames)], [cv2.IMWRITE_JPEG_QUALITY, 95])
+        image_paths.append(image_path)
+
+    return image_paths
+
+
+def get_camera_config(main_directory: str, resolution: Tuple[int, int], motion_image_percent: float,
+                      crop: str) -> Dict[str, Any]:
+    """
+    camknows_config.json with background features that would add noise turned off
+    """
+    with open(os.path.join(SCRIPT_DIRECTORY, 'camknows_config.json')) as json_file:
+        config = json.load(json_file)
+
+    width, height = resolution
+    crop_dimensions = [0, 0, 0, 0]
+    if crop == CROP_CENTER:
+        crop_dimensions = [width // 4 + 1, width * 3 // 4, height // 4 + 1, height * 3 // 4]
+    cropped_pixels = (width * height) / (4 if crop == CROP_CENTER else 1)
+
+    config.update({
+        'main_directory': main_directory,
+        'logger_level': 'ERROR',
+        'resolution_width': width,
+        'resolution_height': height,
+        'motion_image_percent': motion_image_percent,
+        'crop_dimensions': crop_dimensions,
+        # the default threshold is for 1024x768 at 100%; scaled, so the same frames are detected as motion
+        'diff_threshold': int(2000000 * cropped_pixels * (motion_image_percent / 100.0) ** 2 / (1024 * 768)),
+        'do_loop': False,
+        'wait_time': 0,
+        'awb_delay': 0,
+        'show_image_timestamp': False,
+        'capture_mode': 'single',
+        'capture_format': 'bgr',
+        'time_lapse_seconds': 0,
+        'frame_source': 'picamera',
+        'enable_metrics': False,
+        'enable_media_catalog': False,
+        'enable_clip_recording': False,
+        'retention_max_gb': 0,
+        'retention_min_free_gb': 0,
+        'retention_max_age_days': 0,
+        'state_snapshot_seconds': 0,
+        'adaptive_idle_fps': 0,
+        'adaptive_burst_fps': 0,
+        'max_duty_cycle': 1,
+    })
+    return config
+
+
+def timed_iterable(items: Iterable[Any], item_seconds: List[float]) -> Iterator[Any]:
+    """
+    yield items, appending the seconds between consecutive requests to item_seconds
+    with read-ahead consumers, this is the steady state time per item
+    """
+    perf_last_time = time.perf_counter()
+    for item in items:
+        yield item
+        perf_time = time.perf_counter()
+        item_seconds.append(perf_time - perf_last_time)
+        perf_last_time = perf_time
+
+
+def get_scenario_result(frame_seconds: List[float], total_seconds: float, peak_allocated_bytes: int,
+                        retained_bytes: int) -> Dict[str, Any]:
+    frame_milliseconds = np.array(frame_seconds) * 1000 if frame_seconds else np.zeros(1)
+
+    return {
+        'frames': len(frame_seconds),
+        'seconds': round(total_seconds, 4),
+        'fps': round(len(frame_seconds) / max(total_seconds, 1e-9), 2),
+        'latency_ms': {
+            'mean': round(float(np.mean(frame_milliseconds)), 3),
+            'p50': round(float(np.percentile(frame_milliseconds, 50)), 3),
+            'p90': round(float(np.percentile(frame_milliseconds, 90)), 3),
+            'p95': round(float(np.percentile(frame_milliseconds, 95)), 3),
+            'p99': round(float(np.percentile(frame_milliseconds, 99)), 3),
+            'max': round(float(np.max(frame_milliseconds)), 3),
+        },
+        'peak_allocated_mb': round(peak_allocated_bytes / BYTES_PER_MB, 3),
+        'retained_allocated_mb': round(retained_bytes / BYTES_PER_MB, 3),
+        # ru_maxrss is reported in kilobytes on linux; the process peak so far, not per scenario
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def compare_results(baseline: Dict[str, Any], results: Dict[str, Any],
+                    tolerance_percent: float) -> List[str]:
+    """
+    print the change of each compared metric; returns the regressions beyond tolerance_percent
+    """
+    regressions: List[str] = []
+
+    print(f'{"SCENARIO":<48}{"METRIC":<24}{"BASELINE":<16}{"RESULT":<16}CHANGE')
+    for name, result in sorted(results['scenarios'].items()):
+        baseline_result = baseline['scenarios'].get(name)
+        if baseline_result is None:
+            print(f'{name:<48}(not in baseline)')
+            continue
+
+        for metric, higher_is_better in COMPARED_METRICS:
+            baseline_value = _get_metric(baseline_result, metric)
+            value = _get_metric(result, metric)
+            if baseline_value is None or value is None or baseline_value == 0:
+                continue
+
+            change_percent = (value - baseline_value) / baseline_value * 100
+            worse_percent = -change_percent if higher_is_better else change_percent
+            is_regression = worse_percent > tolerance_percent
+            if metric == 'peak_allocated_mb' and abs(value - baseline_value) < MIN_ALLOCATION_CHANGE_MB:
+                is_regression = False
+
+            print(f'{name:<48}{metric:<24}{baseline_value:<16g}{value:<16g}{change_percent:+0.1f}%'
+                  f'{" REGRESSION" if is_regression else ""}')
+            if is_regression:
+                regressions.append(f'{name} {metric}: {baseline_value:g} -> {value:g} ({change_percent:+0.1f}%)')
+
+    for name in sorted(set(baseline['scenarios']) - set(results['scenarios'])):
+        print(f'{name:<48}(not in results)')
+
+    return regressions
+
+
+def _get_metric(result: Dict[str, Any], metric: str) -> Optional[float]:
+    value: Any = result
+    for key in metric.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return float(value)
+
+
+def parse_resolutions(value: str) -> List[Tuple[int, int]]:
+    """
+    ex: 640x480,1024x768; raises ValueError for invalid values
+    """
+    resolutions: List[Tuple[int, int]] = []
+    for resolution in value.split(','):
+        width, height = resolution.lower().split('x')
+        resolutions.append((int(width), int(height)))
+    return resolutions
+
+
+def print_usage() -> None:
+    print('Usage:')
+    print('  python3 benchmark_suite.py run [results.json] [--frames N] [--images N] '
+          '[--resolutions 640x480,1024x768] [--filter camera/]')
+    print('  python3 benchmark_suite.py compare baseline.json results.json [--tolerance PERCENT]')
+
+
+def parse_options(args: List[str]) -> Tuple[List[str], Dict[str, str]]:
+    positional_args: List[str] = []
+    options: Dict[str, str] = {}
+
+    arg_index = 0
+    while arg_index < len(args):
+        if args[arg_index].startswith('--'):
+            if arg_index + 1 >= len(args):
+                raise ValueError(f'Missing value for {args[arg_index]}')
+            options[args[arg_index][2:]] = args[arg_index + 1]
+            arg_index += 2
+        else:
+            positional_args.append(args[arg_index])
+            arg_index += 1
+
+    return positional_args, options
+
+
+def main() -> None:
+    if len(sys.argv) < 2 or sys.argv[1] not in ['run', 'compare']:
+        print_usage()
+        sys.exit(2)
+
+    # utilities import their siblings directly
+    sys.path.insert(0, os.path.join(SCRIPT_DIRECTORY, 'utilities'))
+
+    try:
+        positional_args, options = parse_options(sys.argv[2:])
+        if sys.argv[1] == 'run':
+            output_path = positional_args[0] if positional_args else 'benchmark_results.json'
+            suite = BenchmarkSuite(frame_count=int(options.get('frames', DEFAULT_FRAME_COUNT)),
+                                   image_count=int(options.get('images', DEFAULT_IMAGE_COUNT)),
+                                   resolutions=(parse_resolutions(options['resolutions'])
+                                                if 'resolutions' in options else None),
+                                   scenario_filter=options.get('filter', ''))
+            results = suite.run()
+            with open(output_path, 'w') as results_file:
+                json.dump(results, results_file, indent=2)
+            print(f'Results written to {output_path}')
+            return
+
+        if len(positional_args) != 2:
+            raise ValueError('compare requires a baseline file and a results file')
+        tolerance_percent = float(options.get('tolerance', DEFAULT_TOLERANCE_PERCENT))
+    except ValueError as error:
+        print(error)
+        print_usage()
+        sys.exit(2)
+
+    with open(positional_args[0]) as baseline_file:
+        baseline = json.load(baseline_file)
+    with open(positional_args[1]) as results_file:
+        results = json.load(results_file)
+
+    regressions = compare_results(baseline, results, tolerance_percent)
+    if regressions:
+        print(f'{len(regressions)} regression(s) beyond {tolerance_percent:g}%:')
+        for regression in regressions:
+            print(f'  {regression}')
+        sys.exit(1)
+    print(f'No regressions beyond {tolerance_percent:g}%')
+
+
+if __name__ == '__main__':
+    main()
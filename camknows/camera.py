@@ -2,38 +2,108 @@ import datetime
 import json
 import logging
 import os
+import resource
+import sys
 import time
 import traceback
 import uuid
 from fractions import Fraction
 from logging.handlers import TimedRotatingFileHandler
-from threading import Thread
 from time import sleep
-from typing import Any, List
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-import cv2
-import imutils
 import numpy as np
-import picamera
+
+from analysis_pipeline import AnalysisPipeline, AnalysisResult
+from capture_scheduler import SCHEDULER_STATE_VALUES, CaptureScheduler
+from clip_recorder import ClipRecorder
+from config_watcher import ConfigWatcher
+from frame_sources import (FrameSource, PiCameraFrameSource, YuvFrame, create_frame_source, get_capture_array_size,
+                           get_yuv_capture_size)
+from image_writer import ImageWriter
+from metrics import STAGE_CAPTURE, STAGE_CROP, STAGE_DIFF, STAGE_PREPROCESS, Metrics
+from motion_detector import MotionDetector
+from retention_manager import BYTES_PER_GB, RetentionManager
+from state_snapshot import load_state_snapshot, save_state_snapshot
+
+# utilities import their siblings directly, so they are imported from the utilities directory
+# under the same top-level names
+UTILITIES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utilities')
+if UTILITIES_DIRECTORY not in sys.path:
+    sys.path.insert(0, UTILITIES_DIRECTORY)
+
+from duplicate_filter import DuplicateFilter, get_image_hash
+from media_catalog import (CATALOG_FILE_NAME, THUMBNAIL_DIRECTORY, TRIGGER_FIRST_IMAGE, TRIGGER_MOTION,
+                           TRIGGER_TIME_LAPSE, MediaCatalog)
 
 CONFIG_FILE = 'camknows_config.json'
 LOG_FILE = 'camknows.log'
 LOG_FILE_SUFFIX = '%Y%m%d'
 REPEAT_ERROR_LIMIT = 5
+CAPTURE_MODE_SINGLE = 'single'
+CAPTURE_MODE_CONTINUOUS = 'continuous'
+CAPTURE_FORMAT_BGR = 'bgr'
+CAPTURE_FORMAT_YUV = 'yuv'
+# camera settings that can't change while continuous capture is streaming
+STREAM_RESTART_SETTINGS = ['resolution', 'framerate_range']
+# config used to create long-lived components; a changed value is ignored until restart
+RESTART_CONFIG_PREFIXES = ('main_directory', 'capture_mode', 'capture_format', 'frame_buffer_count', 'frame_source',
+                           'synthetic_', 'image_writer_', 'jpeg_', 'enable_metrics', 'metrics_', 'enable_media_catalog',
+                           'media_catalog_', 'retention_', 'enable_clip_recording', 'clip_', 'config_reload_seconds',
+                           'analysis_', 'enable_duplicate_filter', 'duplicate_filter_',
+                           'enable_thumbnails', 'thumbnail_', 'enable_manual_mode')
+# config read without a default; a reloaded config missing one of these is not applied
+REQUIRED_CONFIG_KEYS = ['awb_delay', 'diff_score_in_filename', 'diff_threshold', 'do_loop', 'enable_image_debugging',
+                        'enable_led', 'image_file_prefix', 'image_timestamp_text_size', 'logger_level',
+                        'print_camera_settings', 'resolution_height', 'resolution_width', 'rotation',
+                        'setup_timeout_seconds', 'show_image_timestamp', 'time_lapse_seconds',
+                        'timestamp_filename_format', 'timestamp_format', 'use_video_port', 'wait_time', 'zoom']
+MANUAL_MODE_CONFIG_KEYS = ['manual_awb_gains_blue', 'manual_awb_gains_red', 'manual_awb_mode',
+                           'manual_framerate_range_from', 'manual_framerate_range_to', 'manual_iso',
+                           'manual_shutter_speed']
+MOTION_CONFIG_KEYS = ['diff_threshold', 'motion_image_percent', 'motion_grid', 'motion_masks', 'motion_cell_threshold',
+                      'motion_cell_thresholds', 'coarse_pyramid_levels', 'coarse_escalation_band', 'crop_dimensions',
+                      'resolution_width', 'resolution_height']
+SCHEDULER_CONFIG_KEYS = ['wait_time', 'target_fps', 'max_duty_cycle', 'diff_threshold']
 
 
 class Camera:
 
-    def __init__(self):
+    def __init__(self, process_start_time: Optional[float] = None, config: Optional[Dict[str, Any]] = None):
+        """
+        process_start_time: perf_counter() at startup, before imports, for the time to first frame
+        config: settings to use instead of camknows_config.json (ex: benchmarks); not reloaded
+        """
+        self.process_start_time: float = process_start_time if process_start_time is not None else time.perf_counter()
         self.script_directory = os.path.dirname(os.path.abspath(__file__))
         self.logger = self._setup_logger()  # setup asap to log errors asap
 
-        with open(os.path.join(self.script_directory, CONFIG_FILE)) as json_file:
-            self.config = json.load(json_file)
+        if config is not None:
+            self.config = config
+        else:
+            with open(os.path.join(self.script_directory, CONFIG_FILE)) as json_file:
+                self.config = json.load(json_file)
 
         self.logger.setLevel(self.config['logger_level'])
-        self.last_image_time: float
+        self.last_image_time: float = 0  # 0 until the first image is saved
         self.last_setup_time: float = 0
+        # camera settings as last applied, so setup only reapplies changed settings
+        self.applied_camera_settings: Dict[str, Any] = {}
+        # frames are not checked for motion until this time, while camera settings settle (awb_delay)
+        self.quarantine_end_time: float = 0
+        # the next checked frame becomes the motion baseline instead of being compared
+        self.rebaseline_pending: bool = False
+        state_snapshot_path = self.config.get('state_snapshot_path', 'state/camknows_state.json')
+        self.state_snapshot_path: str = os.path.join(self.script_directory, state_snapshot_path)
+        self.state_snapshot_seconds: float = self.config.get('state_snapshot_seconds', 60)
+        self.last_state_snapshot_time: float = time.time()
+        # camera settings from a fresh snapshot, until the first setup
+        self.warm_camera_settings: Optional[Dict[str, str]] = None
+        self.camera: Any = None  # PiCamera, when capturing from camera hardware
+        self.time_to_first_frame: float = 0
+        self.config_watcher = ConfigWatcher(os.path.join(self.script_directory, CONFIG_FILE),
+                                            check_seconds=(self.config.get('config_reload_seconds', 2)
+                                                           if config is None else 0), log=self._log)
         self.previous_processed_image: Any = None
         self.diff_threshold: int = self.config['diff_threshold']
         self.resolution_width: int = self.config['resolution_width']
@@ -43,6 +113,126 @@ class Camera:
         self.motion_frames_threshold: int = self.config.get('motion_frames_threshold', 2)
         self.motion_image_percent: float = self.config.get('motion_image_percent', 100)
         self.crop_dimensions: List[int] = self.config.get('crop_dimensions', [0, 0, 0, 0])
+        self.motion_detector = self._create_motion_detector()
+        self.capture_buffer: Any = None
+        self.media_catalog: Optional[MediaCatalog] = None
+        if self.config.get('enable_media_catalog', True):
+            self.media_catalog = MediaCatalog(
+                os.path.join(self.script_directory, self.config['main_directory'], CATALOG_FILE_NAME),
+                batch_size=self.config.get('media_catalog_batch_size', 50),
+                flush_seconds=self.config.get('media_catalog_flush_seconds', 5),
+                log=self._log)
+        self.retention_manager = RetentionManager(
+            os.path.join(self.script_directory, self.config['main_directory']),
+            max_bytes=int(self.config.get('retention_max_gb', 0) * BYTES_PER_GB),
+            min_free_bytes=int(self.config.get('retention_min_free_gb', 0) * BYTES_PER_GB),
+            max_age_days=self.config.get('retention_max_age_days', 0),
+            check_seconds=self.config.get('retention_check_seconds', 300),
+            log=self._log,
+            deleted_callback=self.media_catalog.remove_directory if self.media_catalog is not None else None)
+        self.clip_recorder: Optional[ClipRecorder] = None
+        if self.config.get('enable_clip_recording', False):
+            self.clip_recorder = ClipRecorder(
+                memory_budget_bytes=int(self.config.get('clip_memory_budget_mb', 32) * 1024 * 1024),
+                pre_roll_seconds=self.config.get('clip_pre_roll_seconds', 5),
+                post_roll_seconds=self.config.get('clip_post_roll_seconds', 3),
+                max_clip_frames=self.config.get('clip_max_frames', 900),
+                scale_percent=self.config.get('clip_scale_percent', 50),
+                buffer_format=self.config.get('clip_buffer_format', 'jpeg'),
+                jpeg_quality=self.config.get('clip_jpeg_quality', 80),
+                clip_format=self.config.get('clip_format', 'avi'),
+                log=self._log, written_callback=self.retention_manager.add_file)
+        metrics_textfile_path = self.config.get('metrics_textfile_path', '')
+        self.metrics = Metrics(enabled=self.config.get('enable_metrics', False),
+                               textfile_path=(os.path.join(self.script_directory, metrics_textfile_path)
+                                              if metrics_textfile_path != '' else ''),
+                               export_seconds=self.config.get('metrics_export_seconds', 15),
+                               http_host=self.config.get('metrics_http_host', '127.0.0.1'),
+                               http_port=self.config.get('metrics_http_port', 0),
+                               log=self._log)
+        self.image_writer = ImageWriter(worker_count=self.config.get('image_writer_workers', 2),
+                                        queue_size=self.config.get('image_writer_queue_size', 8),
+                                        overflow_policy=self.config.get('image_writer_overflow_policy', 'block'),
+                                        jpeg_quality=self.config.get('jpeg_quality', 95),
+                                        jpeg_optimize=self.config.get('jpeg_optimize', False),
+                                        jpeg_progressive=self.config.get('jpeg_progressive', False),
+                                        thumbnail_width=self.config.get('thumbnail_width', 320),
+                                        thumbnail_jpeg_quality=self.config.get('thumbnail_jpeg_quality', 80),
+                                        log=self._log, metrics=self.metrics,
+                                        written_callback=self._on_image_written,
+                                        directory_callback=self.retention_manager.recreate_directory)
+        self.image_writer_stats_seconds: int = self.config.get('image_writer_stats_seconds', 0)
+        self.duplicate_filter: Optional[DuplicateFilter] = None
+        if self.config.get('enable_duplicate_filter', False):
+            self.duplicate_filter = DuplicateFilter(
+                max_distance=self.config.get('duplicate_filter_distance', 4),
+                window_seconds=self.config.get('duplicate_filter_window_seconds', 30),
+                cache_size=self.config.get('duplicate_filter_cache_size', 16),
+                keep_every=self.config.get('duplicate_filter_keep_every', 0))
+        self.last_writer_stats_time: float = time.time()
+        self.last_writer_error_count: int = 0
+        self.capture_mode: str = self.config.get('capture_mode', CAPTURE_MODE_SINGLE)
+        self.capture_format: str = self.config.get('capture_format', CAPTURE_FORMAT_BGR)
+        self.target_fps: float = self.config.get('target_fps', 0)
+        self.frame_buffer_count: int = max(1, self.config.get('frame_buffer_count', 2))
+        self.fps_report_seconds: int = self.config.get('fps_report_seconds', 60)
+        self.achieved_fps: float = 0
+        self.fps_start_time: float = time.perf_counter()
+        self.fps_frame_count: int = 0
+        # diff score of the last checked frame, for the capture scheduler; None after errors and first images
+        self.last_diff_score: Optional[int] = None
+        self.capture_scheduler = self._create_capture_scheduler()
+        self.analysis_pipeline: Optional[AnalysisPipeline] = None
+        if self.config.get('analysis_workers', 0) > 0:
+            if self.capture_format == CAPTURE_FORMAT_YUV:
+                self._log('Analysis workers require capture_format bgr; motion checks run in-process',
+                          logging.WARNING)
+            else:
+                self.analysis_pipeline = AnalysisPipeline(worker_count=self.config['analysis_workers'],
+                                                          slot_count=self.config.get('analysis_slot_count', 8),
+                                                          detector_settings=self._get_motion_detector_settings(),
+                                                          log=self._log)
+        self.metrics.add_gauge('consecutive_errors', lambda: self.error_count)
+        self.metrics.add_gauge('achieved_fps', lambda: self.achieved_fps)
+        self.metrics.add_gauge('image_writer_queue_depth', lambda: self.image_writer.get_stats()['queue_depth'])
+        self.metrics.add_gauge('scheduler_state', lambda: SCHEDULER_STATE_VALUES[self.capture_scheduler.state])
+        self.metrics.add_gauge('scheduler_fps', lambda: self.capture_scheduler.effective_fps)
+        self.metrics.add_gauge('time_to_first_frame_seconds', lambda: self.time_to_first_frame)
+
+        self._log(f'Startup: {time.perf_counter() - self.process_start_time:0.2f} seconds to load', logging.INFO)
+
+    def _create_motion_detector(self) -> MotionDetector:
+        return MotionDetector(**self._get_motion_detector_settings())
+
+    def _get_motion_detector_settings(self) -> Dict[str, Any]:
+        # keyword arguments for MotionDetector; also sent to analysis workers
+        return dict(motion_image_percent=self.motion_image_percent,
+                    grid=self.config.get('motion_grid', [0, 0]),
+                    masks=self.config.get('motion_masks', []),
+                    cell_threshold=self.config.get('motion_cell_threshold', 0),
+                    cell_thresholds=self.config.get('motion_cell_thresholds'),
+                    diff_threshold=self.diff_threshold,
+                    pyramid_levels=self.config.get('coarse_pyramid_levels', 0),
+                    escalation_band=self.config.get('coarse_escalation_band', [0.5, 0]))
+
+    def _create_capture_scheduler(self) -> CaptureScheduler:
+        if self.capture_mode == CAPTURE_MODE_CONTINUOUS:
+            normal_interval = 1.0 / self.target_fps if self.target_fps > 0 else 0
+        else:
+            normal_interval = self.config['wait_time']
+        return CaptureScheduler(
+            normal_interval=normal_interval,
+            idle_fps=self.config.get('adaptive_idle_fps', 0),
+            quiet_seconds=self.config.get('adaptive_quiet_seconds', 60),
+            burst_fps=self.config.get('adaptive_burst_fps', 0),
+            # 0: any diff score over diff_threshold is activity
+            pre_alert_threshold=self.config.get('adaptive_pre_alert_threshold', 0) or self.diff_threshold + 1,
+            burst_hold_seconds=self.config.get('adaptive_burst_hold_seconds', 5),
+            decay_seconds=self.config.get('adaptive_decay_seconds', 10),
+            max_duty_cycle=self.config.get('max_duty_cycle', 1),
+            # wait_time is a delay after each frame
+            wait_after_frame=self.capture_mode != CAPTURE_MODE_CONTINUOUS,
+            log=self._log)
 
     def _setup_logger(self) -> Any:
         logs_directory = os.path.join(self.script_directory, "logs")
@@ -58,75 +248,439 @@ class Camera:
 
         return logger
 
-    def start_camera_loop(self) -> None:
+    def start_camera_loop(self, frame_source: Optional[FrameSource] = None) -> None:
+        """
+        run motion detection on frames from the configured frame source (PiCamera by default),
+        or from frame_source if given
+        """
+        if frame_source is None:
+            frame_source = create_frame_source(self.config, self.script_directory)
+
+        self.image_writer.start()
+        self.metrics.start()
+        if self.media_catalog is not None:
+            self.media_catalog.start()
+        self.retention_manager.start()
+
+        try:
+            if isinstance(frame_source, PiCameraFrameSource):
+                # snapshots are only for camera hardware: frame sources replay unrelated frames
+                self._restore_state_snapshot()
+            frame_source.open()
+            if isinstance(frame_source, PiCameraFrameSource):
+                self.camera = frame_source.camera
+                self._run_camera_loop(frame_source.camera)
+            else:
+                self._run_frame_source(frame_source)
+        except Exception:
+            self._log(traceback.format_exc(), logging.ERROR)
+        finally:
+            self._stop_analysis_pipeline()
+            if self.camera is not None:
+                self._save_state_snapshot()
+            frame_source.close()
+            self._log('Camera Closed')
+            if self.clip_recorder is not None:
+                self.clip_recorder.stop()
+            self.image_writer.stop()
+            self.image_writer.log_stats()
+            self._log('Image Writer Stopped')
+            self.retention_manager.stop()
+            if self.media_catalog is not None:
+                self.media_catalog.stop()
+            self.metrics.stop()
+
+    def _run_camera_loop(self, camera: Any) -> None:
 
         do_loop = self.config['do_loop']
 
-        with picamera.PiCamera() as camera:
+        while True:
+            if self.capture_mode == CAPTURE_MODE_CONTINUOUS:
+                self._run_camera_continuous(camera)
+            else:
+                self._run_camera(camera)
+            self._log_image_writer_stats()
+
+            if not do_loop:
+                break
+            if self.error_count >= REPEAT_ERROR_LIMIT:
+                self._log(f"EXITING PROGRAM due to {REPEAT_ERROR_LIMIT} consecutive errors",
+                          logging.ERROR)
+                break
+
+    def _run_frame_source(self, frame_source: FrameSource) -> None:
+        """
+        run motion detection without camera hardware: video files, USB cameras, saved images or synthetic frames
+        """
+        self._log(f'Start frame source: {type(frame_source).__name__}, max speed {frame_source.max_speed}',
+                  logging.INFO)
+        perf_start_time = time.perf_counter()
+
+        for frame in frame_source.frames():
+            timestamp_filename = datetime.datetime.now().strftime(self.config['timestamp_filename_format'])
 
             try:
-                while True:
-                    self._run_camera(camera)
-
-                    if not do_loop:
-                        break
-                    if self.error_count >= REPEAT_ERROR_LIMIT:
-                        self._log(f"EXITING PROGRAM due to {REPEAT_ERROR_LIMIT} consecutive errors",
-                                  logging.ERROR)
-                        break
+                self._reload_config()
+                perf_crop_start_time = time.perf_counter()
+                image_array = self._crop_image(frame)
+                self.metrics.observe(STAGE_CROP, time.perf_counter() - perf_crop_start_time)
+                self._check_for_motion(image_array, timestamp_filename)
+                self._check_image_writer_errors()
+                self.error_count = 0
             except Exception:
                 self._log(traceback.format_exc(), logging.ERROR)
-            finally:
-                camera.close()
-                self._log('Camera Closed')
+                self.error_count += 1
+                self.metrics.inc('errors')
+
+            self._count_frame_for_fps()
+            self._save_state_snapshot_if_due()
+            self._log_image_writer_stats()
+
+            if not self.config['do_loop']:
+                break
+            if self.error_count >= REPEAT_ERROR_LIMIT:
+                self._log(f"EXITING PROGRAM due to {REPEAT_ERROR_LIMIT} consecutive errors",
+                          logging.ERROR)
+                break
+
+        elapsed_seconds = time.perf_counter() - perf_start_time
+        self._log(f'Frame source complete: {frame_source.frame_count} frames in {elapsed_seconds:0.2f} seconds '
+                  f'({frame_source.frame_count / max(elapsed_seconds, 1e-9):0.2f} fps)', logging.INFO)
+
+    def _count_frame_for_fps(self) -> None:
+
+        self.fps_frame_count += 1
+        fps_elapsed_seconds = time.perf_counter() - self.fps_start_time
+
+        if fps_elapsed_seconds >= self.fps_report_seconds:
+            self.achieved_fps = self.fps_frame_count / fps_elapsed_seconds
+            # ru_maxrss is reported in kilobytes on linux
+            peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            self._log(f'Achieved fps: {self.achieved_fps:0.2f}, motion check avg/max '
+                      f'{self.motion_detector.get_seconds_average():0.4f}/{self.motion_detector.seconds_max:0.4f}s, '
+                      f'coarse early exits {self.motion_detector.early_exit_count} of '
+                      f'{self.motion_detector.early_exit_count + self.motion_detector.escalated_count}, '
+                      f'peak RSS {peak_rss_mb:0.1f} MB, scheduler {self.capture_scheduler.state} '
+                      f'{self.capture_scheduler.effective_fps:0.2f} fps', logging.INFO)
+            self.fps_start_time = time.perf_counter()
+            self.fps_frame_count = 0
+
+    def _save_state_snapshot_if_due(self) -> None:
+
+        if (self.camera is None or self.state_snapshot_seconds <= 0
+                or time.time() - self.last_state_snapshot_time < self.state_snapshot_seconds):
+            return
+
+        self._save_state_snapshot()
+        self.last_state_snapshot_time = time.time()
+
+    def _save_state_snapshot(self) -> None:
+        """
+        persist what a restart needs to continue where this run left off (see _restore_state_snapshot)
+        """
+        if self.state_snapshot_seconds <= 0:
+            return
+
+        state: Dict[str, Any] = {
+            'last_image_time': self.last_image_time,
+            'motion_frame_count': self.motion_frame_count,
+            'image_shape': (list(self.motion_detector.image_shape)
+                            if self.previous_processed_image is not None else None),
+            'camera_settings': self._serialize_camera_settings(self.applied_camera_settings),
+        }
+        try:
+            # actual values chosen by the camera, for troubleshooting
+            state['awb_gains'] = [float(gain) for gain in self.camera.awb_gains]
+            state['exposure_speed'] = self.camera.exposure_speed
+        except Exception:
+            pass
+
+        try:
+            save_state_snapshot(self.state_snapshot_path, state, self.previous_processed_image)
+        except Exception:
+            self._log(traceback.format_exc(), logging.ERROR)
+
+    def _restore_state_snapshot(self) -> None:
+        """
+        warm restart: with a snapshot no older than state_snapshot_max_age_seconds, continue from the last
+        motion frame (no first image is saved), and skip the AWB delay if manual camera settings are unchanged
+        """
+        if self.state_snapshot_seconds <= 0:
+            return
+
+        try:
+            snapshot = load_state_snapshot(self.state_snapshot_path,
+                                           self.config.get('state_snapshot_max_age_seconds', 300))
+        except Exception:
+            self._log(traceback.format_exc(), logging.ERROR)
+            return
+        if snapshot is None:
+            return
+
+        state, motion_image = snapshot
+        self.last_image_time = state.get('last_image_time', 0)
+        self.motion_frame_count = state.get('motion_frame_count', 0)
+        self.warm_camera_settings = state.get('camera_settings')
+
+        baseline_restored = False
+        if motion_image is not None and state.get('image_shape') is not None:
+            baseline_restored = self.motion_detector.restore_previous_image(tuple(state['image_shape']), motion_image)
+            if baseline_restored:
+                self.previous_processed_image = self.motion_detector.previous_image
+
+        self._log(f'Warm restart: state from {time.time() - state["saved_time"]:0.0f} seconds ago restored, '
+                  f'motion baseline {"restored" if baseline_restored else "not restored"}', logging.INFO)
+
+    @staticmethod
+    def _serialize_camera_settings(settings: Dict[str, Any]) -> Dict[str, str]:
+        # repr keeps tuples and fractions comparable after a json round trip
+        return {name: repr(value) for name, value in settings.items()}
+
+    def _check_image_writer_errors(self) -> None:
+        """
+        images are written in background threads; failed writes count as errors of the camera loop, so repeated
+        failures end the process like other errors
+        """
+        writer_error_count = self.image_writer.error_count
+        if writer_error_count > self.last_writer_error_count:
+            new_error_count = writer_error_count - self.last_writer_error_count
+            self.last_writer_error_count = writer_error_count
+            raise RuntimeError(f'{new_error_count} image writer errors')
+
+    def _log_image_writer_stats(self) -> None:
+
+        if (self.image_writer_stats_seconds == 0
+                or time.time() - self.last_writer_stats_time < self.image_writer_stats_seconds):
+            return
+
+        self.image_writer.log_stats()
+        self.last_writer_stats_time = time.time()
 
     def _run_camera(self, camera: Any) -> None:
 
+        self.capture_scheduler.start_frame()
         try:
+            self._reload_config()
             self._setup_camera(camera)
             self._capture_image_with_motion_detection(camera)
+            self._count_frame_for_fps()
+            self._save_state_snapshot_if_due()
+            self._check_image_writer_errors()
 
             # successful run: reset error counter
             self.error_count = 0
         except Exception:
             self._log(traceback.format_exc(), logging.ERROR)
             self.error_count += 1
+            self.metrics.inc('errors')
+            self.last_diff_score = None
 
-        wait_time = self.config['wait_time']
-        self._log(f'sleeping for {wait_time} seconds')
+        wait_time = self.capture_scheduler.finish_frame(self.last_diff_score)
+        self._log(f'sleeping for {wait_time:0.3f} seconds ({self.capture_scheduler.state})')
         sleep(wait_time)
 
+    def _run_camera_continuous(self, camera: Any) -> None:
+        """
+        stream frames from the video port into reusable buffers until setup expires or the loop ends
+        """
+        try:
+            self._setup_camera(camera)
+            camera.capture_sequence(self._continuous_frame_buffers(camera), self.capture_format, use_video_port=True)
+        except Exception:
+            self._log(traceback.format_exc(), logging.ERROR)
+            self.error_count += 1
+            self.metrics.inc('errors')
+
+    def _continuous_frame_buffers(self, camera: Any) -> Iterator[Any]:
+        """
+        generator for capture_sequence: yields a preallocated buffer, which the camera fills before
+        the generator resumes, then checks the filled buffer for motion
+        """
+        frame_buffers = [self._allocate_capture_buffer(use_video_port=True) for _ in range(self.frame_buffer_count)]
+        buffer_index = 0
+
+        self._log(f'Start continuous capture: {len(frame_buffers)} buffers, target fps {self.target_fps}',
+                  logging.INFO)
+
+        while True:
+            self._reload_config()
+            if self._is_setup_due():
+                if any(name in STREAM_RESTART_SETTINGS for name in self._get_changed_camera_settings()):
+                    # end the sequence; start_camera_loop sets up the camera and streams again
+                    return
+                # other settings are applied between frames, without restarting the stream
+                self._setup_camera(camera)
+
+            frame_buffer = frame_buffers[buffer_index]
+            buffer_index = (buffer_index + 1) % len(frame_buffers)
+
+            self._annotate_image_timestamp(camera)
+            timestamp_filename = datetime.datetime.now().strftime(self.config['timestamp_filename_format'])
+
+            # the generator is suspended while the camera fills the buffer
+            self.capture_scheduler.start_frame()
+            perf_capture_start_time = time.perf_counter()
+            yield frame_buffer
+            self.metrics.observe(STAGE_CAPTURE, time.perf_counter() - perf_capture_start_time)
+
+            try:
+                perf_start_time = time.perf_counter()
+                image_array = self._get_captured_image(frame_buffer, use_video_port=True)
+                self.metrics.observe(STAGE_CROP, time.perf_counter() - perf_start_time)
+                self._check_for_motion(image_array, timestamp_filename)
+                self._check_image_writer_errors()
+                self.error_count = 0
+            except Exception:
+                self._log(traceback.format_exc(), logging.ERROR)
+                self.error_count += 1
+                self.metrics.inc('errors')
+                self.last_diff_score = None
+
+            self._count_frame_for_fps()
+            self._save_state_snapshot_if_due()
+
+            if not self.config['do_loop'] or self.error_count >= REPEAT_ERROR_LIMIT:
+                # end the sequence; start_camera_loop decides whether to stream again
+                return
+
+            # measured from this frame's start, so a slow frame doesn't make the next ones catch up
+            delay = self.capture_scheduler.finish_frame(self.last_diff_score)
+            if delay > 0:
+                sleep(delay)
+
+    def _is_setup_due(self) -> bool:
+        return (self.config['setup_timeout_seconds'] == 0
+                or time.time() - self.last_setup_time > self.config['setup_timeout_seconds'])
+
     def _setup_camera(self, camera: Any) -> None:
 
-        if (self.config['setup_timeout_seconds'] != 0
-                and time.time() - self.last_setup_time <= self.config['setup_timeout_seconds']):
+        if not self._is_setup_due():
             # setup timeout configured, and not expired; skip setup
             return
 
-        self._log('Setup PiCamera', logging.INFO)
-        camera.rotation = self.config['rotation']
-        camera.resolution = (self.resolution_width, self.resolution_height)
-        camera.zoom = self.config['zoom']
-        camera.led = self.config['enable_led']
+        self.last_setup_time = time.time()
+
+        changed_settings = self._get_changed_camera_settings()
+        if len(changed_settings) == 0:
+            return
+
+        self._log(f'Setup PiCamera: {", ".join(changed_settings)}', logging.INFO)
+        for name, value in changed_settings.items():
+            setattr(camera, name, value)
+            self.applied_camera_settings[name] = value
+
+        warm_camera_settings = self.warm_camera_settings
+        self.warm_camera_settings = None
+        if (self.config['enable_manual_mode']
+                and warm_camera_settings == self._serialize_camera_settings(self.applied_camera_settings)):
+            # warm restart with the same manual gains and exposure: the restored motion baseline still applies
+            self._log('Warm restart: camera settings unchanged, AWB Delay skipped', logging.INFO)
+        else:
+            # allow awb to catch up: frames keep being captured, but are not checked for motion
+            awb_delay = self.config['awb_delay']
+            self._log(f'AWB Delay for {awb_delay} seconds', logging.INFO)
+            self.quarantine_end_time = time.perf_counter() + awb_delay
+            self.rebaseline_pending = True
+
+        self._print_camera_settings(camera)
+
+    def _get_camera_settings(self) -> Dict[str, Any]:
+        """
+        PiCamera attribute values from the config, in the order they are applied
+        """
+        settings: Dict[str, Any] = {
+            'rotation': self.config['rotation'],
+            'resolution': (self.resolution_width, self.resolution_height),
+            'zoom': tuple(self.config['zoom']),
+            'led': self.config['enable_led'],
+        }
 
         if self.config['enable_manual_mode']:
             # useful for consistent images and low light settings
             # ex: framerate range (Fraction(1, 6), Fraction(30, 1)) allows for slower shutter speeds for low light
-            camera.shutter_speed = self.config['manual_shutter_speed']
-            camera.iso = self.config['manual_iso']
-            framerate_range_from = Fraction(self.config['manual_framerate_range_from'])
-            framerate_range_to = Fraction(self.config['manual_framerate_range_to'])
-            camera.framerate_range = (framerate_range_from, framerate_range_to)
-            camera.awb_mode = self.config['manual_awb_mode']
-            camera.awb_gains = (self.config['manual_awb_gains_red'], self.config['manual_awb_gains_blue'])
-
-        # allow awb to catch up
-        awb_delay = self.config['awb_delay']
-        self._log(f'AWB Delay for {awb_delay} seconds', logging.INFO)
-        sleep(awb_delay)
+            settings['shutter_speed'] = self.config['manual_shutter_speed']
+            settings['iso'] = self.config['manual_iso']
+            settings['framerate_range'] = (Fraction(self.config['manual_framerate_range_from']),
+                                           Fraction(self.config['manual_framerate_range_to']))
+            settings['awb_mode'] = self.config['manual_awb_mode']
+            settings['awb_gains'] = (self.config['manual_awb_gains_red'], self.config['manual_awb_gains_blue'])
 
-        self._print_camera_settings(camera)
-        self.last_setup_time = time.time()
+        return settings
+
+    def _get_changed_camera_settings(self) -> Dict[str, Any]:
+        return {name: value for name, value in self._get_camera_settings().items()
+                if name not in self.applied_camera_settings or self.applied_camera_settings[name] != value}
+
+    def _reload_config(self) -> None:
+        """
+        apply camknows_config.json changes without a restart; camera settings are applied by the next setup
+        """
+        config = self.config_watcher.poll()
+        if config is None:
+            return
+
+        changed_keys = sorted(key for key in set(config) | set(self.config) if config.get(key) != self.config.get(key))
+        if len(changed_keys) == 0:
+            return
+
+        restart_keys = [key for key in changed_keys if key.startswith(RESTART_CONFIG_PREFIXES)]
+        for key in restart_keys:
+            if key in self.config:
+                config[key] = self.config[key]
+            else:
+                del config[key]
+        if len(restart_keys) > 0:
+            self._log(f'Config changes require a restart: {", ".join(restart_keys)}', logging.WARNING)
+
+        missing_keys = self._get_missing_config_keys(config)
+        if len(missing_keys) > 0:
+            # keep running with the current config; the file is checked again when it changes
+            self._log(f'Config not reloaded, missing: {", ".join(missing_keys)}', logging.WARNING)
+            return
+
+        live_keys = [key for key in changed_keys if key not in restart_keys]
+        if len(live_keys) == 0:
+            return
+        self._log(f'Config reloaded: {", ".join(live_keys)}', logging.INFO)
+
+        motion_config_changed = any(key in MOTION_CONFIG_KEYS for key in live_keys)
+        if motion_config_changed:
+            # frames already queued are checked with the settings they were captured with
+            self._stop_analysis_pipeline()
+
+        self.config = config
+        self.logger.setLevel(self.config['logger_level'])
+        self.diff_threshold = self.config['diff_threshold']
+        self.motion_frames_threshold = self.config.get('motion_frames_threshold', 2)
+        self.motion_image_percent = self.config.get('motion_image_percent', 100)
+        self.crop_dimensions = self.config.get('crop_dimensions', [0, 0, 0, 0])
+        self.target_fps = self.config.get('target_fps', 0)
+        self.fps_report_seconds = self.config.get('fps_report_seconds', 60)
+        self.image_writer_stats_seconds = self.config.get('image_writer_stats_seconds', 0)
+
+        if motion_config_changed:
+            # images may change size: start from a new baseline instead of comparing to the old settings
+            self.motion_detector = self._create_motion_detector()
+            self.rebaseline_pending = True
+            if self.analysis_pipeline is not None:
+                self.analysis_pipeline.detector_settings = self._get_motion_detector_settings()
+        if any(key in SCHEDULER_CONFIG_KEYS or key.startswith('adaptive_') for key in live_keys):
+            self.capture_scheduler = self._create_capture_scheduler()
+        if 'resolution_width' in live_keys or 'resolution_height' in live_keys:
+            self.resolution_width = self.config['resolution_width']
+            self.resolution_height = self.config['resolution_height']
+            self.capture_buffer = None
+        if 'use_video_port' in live_keys:
+            # video port captures are padded differently than still captures
+            self.capture_buffer = None
+
+        # camera settings: compared to the applied settings at the next setup
+        self.last_setup_time = 0
+
+    @staticmethod
+    def _get_missing_config_keys(config: Dict[str, Any]) -> List[str]:
+        required_keys = REQUIRED_CONFIG_KEYS + (MANUAL_MODE_CONFIG_KEYS if config.get('enable_manual_mode') else [])
+        return [key for key in required_keys if key not in config]
 
     def _print_camera_settings(self, camera: Any) -> None:
 
@@ -149,29 +703,55 @@ class Camera:
         perf_start_time = time.perf_counter()
 
         self._log('Capturing Image...')
-        if self.config['show_image_timestamp']:
-            camera.annotate_background = picamera.Color('black')
-            camera.annotate_text = self._get_timestamp()
-            camera.annotate_text_size = self.config['image_timestamp_text_size']
+        self._annotate_image_timestamp(camera)
 
         # capturing this now: we want exact times for file and image timestamps
         timestamp_filename = datetime.datetime.now().strftime(self.config['timestamp_filename_format'])
 
-        # unencoded formats must account for resolution rounding
-        horizontal_multiple = 16 if self.config['use_video_port'] else 32
-        vertical_multiple = 16
-        array_width = (self.resolution_width + horizontal_multiple - 1) // horizontal_multiple * horizontal_multiple
-        array_height = (self.resolution_height + vertical_multiple - 1) // vertical_multiple * vertical_multiple
+        use_video_port = self.config['use_video_port']
+        if self.capture_buffer is None:
+            self.capture_buffer = self._allocate_capture_buffer(use_video_port)
+        perf_capture_start_time = time.perf_counter()
+        camera.capture(self.capture_buffer, self.capture_format, use_video_port=use_video_port)
+        self.metrics.observe(STAGE_CAPTURE, time.perf_counter() - perf_capture_start_time)
 
-        image_array = np.empty((array_height, array_width, 3), dtype=np.uint8)
-        camera.capture(image_array, 'bgr', use_video_port=self.config['use_video_port'])
-        image_array = self._crop_image(image_array)
+        perf_crop_start_time = time.perf_counter()
+        image_array = self._get_captured_image(self.capture_buffer, use_video_port)
+        self.metrics.observe(STAGE_CROP, time.perf_counter() - perf_crop_start_time)
 
-        self._log(f'Image Capture Complete')
+        self._log('Image Capture Complete')
         self._log(f'Elapsed Seconds: {time.perf_counter() - perf_start_time:0.4f}')
 
         self._check_for_motion(image_array, timestamp_filename)
 
+    def _annotate_image_timestamp(self, camera: Any) -> None:
+
+        if self.config['show_image_timestamp']:
+            from picamera import Color  # deferred: only needed with camera hardware
+            camera.annotate_background = Color('black')
+            camera.annotate_text = self._get_timestamp()
+            camera.annotate_text_size = self.config['image_timestamp_text_size']
+
+    def _allocate_capture_buffer(self, use_video_port: bool) -> Any:
+
+        resolution = (self.resolution_width, self.resolution_height)
+
+        if self.capture_format == CAPTURE_FORMAT_YUV:
+            return YuvFrame.allocate(get_yuv_capture_size(resolution))
+
+        array_width, array_height = get_capture_array_size(resolution, use_video_port)
+        return np.empty((array_height, array_width, 3), dtype=np.uint8)
+
+    def _get_captured_image(self, capture_buffer: Any, use_video_port: bool) -> Any:
+        """
+        cropped BGR image, or a YuvFrame whose luma plane is cropped the same way
+        """
+        if self.capture_format == CAPTURE_FORMAT_YUV:
+            return YuvFrame(capture_buffer, get_yuv_capture_size((self.resolution_width, self.resolution_height)),
+                            self._crop_image)
+
+        return self._crop_image(capture_buffer)
+
     def _crop_image(self, image_array: Any) -> Any:
 
         # crop image data to remove blank pixel data from rounding
@@ -193,64 +773,285 @@ class Camera:
 
         perf_start_time = time.perf_counter()
 
+        if self.time_to_first_frame == 0:
+            self.time_to_first_frame = perf_start_time - self.process_start_time
+            self._log(f'Time to first frame: {self.time_to_first_frame:0.2f} seconds', logging.INFO)
+
+        if perf_start_time < self.quarantine_end_time:
+            # camera settings are settling; changing colors and exposure would be detected as motion
+            self._log('Camera settings settling; motion check skipped')
+            # queued frames first, to keep clip frames in order
+            self._drain_analysis_pipeline()
+            self.last_diff_score = None
+            self.motion_frame_count = 0
+            self.metrics.inc('quarantined_frames')
+            self._add_clip_frame(image_array, False)
+            return
+
+        if self.analysis_pipeline is not None:
+            self._submit_for_analysis(image_array, timestamp_filename)
+            return
+
         self._log('Check for motion...')
 
-        image_width = image_array.shape[1]
-        motion_image_width = int(image_width * (self.motion_image_percent / 100.0))
-        processed_image = imutils.resize(image_array, width=motion_image_width)
-        processed_image = cv2.cvtColor(processed_image, cv2.COLOR_BGR2GRAY)
-        processed_image = cv2.blur(processed_image, (21, 21))
+        # yuv: the luma plane is already grayscale
+        diff_score = self.motion_detector.process(image_array.luma if isinstance(image_array, YuvFrame)
+                                                  else image_array)
+        self.metrics.observe(STAGE_PREPROCESS, self.motion_detector.last_preprocess_seconds)
+        self.metrics.observe(STAGE_DIFF, self.motion_detector.last_diff_seconds)
+        if self._is_time_lapse_due():
+            # time-lapse images are hashed, and saved with the motion frame in debug mode
+            self.motion_detector.finish_motion_image()
+        self._handle_diff_score(image_array, timestamp_filename, diff_score, self.motion_detector.current_image)
+
+        self._log('Motion Check Complete')
+        self._log(f'Elapsed Seconds: {time.perf_counter() - perf_start_time:0.4f}')
 
-        if self.previous_processed_image is None:
-            # save and set first image!
-            self._log(f'saving first image', logging.INFO)
-            self._save_image_from_motion(image_array, timestamp_filename)
-            self.previous_processed_image = processed_image
+    def _handle_diff_score(self, image_array: Any, timestamp_filename: str, diff_score: Optional[int],
+                           processed_image: Any) -> None:
+        """
+        save, time-lapse and clip decisions for a checked frame, in capture order
+        """
+        self.metrics.inc('frames_processed')
+        self.last_diff_score = diff_score
+
+        if diff_score is None or self.previous_processed_image is None or self.rebaseline_pending:
+            self.rebaseline_pending = False
+            if self.last_image_time == 0:
+                # save and set first image!
+                self._log('saving first image', logging.INFO)
+                self._save_image_from_motion(image_array, timestamp_filename, trigger=TRIGGER_FIRST_IMAGE)
+            else:
+                # settings changed: set the new baseline image, without saving
+                self._log('new motion baseline image', logging.INFO)
+                self.last_diff_score = None
+            self._advance_processed_image(processed_image)
+            self._add_clip_frame(image_array, False)
             return
 
-        images_diff = cv2.absdiff(self.previous_processed_image, processed_image)
-        diff_score = np.sum(images_diff)
+        motion_detected = self._is_motion_detected(diff_score)
 
-        if diff_score > self.diff_threshold:
+        if motion_detected:
             self._log(f'motion detected; diff score:{diff_score:,d}', logging.INFO)
+            self._log_cell_scores()
+            self.metrics.inc('motion_frames')
             self.motion_frame_count += 1
             if self.motion_frame_count >= self.motion_frames_threshold:
-                self._save_image_from_motion(image_array, timestamp_filename, processed_image, diff_score)
+                self._trigger_clip(timestamp_filename)
+                self.metrics.inc('motion_events')
+                if self.clip_recorder is not None and self.config.get('clip_only', False):
+                    # the clip replaces individual motion images
+                    self.last_image_time = time.time()
+                elif not self._is_duplicate_motion_image(processed_image):
+                    self._save_image_from_motion(image_array, timestamp_filename, processed_image, diff_score)
                 self.motion_frame_count = 0
-        elif (self.config['time_lapse_seconds'] != 0
-              and time.time() - self.last_image_time > self.config['time_lapse_seconds']):
+        elif self._is_time_lapse_due():
             # we will also save the image if the time-lapse is set and expired
             self.motion_frame_count = 0  # reset here since time elapsed
-            self._log(f'time elapsed; saving image', logging.INFO)
-            self._save_image_from_motion(image_array, timestamp_filename)
+            self._log('time elapsed; saving image', logging.INFO)
+            self.metrics.inc('time_lapse_saves')
+            if self.duplicate_filter is not None:
+                self.duplicate_filter.add(get_image_hash(processed_image))
+            self._save_image_from_motion(image_array, timestamp_filename, trigger=TRIGGER_TIME_LAPSE)
         else:
             # no consecutive frame motion, reset motion_frame_count
             self.motion_frame_count = 0
 
-        self.previous_processed_image = processed_image
+        self._advance_processed_image(processed_image)
+        self._add_clip_frame(image_array, motion_detected)
 
-        self._log(f'Motion Check Complete')
-        self._log(f'Elapsed Seconds: {time.perf_counter() - perf_start_time:0.4f}')
+    def _is_duplicate_motion_image(self, processed_image: Any) -> bool:
+        """
+        True if the motion image is nearly identical to a recently saved image (ex: a long motion event)
+        """
+        if self.duplicate_filter is None:
+            return False
+
+        if self._is_time_lapse_due():
+            # time-lapse images are still saved during long motion events
+            self.duplicate_filter.add(get_image_hash(processed_image))
+            return False
+
+        if self.duplicate_filter.check(processed_image):
+            return False
+
+        # nothing was encoded: estimated from the average saved image
+        writer_stats = self.image_writer.get_stats()
+        self.metrics.inc('duplicate_saves_suppressed')
+        self.metrics.inc('duplicate_bytes_saved', writer_stats['bytes_written'] / max(1, writer_stats['written']))
+        self._log('near-duplicate of a recent image; not saved', logging.INFO)
+        return True
+
+    def _is_time_lapse_due(self) -> bool:
+        time_lapse_seconds = self.config['time_lapse_seconds']
+        return time_lapse_seconds != 0 and time.time() - self.last_image_time > time_lapse_seconds
+
+    def _is_motion_detected(self, diff_score: int) -> bool:
+
+        # per-cell thresholds replace diff_threshold when configured
+        if self.motion_detector.has_cell_thresholds():
+            return len(self.motion_detector.get_hot_cells()) > 0
+
+        return diff_score > self.diff_threshold
+
+    def _log_cell_scores(self) -> None:
+
+        cell_scores = self.motion_detector.cell_scores
+        if cell_scores is None:
+            return
+
+        rows = ['|'.join(f'{cell_score:,d}' for cell_score in row) for row in cell_scores.tolist()]
+        self._log(f'cell scores: {" / ".join(rows)}', logging.INFO)
+
+    def _advance_processed_image(self, processed_image: Any) -> None:
+
+        if self.analysis_pipeline is not None:
+            # the motion frame stays in the analysis ring until the next result is handled
+            self.previous_processed_image = processed_image
+            return
+
+        # motion frame buffers are swapped, not copied
+        self.motion_detector.advance()
+        self.previous_processed_image = self.motion_detector.previous_image
+
+    def _submit_for_analysis(self, image_array: Any, timestamp_filename: str) -> None:
+        """
+        queue the frame for the analysis workers, and handle the results of earlier frames
+        worker errors are raised after the frame is queued, so they count as errors of the camera loop
+        """
+        pipeline = self.analysis_pipeline
+
+        if pipeline.is_running() and pipeline.frame_shape != image_array.shape:
+            self._stop_analysis_pipeline()
+        if not pipeline.is_running():
+            pipeline.start(image_array.shape)
+            # cell thresholds for results are checked here
+            self.motion_detector.get_motion_shape(image_array.shape)
+
+        error_count = self._handle_analysis_results(block=False)
+        while not pipeline.has_free_slot():
+            error_count += self._handle_analysis_results(block=True)
+        pipeline.submit(image_array, timestamp_filename)
+
+        if error_count > 0:
+            raise RuntimeError(f'{error_count} analysis worker errors')
+
+    def _handle_analysis_results(self, block: bool) -> int:
+        """
+        handle ready results, or wait for one when blocking; returns the number of worker errors
+        """
+        error_count = 0
+
+        while True:
+            result = self.analysis_pipeline.get_result(block)
+            if result is None:
+                return error_count
+
+            if result.error != '':
+                self._log(result.error, logging.ERROR)
+                self.last_diff_score = None
+                error_count += 1
+            else:
+                self._handle_analysis_result(result)
+
+            if block:
+                return error_count
+
+    def _handle_analysis_result(self, result: AnalysisResult) -> None:
+
+        self.metrics.observe(STAGE_PREPROCESS, result.preprocess_seconds)
+        self.metrics.observe(STAGE_DIFF, result.diff_seconds)
+        self.motion_detector.cell_scores = np.array(result.cell_scores) if result.cell_scores is not None else None
+
+        self._log('Check for motion...')
+        self._handle_diff_score(self.analysis_pipeline.get_frame(result.slot), result.context, result.diff_score,
+                                self.analysis_pipeline.get_motion_image(result.slot))
+        self._log('Motion Check Complete')
+
+    def _drain_analysis_pipeline(self) -> None:
+
+        if self.analysis_pipeline is None:
+            return
+
+        # worker errors are already logged; nothing is left to retry
+        while self.analysis_pipeline.get_pending_count() > 0:
+            self._handle_analysis_results(block=True)
+
+    def _stop_analysis_pipeline(self) -> None:
+        """
+        handle all queued frames, then stop the analysis workers
+        """
+        if self.analysis_pipeline is None or not self.analysis_pipeline.is_running():
+            return
+
+        try:
+            self._drain_analysis_pipeline()
+        except Exception:
+            self._log(traceback.format_exc(), logging.ERROR)
+        finally:
+            if self.previous_processed_image is not None:
+                # the ring is freed: keep the baseline (ex: for state snapshots)
+                self.previous_processed_image = self.previous_processed_image.copy()
+            self.analysis_pipeline.stop()
+
+    def _trigger_clip(self, timestamp_filename: str) -> None:
+
+        if self.clip_recorder is None:
+            return
+
+        image_file_prefix = self.config['image_file_prefix']
+        self.clip_recorder.trigger(os.path.join(self._get_save_directory(),
+                                                f'{image_file_prefix}-{timestamp_filename}-clip'))
+
+    def _add_clip_frame(self, image_array: Any, motion_detected: bool) -> None:
+
+        if self.clip_recorder is None:
+            return
+
+        # clips are color: yuv frames are converted for every frame while clip recording is enabled
+        self.clip_recorder.add_frame(image_array.to_bgr() if isinstance(image_array, YuvFrame) else image_array,
+                                     motion_detected)
+
+    def _get_save_directory(self) -> str:
+
+        # created once per day; the retention manager caches existing directories
+        return self.retention_manager.get_day_directory()
 
     def _save_image_from_motion(self, image_array: Any, timestamp_filename: str, processed_image_array: Any = None,
-                                diff_score: Any = None):
+                                diff_score: Any = None, trigger: str = TRIGGER_MOTION):
 
         # setup directory and output format
-        main_directory = self.config['main_directory']
-        subdirectory = datetime.datetime.now().strftime('%Y/%m/%d')
-        directory_path = os.path.join(self.script_directory, main_directory, subdirectory)
-
-        if not os.path.exists(directory_path):
-            os.makedirs(directory_path)
+        directory_path = self._get_save_directory()
 
         image_file_prefix = self.config['image_file_prefix']
         diff_score_in_filename = self.config['diff_score_in_filename']
         image_file_suffix: str = (str(uuid.uuid4())[:8] if (diff_score is None or not diff_score_in_filename)
                                   else '{0:,d}'.format(diff_score).replace(',', '.'))
+
+        max_cell = self.motion_detector.get_max_cell()
+        if diff_score is not None and max_cell is not None and self.config.get('cell_scores_in_filename', False):
+            # highest scoring grid cell, ex: r1c2-1.234.567
+            row, column, cell_score = max_cell
+            image_file_suffix += f'-r{row}c{column}-' + '{0:,d}'.format(cell_score).replace(',', '.')
         filename = f'{image_file_prefix}-{timestamp_filename}-{image_file_suffix}.jpg'
         image_full_path = os.path.join(directory_path, filename)
 
-        self._write_image_file_async(image_full_path, image_array)
+        thumbnail_path = ''
+        if self.config.get('enable_thumbnails', False):
+            thumbnail_path = os.path.join(
+                self.retention_manager.ensure_directory(os.path.join(directory_path, THUMBNAIL_DIRECTORY)), filename)
+
+        if isinstance(image_array, YuvFrame):
+            # converted only when saved; the converted image is new, so no copy is needed
+            saved_image = image_array.to_bgr()
+            copy_data = False
+        else:
+            # capture buffers are reused, so the saved image must be copied
+            saved_image = image_array
+            copy_data = True
+        # cataloged by the writer once the file exists: queued images can still be dropped or fail to write
+        self._write_image_file_async(image_full_path, saved_image, copy_data, thumbnail_path,
+                                     self._get_catalog_record(timestamp_filename, diff_score, trigger, saved_image))
         self.last_image_time = time.time()
 
         self._save_processed_images(directory_path, filename, processed_image_array)
@@ -262,25 +1063,49 @@ class Camera:
         if not self.config['enable_image_debugging'] or processed_image_array is None:
             return
 
-        processed_directory_path = os.path.join(directory_path, 'processed')
-
-        if not os.path.exists(processed_directory_path):
-            os.makedirs(processed_directory_path)
+        processed_directory_path = self.retention_manager.ensure_directory(os.path.join(directory_path, 'processed'))
 
         processed_image_path = os.path.join(processed_directory_path, filename)
 
-        self._write_image_file_async(processed_image_path.replace('.jpg', '_p0.jpg'), self.previous_processed_image)
-        self._write_image_file_async(processed_image_path.replace('.jpg', '_p1.jpg'), processed_image_array)
+        self._write_image_file_async(processed_image_path.replace('.jpg', '_p0.jpg'), self.previous_processed_image,
+                                     copy_data=True)
+        self._write_image_file_async(processed_image_path.replace('.jpg', '_p1.jpg'), processed_image_array,
+                                     copy_data=True)
+
+    def _get_catalog_record(self, timestamp_filename: str, diff_score: Any, trigger: str,
+                            image_array: Any) -> Optional[Tuple[float, Any, str, int, int]]:
+        """
+        (timestamp, diff score, trigger, width, height) for MediaCatalog.add, or None without a catalog
+        """
+        if self.media_catalog is None:
+            return None
+
+        try:
+            timestamp = datetime.datetime.strptime(timestamp_filename,
+                                                   self.config['timestamp_filename_format']).timestamp()
+        except ValueError:
+            # formats that can't be parsed back, such as those without a full date
+            timestamp = time.time()
+
+        return timestamp, diff_score, trigger, image_array.shape[1], image_array.shape[0]
+
+    def _on_image_written(self, image_full_path: str, size_bytes: int, catalog_record: Any) -> None:
+
+        # called from image writer threads
+        self.retention_manager.add_file(image_full_path, size_bytes)
+        if catalog_record is not None and self.media_catalog is not None:
+            self.media_catalog.add(image_full_path, *catalog_record)
 
-    def _write_image_file_async(self, image_full_path: str, image_array: Any) -> None:
+    def _write_image_file_async(self, image_full_path: str, image_array: Any, copy_data: bool = False,
+                                thumbnail_path: str = '', catalog_record: Any = None) -> bool:
         """
-        use threading to write image file and avoid disk io delay
+        queue image file for the writer pool to avoid disk io delay
+        copy_data is required for reused capture and motion buffers
+        returns False if the writer dropped the image
         """
         self._log(f'Writing file: {image_full_path.split("/")[-1]}', logging.INFO)
 
-        image_data = image_array.copy()
-        thread = Thread(target=cv2.imwrite, args=(image_full_path, image_data))
-        thread.start()
+        return self.image_writer.submit(image_full_path, image_array, copy_data, thumbnail_path, catalog_record)
 
     def _get_timestamp(self) -> str:
         return datetime.datetime.now().strftime(self.config['timestamp_format'])
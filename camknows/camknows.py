@@ -1,11 +1,14 @@
-
-from camera import Camera
+import time
 
 
 def main() -> None:
 
+    # measured before the camera module's imports (OpenCV, numpy) for the time to first frame
+    process_start_time = time.perf_counter()
+
     try:
-        camera = Camera()
+        from camera import Camera
+        camera = Camera(process_start_time)
         camera.start_camera_loop()
     except KeyboardInterrupt:
         print('Application closed (KeyboardInterrupt)')
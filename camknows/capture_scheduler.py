@@ -0,0 +1,111 @@
+import logging
+import time
+from typing import Callable, Dict, Optional
+
+SCHEDULER_IDLE = 'idle'
+SCHEDULER_NORMAL = 'normal'
+SCHEDULER_BURST = 'burst'
+SCHEDULER_DECAY = 'decay'
+# numeric values for the scheduler_state metric
+SCHEDULER_STATE_VALUES: Dict[str, int] = {SCHEDULER_IDLE: 0, SCHEDULER_NORMAL: 1, SCHEDULER_DECAY: 2,
+                                          SCHEDULER_BURST: 3}
+
+
+class CaptureScheduler:
+    """
+    decides the delay before the next frame from recent diff scores and cpu use
+    - normal: normal_interval seconds per frame (0: as fast as possible); with wait_after_frame, normal_interval
+      seconds after each frame instead, like wait_time
+    - idle: after quiet_seconds without a diff score reaching pre_alert_threshold, idle_fps
+    - burst: as soon as a diff score reaches pre_alert_threshold, burst_fps, held for burst_hold_seconds
+    - decay: after a burst, the frame interval returns to normal over decay_seconds
+    with max_duty_cycle < 1, frames are spaced so process cpu time stays under that fraction of elapsed time
+    a rate of 0 disables its state; with no adaptive settings, this is a fixed interval like wait_time
+    """
+
+    def __init__(self, normal_interval: float = 0, idle_fps: float = 0, quiet_seconds: float = 60,
+                 burst_fps: float = 0, pre_alert_threshold: int = 0, burst_hold_seconds: float = 5,
+                 decay_seconds: float = 10, max_duty_cycle: float = 1, wait_after_frame: bool = False,
+                 log: Optional[Callable[..., None]] = None):
+        self.normal_interval: float = max(0.0, normal_interval)
+        self.idle_interval: float = max(1.0 / idle_fps, self.normal_interval) if idle_fps > 0 else 0
+        self.quiet_seconds: float = quiet_seconds
+        # a burst is never slower than normal
+        self.burst_interval: float = (min(1.0 / burst_fps, self.normal_interval) if self.normal_interval > 0
+                                      else 0) if burst_fps > 0 else 0
+        self.burst_enabled: bool = burst_fps > 0
+        self.pre_alert_threshold: int = pre_alert_threshold
+        self.burst_hold_seconds: float = burst_hold_seconds
+        self.decay_seconds: float = decay_seconds
+        self.max_duty_cycle: float = min(1.0, max(0.01, max_duty_cycle))
+        self.wait_after_frame: bool = wait_after_frame
+        self._log: Callable[..., None] = log if log is not None else (lambda message, level=logging.NOTSET: None)
+
+        self.state: str = SCHEDULER_NORMAL
+        self.effective_fps: float = 0
+        self.duty_cycle_limited_count: int = 0
+        self._last_activity_time: float = time.perf_counter()
+        self._frame_start_time: float = time.perf_counter()
+        self._frame_start_cpu_time: float = time.process_time()
+
+    def start_frame(self) -> None:
+        self._frame_start_time = time.perf_counter()
+        self._frame_start_cpu_time = time.process_time()
+
+    def finish_frame(self, diff_score: Optional[int]) -> float:
+        """
+        update the state with the frame's diff score (None if unknown); returns seconds to wait before the next frame
+        """
+        now = time.perf_counter()
+        cpu_seconds = time.process_time() - self._frame_start_cpu_time
+
+        if diff_score is not None and self.pre_alert_threshold > 0 and diff_score >= self.pre_alert_threshold:
+            self._last_activity_time = now
+            if self.burst_enabled:
+                self._set_state(SCHEDULER_BURST, f'diff score {diff_score:,d}')
+
+        frame_interval = self._get_frame_interval(now)
+        if self.state == SCHEDULER_NORMAL and self.wait_after_frame:
+            frame_interval += now - self._frame_start_time
+
+        if self.max_duty_cycle < 1:
+            duty_cycle_interval = cpu_seconds / self.max_duty_cycle
+            if duty_cycle_interval > frame_interval:
+                frame_interval = duty_cycle_interval
+                self.duty_cycle_limited_count += 1
+
+        self.effective_fps = 1.0 / max(frame_interval, now - self._frame_start_time, 1e-6)
+
+        return max(0.0, self._frame_start_time + frame_interval - now)
+
+    def _get_frame_interval(self, now: float) -> float:
+        quiet_seconds = now - self._last_activity_time
+
+        if self.state == SCHEDULER_BURST and quiet_seconds > self.burst_hold_seconds:
+            self._set_state(SCHEDULER_DECAY if self.decay_seconds > 0 else SCHEDULER_NORMAL)
+
+        if self.state == SCHEDULER_DECAY:
+            decay_progress = (quiet_seconds - self.burst_hold_seconds) / self.decay_seconds
+            if decay_progress < 1:
+                return self.burst_interval + (self.normal_interval - self.burst_interval) * decay_progress
+            self._set_state(SCHEDULER_NORMAL)
+
+        if self.state == SCHEDULER_NORMAL and self.idle_interval > 0 and quiet_seconds > self.quiet_seconds:
+            self._set_state(SCHEDULER_IDLE, f'{self.quiet_seconds:g} seconds without activity')
+
+        if self.state == SCHEDULER_IDLE and quiet_seconds <= self.quiet_seconds:
+            # activity without a burst rate configured
+            self._set_state(SCHEDULER_NORMAL)
+
+        if self.state == SCHEDULER_BURST:
+            return self.burst_interval
+        if self.state == SCHEDULER_IDLE:
+            return self.idle_interval
+        return self.normal_interval
+
+    def _set_state(self, state: str, reason: str = '') -> None:
+        if state == self.state:
+            return
+        self.state = state
+        self._log(f'Capture scheduler: {state}{f" ({reason})" if reason else ""}, '
+                  f'last effective fps {self.effective_fps:0.2f}', logging.INFO)
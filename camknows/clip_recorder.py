@@ -0,0 +1,246 @@
+import collections
+import logging
+import os
+import queue
+import sys
+import time
+import traceback
+from threading import Thread
+from typing import Any, Callable, Deque, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# utilities import their siblings directly, so they are imported from the utilities directory
+# under the same top-level names
+UTILITIES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utilities')
+if UTILITIES_DIRECTORY not in sys.path:
+    sys.path.insert(0, UTILITIES_DIRECTORY)
+
+from mjpeg_avi_writer import MjpegAviWriter, get_jpeg_size
+
+CLIP_FORMAT_AVI = 'avi'
+CLIP_FORMAT_MP4 = 'mp4'
+BUFFER_FORMAT_JPEG = 'jpeg'
+BUFFER_FORMAT_ARRAY = 'array'
+
+
+class ClipRecorder:
+    """
+    keeps a pre-roll ring buffer of the frames from the last pre_roll_seconds, within a memory budget
+    when triggered, the pre-roll and following frames, until post_roll_seconds without motion,
+    are written as one video clip by a background thread
+    frames are stored as jpeg bytes or downscaled arrays; a clip whose frames after the pre-roll reach the memory
+    budget or max_clip_frames is split, so long events don't hold more than the budget in memory
+    """
+
+    def __init__(self, memory_budget_bytes: int = 32 * 1024 * 1024, pre_roll_seconds: float = 5,
+                 post_roll_seconds: float = 3,
+                 max_clip_frames: int = 900, scale_percent: float = 50, buffer_format: str = BUFFER_FORMAT_JPEG,
+                 jpeg_quality: int = 80, clip_format: str = CLIP_FORMAT_AVI,
+                 log: Optional[Callable[..., None]] = None,
+                 written_callback: Optional[Callable[[str, int], None]] = None):
+
+        if buffer_format not in [BUFFER_FORMAT_JPEG, BUFFER_FORMAT_ARRAY]:
+            raise ValueError(f'Invalid clip buffer format: {buffer_format}')
+        if clip_format not in [CLIP_FORMAT_AVI, CLIP_FORMAT_MP4]:
+            raise ValueError(f'Invalid clip format: {clip_format}')
+
+        self.memory_budget_bytes: int = memory_budget_bytes
+        self.pre_roll_seconds: float = pre_roll_seconds
+        self.post_roll_seconds: float = post_roll_seconds
+        self.max_clip_frames: int = max(1, max_clip_frames)
+        self.scale_percent: float = scale_percent
+        self.buffer_format: str = buffer_format
+        self.jpeg_quality: int = jpeg_quality
+        self.clip_format: str = clip_format
+        self._log: Callable[..., None] = log if log is not None else (lambda message, level=logging.NOTSET: None)
+        # called from the clip writer thread with the path and size of each written clip
+        self._written_callback: Optional[Callable[[str, int], None]] = written_callback
+
+        # (timestamp, frame data, size in bytes)
+        self._pre_roll: Deque[Tuple[float, Any, int]] = collections.deque()
+        self._pre_roll_bytes: int = 0
+        self._clip_frames: List[Tuple[float, Any, int]] = []
+        self._clip_bytes: int = 0  # frames after the pre-roll
+        self._clip_path: str = ''
+        self._clip_path_without_extension: str = ''
+        self._clip_part: int = 0
+        self._last_motion_time: float = 0
+        self._clip_queue: queue.Queue = queue.Queue(maxsize=2)
+        self._thread: Optional[Thread] = None
+
+        self.clip_count: int = 0
+        self.frames_written: int = 0
+
+    def is_recording(self) -> bool:
+        return self._clip_path != ''
+
+    def add_frame(self, image_array: Any, motion_detected: bool) -> None:
+        """
+        buffer a BGR frame; call once for every frame, after trigger() if the frame triggered a clip
+        """
+        frame = self._store_frame(image_array)
+
+        if not self.is_recording():
+            self._pre_roll.append(frame)
+            self._pre_roll_bytes += frame[2]
+            while len(self._pre_roll) > 1 and (self._pre_roll_bytes > self.memory_budget_bytes
+                                               or frame[0] - self._pre_roll[0][0] > self.pre_roll_seconds):
+                self._pre_roll_bytes -= self._pre_roll.popleft()[2]
+            return
+
+        self._clip_frames.append(frame)
+        self._clip_bytes += frame[2]
+        if motion_detected:
+            self._last_motion_time = frame[0]
+
+        if frame[0] - self._last_motion_time > self.post_roll_seconds:
+            self._finish_clip()
+        elif len(self._clip_frames) >= self.max_clip_frames or self._clip_bytes >= self.memory_budget_bytes:
+            # long event: split into another clip, which continues without pre-roll
+            self._finish_clip()
+            self._clip_part += 1
+            self._clip_path = f'{self._clip_path_without_extension}-{self._clip_part}.{self.clip_format}'
+
+    def trigger(self, clip_path_without_extension: str) -> None:
+        """
+        start a clip with the buffered pre-roll, or extend the clip already recording
+        """
+        self._last_motion_time = time.time()
+        if self.is_recording():
+            return
+
+        self._clip_path_without_extension = clip_path_without_extension
+        self._clip_part = 0
+        self._clip_path = f'{clip_path_without_extension}.{self.clip_format}'
+        self._clip_frames = list(self._pre_roll)
+        # the pre-roll has its own budget, so a full pre-roll doesn't split the clip at the start of the event
+        self._clip_bytes = 0
+        self._pre_roll.clear()
+        self._pre_roll_bytes = 0
+        self._log(f'Recording clip: {self._clip_path.split("/")[-1]}', logging.INFO)
+
+    def stop(self) -> None:
+        """
+        write any clip in progress and wait for the clip writer
+        """
+        if self.is_recording():
+            self._finish_clip()
+
+        if self._thread is not None:
+            self._clip_queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _store_frame(self, image_array: Any) -> Tuple[float, Any, int]:
+        frame_time = time.time()
+
+        if self.scale_percent != 100:
+            width = max(1, int(image_array.shape[1] * self.scale_percent / 100.0))
+            height = max(1, int(image_array.shape[0] * width / float(image_array.shape[1])))
+            image_array = cv2.resize(image_array, (width, height), interpolation=cv2.INTER_AREA)
+        elif self.buffer_format == BUFFER_FORMAT_ARRAY:
+            # capture buffers are reused
+            image_array = image_array.copy()
+
+        if self.buffer_format == BUFFER_FORMAT_JPEG:
+            encoded_image = self._encode_jpeg(image_array)
+            return frame_time, encoded_image, encoded_image.nbytes
+
+        return frame_time, image_array, image_array.nbytes
+
+    def _finish_clip(self) -> None:
+        clip_path, clip_frames = self._clip_path, self._clip_frames
+        self._clip_path = ''
+        self._clip_frames = []
+        self._clip_bytes = 0
+
+        if self._thread is None:
+            self._thread = Thread(target=self._writer, name='clip-writer', daemon=True)
+            self._thread.start()
+
+        # blocks if two clips are already waiting; clips are large, so don't let them pile up
+        self._clip_queue.put((clip_path, clip_frames))
+
+    def _writer(self) -> None:
+        while True:
+            item = self._clip_queue.get()
+            if item is None:
+                return
+            self._write_clip(*item)
+
+    def _write_clip(self, clip_path: str, clip_frames: List[Tuple[float, Any, int]]) -> None:
+        try:
+            perf_start_time = time.perf_counter()
+            os.makedirs(os.path.dirname(clip_path), exist_ok=True)
+
+            # frame rate from capture times, since capture rate varies
+            duration = clip_frames[-1][0] - clip_frames[0][0]
+            frames_per_second = min(30.0, max(1.0, (len(clip_frames) - 1) / duration)) if duration > 0 else 1.0
+
+            if self.clip_format == CLIP_FORMAT_AVI:
+                self._write_avi(clip_path, clip_frames, frames_per_second)
+            else:
+                self._write_video(clip_path, clip_frames, frames_per_second)
+
+            self.clip_count += 1
+            self.frames_written += len(clip_frames)
+            if self._written_callback is not None:
+                self._written_callback(clip_path, os.path.getsize(clip_path))
+            self._log(f'Clip written: {clip_path.split("/")[-1]}, {len(clip_frames)} frames at '
+                      f'{frames_per_second:0.1f} fps in {time.perf_counter() - perf_start_time:0.2f} seconds',
+                      logging.INFO)
+        except Exception:
+            self._log(traceback.format_exc(), logging.ERROR)
+
+    def _write_avi(self, clip_path: str, clip_frames: List[Tuple[float, Any, int]], frames_per_second: float) -> None:
+        # stored jpeg frames are written as they are; only arrays, or frames of another size, are encoded
+        frame_size = None
+        video = None
+        try:
+            for _, frame_data, _ in clip_frames:
+                jpeg_data = self._get_jpeg_data(frame_data)
+                if frame_size is None:
+                    frame_size = get_jpeg_size(jpeg_data)
+                    if frame_size is None:
+                        raise IOError(f'Invalid clip frame: {clip_path}')
+                    video = MjpegAviWriter(clip_path, frame_size, frames_per_second)
+                elif get_jpeg_size(jpeg_data) != frame_size:
+                    image = cv2.resize(self._load_frame(frame_data), frame_size, interpolation=cv2.INTER_AREA)
+                    jpeg_data = self._encode_jpeg(image).tobytes()
+                video.write(jpeg_data)
+        finally:
+            if video is not None:
+                video.release()
+
+    def _write_video(self, clip_path: str, clip_frames: List[Tuple[float, Any, int]],
+                     frames_per_second: float) -> None:
+        first_image = self._load_frame(clip_frames[0][1])
+        frame_size = (first_image.shape[1], first_image.shape[0])
+        video = cv2.VideoWriter(clip_path, cv2.VideoWriter_fourcc(*'mp4v'), frames_per_second, frame_size)
+
+        try:
+            for _, frame_data, _ in clip_frames:
+                image = self._load_frame(frame_data)
+                if (image.shape[1], image.shape[0]) != frame_size:
+                    image = cv2.resize(image, frame_size, interpolation=cv2.INTER_AREA)
+                video.write(image)
+        finally:
+            video.release()
+
+    def _get_jpeg_data(self, frame_data: Any) -> bytes:
+        if self.buffer_format == BUFFER_FORMAT_JPEG:
+            return frame_data.tobytes()
+        return self._encode_jpeg(frame_data).tobytes()
+
+    def _encode_jpeg(self, image: Any) -> Any:
+        success, encoded_image = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not success:
+            raise IOError('Unable to encode clip frame')
+        return encoded_image
+
+    def _load_frame(self, frame_data: Any) -> Any:
+        if self.buffer_format == BUFFER_FORMAT_JPEG:
+            return cv2.imdecode(np.asarray(frame_data), cv2.IMREAD_COLOR)
+        return frame_data
@@ -0,0 +1,53 @@
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class ConfigWatcher:
+    """
+    reloads a json config file when it changes (modified time or size)
+    the file is checked at most every check_seconds, so poll() can be called for every frame
+    invalid json (ex: a file still being saved) is logged and skipped until the file changes again
+    """
+
+    def __init__(self, config_path: str, check_seconds: float = 2, log: Optional[Callable[..., None]] = None):
+        self.config_path: str = config_path
+        self.check_seconds: float = check_seconds
+        self._log: Callable[..., None] = log if log is not None else (lambda message, level=logging.NOTSET: None)
+        self._file_version: Optional[Tuple[int, int]] = self._get_file_version()
+        self._next_check_time: float = time.perf_counter() + check_seconds
+
+    def poll(self) -> Optional[Dict[str, Any]]:
+        """
+        the new config if the file changed since the last poll, otherwise None
+        """
+        if self.check_seconds <= 0 or time.perf_counter() < self._next_check_time:
+            return None
+        self._next_check_time = time.perf_counter() + self.check_seconds
+
+        file_version = self._get_file_version()
+        if file_version is None or file_version == self._file_version:
+            return None
+        self._file_version = file_version
+
+        try:
+            with open(self.config_path) as json_file:
+                config = json.load(json_file)
+        except (OSError, ValueError) as error:
+            self._log(f'Config not reloaded: {error}', logging.WARNING)
+            return None
+
+        if not isinstance(config, dict):
+            self._log(f'Config not reloaded: {self.config_path} is not a json object', logging.WARNING)
+            return None
+
+        return config
+
+    def _get_file_version(self) -> Optional[Tuple[int, int]]:
+        try:
+            file_stat = os.stat(self.config_path)
+        except OSError:
+            return None
+        return file_stat.st_mtime_ns, file_stat.st_size
@@ -0,0 +1,314 @@
+import os
+import sys
+import time
+from time import sleep
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# utilities import their siblings directly, so they are imported from the utilities directory
+# under the same top-level names
+UTILITIES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utilities')
+if UTILITIES_DIRECTORY not in sys.path:
+    sys.path.insert(0, UTILITIES_DIRECTORY)
+
+# shared with the catalog: subdirectories of saved images (processed images, thumbnails, contact sheets)
+# that are not camera frames
+from media_catalog import SKIPPED_DIRECTORIES
+
+FRAME_SOURCE_PICAMERA = 'picamera'
+FRAME_SOURCE_VIDEO = 'video'
+FRAME_SOURCE_DIRECTORY = 'directory'
+FRAME_SOURCE_SYNTHETIC = 'synthetic'
+FRAME_SOURCE_TYPES = [FRAME_SOURCE_PICAMERA, FRAME_SOURCE_VIDEO, FRAME_SOURCE_DIRECTORY, FRAME_SOURCE_SYNTHETIC]
+
+
+def get_capture_array_size(resolution: Tuple[int, int], use_video_port: bool) -> Tuple[int, int]:
+
+    # unencoded formats must account for resolution rounding
+    resolution_width, resolution_height = resolution
+    horizontal_multiple = 16 if use_video_port else 32
+    vertical_multiple = 16
+    array_width = (resolution_width + horizontal_multiple - 1) // horizontal_multiple * horizontal_multiple
+    array_height = (resolution_height + vertical_multiple - 1) // vertical_multiple * vertical_multiple
+
+    return array_width, array_height
+
+
+def get_yuv_capture_size(resolution: Tuple[int, int]) -> Tuple[int, int]:
+
+    # yuv planes are always rounded to a width multiple of 32 and a height multiple of 16
+    resolution_width, resolution_height = resolution
+    array_width = (resolution_width + 31) // 32 * 32
+    array_height = (resolution_height + 15) // 16 * 16
+
+    return array_width, array_height
+
+
+class YuvFrame:
+    """
+    YUV420 (I420) capture buffer: the luma plane is a zero-copy grayscale view for motion detection,
+    and BGR conversion only happens for frames that are saved
+    crop is applied to both, and must accept 2 and 3 dimensional arrays
+    """
+
+    def __init__(self, yuv_buffer: Any, padded_size: Tuple[int, int], crop: Callable[[Any], Any]):
+        padded_width, padded_height = padded_size
+        self.yuv_buffer: Any = yuv_buffer
+        self.padded_size: Tuple[int, int] = padded_size
+        self.crop: Callable[[Any], Any] = crop
+        self.luma: Any = crop(yuv_buffer[:padded_width * padded_height].reshape((padded_height, padded_width)))
+        self._bgr_image: Any = None
+
+    @staticmethod
+    def allocate(padded_size: Tuple[int, int]) -> Any:
+        padded_width, padded_height = padded_size
+        return np.empty(padded_width * padded_height * 3 // 2, dtype=np.uint8)
+
+    def to_bgr(self) -> Any:
+        if self._bgr_image is None:
+            padded_width, padded_height = self.padded_size
+            i420_image = self.yuv_buffer.reshape((padded_height * 3 // 2, padded_width))
+            self._bgr_image = self.crop(cv2.cvtColor(i420_image, cv2.COLOR_YUV2BGR_I420))
+        return self._bgr_image
+
+
+class FrameSource:
+    """
+    base class for sources of BGR frames at the configured resolution
+    subclasses implement read(), returning None when the source is exhausted
+    """
+
+    def __init__(self, resolution: Tuple[int, int], fps: float = 0, max_speed: bool = False):
+        self.resolution: Tuple[int, int] = resolution
+        self.fps: float = fps
+        self.max_speed: bool = max_speed
+        self.frame_count: int = 0
+
+    def open(self) -> None:
+        pass
+
+    def read(self) -> Optional[Any]:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def frames(self) -> Iterator[Any]:
+        """
+        yield frames paced to fps; max_speed replays as fast as the consumer allows
+        """
+        frame_interval = 1.0 / self.fps if self.fps > 0 and not self.max_speed else 0
+        next_frame_time = time.perf_counter()
+
+        while True:
+            frame = self.read()
+            if frame is None:
+                return
+
+            self.frame_count += 1
+            yield frame
+
+            if frame_interval > 0:
+                next_frame_time += frame_interval
+                delay = next_frame_time - time.perf_counter()
+                if delay > 0:
+                    sleep(delay)
+                else:
+                    next_frame_time = time.perf_counter()
+
+    def _fit_to_resolution(self, frame: Any) -> Any:
+        if (frame.shape[1], frame.shape[0]) != self.resolution:
+            frame = cv2.resize(frame, self.resolution, interpolation=cv2.INTER_AREA)
+        return frame
+
+    def __enter__(self) -> 'FrameSource':
+        self.open()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class PiCameraFrameSource(FrameSource):
+    """
+    Raspberry Pi Camera Module; picamera is imported only when this source is opened
+    """
+
+    def __init__(self, resolution: Tuple[int, int], use_video_port: bool = True, fps: float = 0,
+                 max_speed: bool = False):
+        super().__init__(resolution, fps, max_speed)
+        self.use_video_port: bool = use_video_port
+        self.camera: Any = None
+
+    def open(self) -> None:
+        import picamera
+        self.camera = picamera.PiCamera()
+        self.camera.resolution = self.resolution
+
+    def read(self) -> Optional[Any]:
+        array_width, array_height = get_capture_array_size(self.resolution, self.use_video_port)
+        image_array = np.empty((array_height, array_width, 3), dtype=np.uint8)
+        self.camera.capture(image_array, 'bgr', use_video_port=self.use_video_port)
+        return image_array[:self.resolution[1], :self.resolution[0]]
+
+    def close(self) -> None:
+        if self.camera is not None:
+            self.camera.close()
+            self.camera = None
+
+
+class VideoCaptureFrameSource(FrameSource):
+    """
+    video file or USB camera via cv2.VideoCapture
+    video files are paced to their own frame rate unless fps or max_speed is set
+    """
+
+    def __init__(self, resolution: Tuple[int, int], source: str, fps: float = 0, max_speed: bool = False):
+        super().__init__(resolution, fps, max_speed)
+        # a numeric source is a camera device index
+        self.source: Any = int(source) if source.isdigit() else source
+        self.video_capture: Any = None
+
+    def open(self) -> None:
+        self.video_capture = cv2.VideoCapture(self.source)
+        if not self.video_capture.isOpened():
+            raise IOError(f'Unable to open video source: {self.source}')
+
+        if isinstance(self.source, int):
+            self.video_capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.resolution[0])
+            self.video_capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.resolution[1])
+        elif self.fps == 0:
+            self.fps = self.video_capture.get(cv2.CAP_PROP_FPS) or 0
+
+    def read(self) -> Optional[Any]:
+        success, frame = self.video_capture.read()
+        if not success:
+            return None
+        return self._fit_to_resolution(frame)
+
+    def close(self) -> None:
+        if self.video_capture is not None:
+            self.video_capture.release()
+            self.video_capture = None
+
+
+class DirectoryFrameSource(FrameSource):
+    """
+    saved images replayed in file name order, including year/month/day subdirectories
+    """
+
+    def __init__(self, resolution: Tuple[int, int], directory: str, extension: str = 'jpg', fps: float = 0,
+                 max_speed: bool = False):
+        super().__init__(resolution, fps, max_speed)
+        self.directory: str = directory
+        self.extension: str = extension
+        self._image_paths: Iterator[str] = iter([])
+
+    def open(self) -> None:
+        if not os.path.isdir(self.directory):
+            raise IOError(f'Invalid directory: {self.directory}')
+        self._image_paths = self._walk_image_paths(self.directory)
+
+    def read(self) -> Optional[Any]:
+        for image_path in self._image_paths:
+            frame = cv2.imread(image_path)
+            if frame is not None:
+                return self._fit_to_resolution(frame)
+        return None
+
+    def _walk_image_paths(self, directory: str) -> Iterator[str]:
+        """
+        lazily yield image paths; files sort before subdirectories, so YYYY/MM/DD trees stay in time order
+        """
+        entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(f'.{self.extension}'):
+                yield entry.path
+
+        for entry in entries:
+            if entry.is_dir() and entry.name not in SKIPPED_DIRECTORIES:
+                yield from self._walk_image_paths(entry.path)
+
+
+class SyntheticFrameSource(FrameSource):
+    """
+    deterministic generated frames: a static textured scene with sensor noise,
+    and a moving block during scripted motion intervals of [start_frame, end_frame)
+    a frame_count of 0 generates frames indefinitely
+    """
+
+    def __init__(self, resolution: Tuple[int, int], frame_count: int = 0, motion_frames: List[List[int]] = None,
+                 seed: int = 0, noise_level: int = 2, fps: float = 0, max_speed: bool = False):
+        super().__init__(resolution, fps, max_speed)
+        self.total_frame_count: int = frame_count
+        self.motion_frames: List[List[int]] = motion_frames if motion_frames is not None else []
+        self.seed: int = seed
+        self.noise_level: int = noise_level
+        self._frame_index: int = 0
+        self._background: Any = None
+        self._noise_frames: List[Any] = []
+
+    def open(self) -> None:
+        width, height = self.resolution
+        random_generator = np.random.default_rng(self.seed)
+
+        texture = random_generator.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        self._background = cv2.GaussianBlur(texture, (0, 0), 8)
+        self._noise_frames = [random_generator.integers(0, self.noise_level + 1, (height, width, 3), dtype=np.uint8)
+                              for _ in range(4)] if self.noise_level > 0 else []
+        self._frame_index = 0
+
+    def read(self) -> Optional[Any]:
+        if 0 < self.total_frame_count <= self._frame_index:
+            return None
+
+        if self._noise_frames:
+            frame = cv2.add(self._background, self._noise_frames[self._frame_index % len(self._noise_frames)])
+        else:
+            frame = self._background.copy()
+
+        motion_start_frame = self._get_motion_start_frame(self._frame_index)
+        if motion_start_frame is not None:
+            width, height = self.resolution
+            block_width = max(1, width // 8)
+            block_height = max(1, height // 8)
+            step = max(1, width // 32)
+            x = ((self._frame_index - motion_start_frame) * step) % max(1, width - block_width)
+            y = (height - block_height) // 2
+            cv2.rectangle(frame, (x, y), (x + block_width, y + block_height), (255, 255, 255), -1)
+
+        self._frame_index += 1
+        return frame
+
+    def _get_motion_start_frame(self, frame_index: int) -> Optional[int]:
+        for start_frame, end_frame in self.motion_frames:
+            if start_frame <= frame_index < end_frame:
+                return start_frame
+        return None
+
+
+def create_frame_source(config: Dict[str, Any], script_directory: str) -> FrameSource:
+
+    source_type = config.get('frame_source', FRAME_SOURCE_PICAMERA)
+    resolution = (config['resolution_width'], config['resolution_height'])
+    fps = config.get('frame_source_fps', 0)
+    max_speed = config.get('frame_source_max_speed', False)
+    source_path = config.get('frame_source_path', '')
+
+    if source_type == FRAME_SOURCE_PICAMERA:
+        return PiCameraFrameSource(resolution, config['use_video_port'], fps, max_speed)
+    if source_type == FRAME_SOURCE_VIDEO:
+        if not source_path.isdigit():
+            source_path = os.path.join(script_directory, source_path)
+        return VideoCaptureFrameSource(resolution, source_path, fps, max_speed)
+    if source_type == FRAME_SOURCE_DIRECTORY:
+        return DirectoryFrameSource(resolution, os.path.join(script_directory, source_path),
+                                    config.get('frame_source_extension', 'jpg'), fps, max_speed)
+    if source_type == FRAME_SOURCE_SYNTHETIC:
+        return SyntheticFrameSource(resolution, config.get('synthetic_frame_count', 0),
+                                    config.get('synthetic_motion_frames', []), fps=fps, max_speed=max_speed)
+
+    raise ValueError(f'Invalid frame source: {source_type} (options: {", ".join(FRAME_SOURCE_TYPES)})')
@@ -0,0 +1,263 @@
+import logging
+import os
+import queue
+import time
+import traceback
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+
+from metrics import STAGE_ENCODE, STAGE_SAVE_QUEUE, STAGE_WRITE, Metrics
+
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_DROP_NEWEST = 'drop_newest'
+OVERFLOW_POLICIES = [OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST]
+
+
+class ImageWriter:
+    """
+    fixed-size pool of writer threads fed by a bounded queue
+    images are encoded and written in the background to avoid disk io delay in the capture loop
+    """
+
+    def __init__(self, worker_count: int = 2, queue_size: int = 8, overflow_policy: str = OVERFLOW_BLOCK,
+                 jpeg_quality: int = 95, jpeg_optimize: bool = False, jpeg_progressive: bool = False,
+                 thumbnail_width: int = 320, thumbnail_jpeg_quality: int = 80,
+                 log: Optional[Callable[..., None]] = None, metrics: Optional[Metrics] = None,
+                 written_callback: Optional[Callable[[str, int, Any], None]] = None,
+                 directory_callback: Optional[Callable[[str], Any]] = None):
+
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f'Invalid overflow policy: {overflow_policy} (options: {", ".join(OVERFLOW_POLICIES)})')
+
+        self.worker_count: int = max(1, worker_count)
+        self.overflow_policy: str = overflow_policy
+        self.jpeg_params: List[int] = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality,
+                                       cv2.IMWRITE_JPEG_OPTIMIZE, int(jpeg_optimize),
+                                       cv2.IMWRITE_JPEG_PROGRESSIVE, int(jpeg_progressive)]
+        self.thumbnail_width: int = max(1, thumbnail_width)
+        self.thumbnail_params: List[int] = [cv2.IMWRITE_JPEG_QUALITY, thumbnail_jpeg_quality]
+        self._log: Callable[..., None] = log if log is not None else (lambda message, level=logging.NOTSET: None)
+        self.metrics: Metrics = metrics if metrics is not None else Metrics()
+        # called from writer threads with the path, size and submitted written_data of each written file
+        # (None for thumbnails); dropped images and failed writes are never reported
+        self.written_callback: Optional[Callable[[str, int, Any], None]] = written_callback
+        # called from writer threads to create the directory of a file again, when it was removed after the image
+        # was submitted (ex: by hand over a file share); the write is then retried once
+        self.directory_callback: Callable[[str], Any] = (
+            directory_callback if directory_callback is not None
+            else (lambda directory_path: os.makedirs(directory_path, exist_ok=True)))
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+        self._threads: List[Thread] = []
+        self._stats_lock = Lock()
+        self._running = False
+
+        self.submitted_count: int = 0
+        self.written_count: int = 0
+        self.dropped_count: int = 0
+        self.error_count: int = 0
+        self.max_queue_depth: int = 0
+        self.bytes_written: int = 0
+        self.thumbnail_count: int = 0
+        self.encode_seconds_total: float = 0
+        self.encode_seconds_max: float = 0
+        self.write_seconds_total: float = 0
+        self.write_seconds_max: float = 0
+
+    def start(self) -> None:
+        if self._running:
+            return
+
+        self._running = True
+        for index in range(self.worker_count):
+            thread = Thread(target=self._worker, name=f'image-writer-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, image_full_path: str, image_array: Any, copy_data: bool = False,
+               thumbnail_path: str = '', written_data: Any = None) -> bool:
+        """
+        queue an image to be written; returns False if the image was dropped
+        copy_data must be set when the caller reuses image_array after submitting it
+        thumbnail_path: also write a thumbnail_width thumbnail, downscaled from image_array after it is written
+        written_data: passed to written_callback once the image is written (ex: catalog record data)
+        """
+        if not self._running:
+            self.start()
+
+        # time the caller spends queuing: copying, and waiting for space with the block policy
+        perf_start_time = time.perf_counter()
+
+        # copy only after the overflow policy admits the image, so drops cost nothing
+        item: Tuple[str, Any, bool, str, Any] = (image_full_path, image_array, copy_data, thumbnail_path,
+                                                 written_data)
+
+        if self.overflow_policy == OVERFLOW_BLOCK:
+            self._queue.put(self._prepare_item(item))
+        elif self.overflow_policy == OVERFLOW_DROP_NEWEST:
+            try:
+                if self._queue.full():
+                    raise queue.Full
+                self._queue.put_nowait(self._prepare_item(item))
+            except queue.Full:
+                self._count_drop(image_full_path)
+                return False
+        else:
+            prepared_item = self._prepare_item(item)
+            while True:
+                try:
+                    self._queue.put_nowait(prepared_item)
+                    break
+                except queue.Full:
+                    try:
+                        dropped_item = self._queue.get_nowait()
+                        self._queue.task_done()
+                        self._count_drop(dropped_item[0])
+                    except queue.Empty:
+                        pass
+
+        with self._stats_lock:
+            self.submitted_count += 1
+            self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        self.metrics.observe(STAGE_SAVE_QUEUE, time.perf_counter() - perf_start_time)
+
+        return True
+
+    def flush(self) -> None:
+        """
+        block until every queued image has been written
+        """
+        self._queue.join()
+
+    def stop(self) -> None:
+        """
+        flush queued images and stop the writer threads
+        """
+        if not self._running:
+            return
+
+        self.flush()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+        self._threads = []
+        self._running = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            written_count = max(1, self.written_count)
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self.max_queue_depth,
+                'submitted': self.submitted_count,
+                'written': self.written_count,
+                'dropped': self.dropped_count,
+                'errors': self.error_count,
+                'bytes_written': self.bytes_written,
+                'encode_seconds_avg': self.encode_seconds_total / written_count,
+                'encode_seconds_max': self.encode_seconds_max,
+                'write_seconds_avg': self.write_seconds_total / written_count,
+                'write_seconds_max': self.write_seconds_max,
+            }
+
+    def log_stats(self, level=logging.INFO) -> None:
+        stats = self.get_stats()
+        self._log(f'Image writer: queue depth {stats["queue_depth"]} (max {stats["max_queue_depth"]}), '
+                  f'written {stats["written"]}, dropped {stats["dropped"]}, errors {stats["errors"]}, '
+                  f'encode avg/max {stats["encode_seconds_avg"]:0.4f}/{stats["encode_seconds_max"]:0.4f}s, '
+                  f'write avg/max {stats["write_seconds_avg"]:0.4f}/{stats["write_seconds_max"]:0.4f}s', level)
+
+    @staticmethod
+    def _prepare_item(item: Tuple[str, Any, bool, str, Any]) -> Tuple[str, Any, str, Any]:
+        image_full_path, image_array, copy_data, thumbnail_path, written_data = item
+        return image_full_path, (image_array.copy() if copy_data else image_array), thumbnail_path, written_data
+
+    def _count_drop(self, image_full_path: str) -> None:
+        with self._stats_lock:
+            self.dropped_count += 1
+        self.metrics.inc('image_writer_dropped')
+        self._log(f'Image writer queue full; dropped file: {image_full_path.split("/")[-1]}', logging.WARNING)
+
+    def _worker(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, image_full_path: str, image_array: Any, thumbnail_path: str = '',
+               written_data: Any = None) -> None:
+        try:
+            perf_start_time = time.perf_counter()
+            extension = '.' + image_full_path.rsplit('.', 1)[-1]
+            params = self.jpeg_params if extension.lower() in ['.jpg', '.jpeg'] else []
+            success, encoded_image = cv2.imencode(extension, image_array, params)
+            if not success:
+                raise IOError(f'Unable to encode image: {image_full_path}')
+            encode_seconds = time.perf_counter() - perf_start_time
+
+            perf_start_time = time.perf_counter()
+            self._write_file(image_full_path, encoded_image.tobytes())
+            write_seconds = time.perf_counter() - perf_start_time
+
+            with self._stats_lock:
+                self.written_count += 1
+                self.bytes_written += encoded_image.size
+                self.encode_seconds_total += encode_seconds
+                self.encode_seconds_max = max(self.encode_seconds_max, encode_seconds)
+                self.write_seconds_total += write_seconds
+                self.write_seconds_max = max(self.write_seconds_max, write_seconds)
+            self.metrics.observe(STAGE_ENCODE, encode_seconds)
+            self.metrics.observe(STAGE_WRITE, write_seconds)
+            self.metrics.inc('images_written')
+            self.metrics.inc('image_bytes_written', encoded_image.size)
+            if self.written_callback is not None:
+                self.written_callback(image_full_path, encoded_image.size, written_data)
+
+            if thumbnail_path != '':
+                self._write_thumbnail(thumbnail_path, image_array)
+        except Exception:
+            with self._stats_lock:
+                self.error_count += 1
+            self.metrics.inc('image_writer_errors')
+            self._log(traceback.format_exc(), logging.ERROR)
+
+    def _write_file(self, file_path: str, data: bytes) -> None:
+        try:
+            with open(file_path, 'wb') as output_file:
+                output_file.write(data)
+        except FileNotFoundError:
+            self._log(f'Directory missing; creating it again: {os.path.dirname(file_path)}', logging.WARNING)
+            self.directory_callback(os.path.dirname(file_path))
+            with open(file_path, 'wb') as output_file:
+                output_file.write(data)
+
+    def _write_thumbnail(self, thumbnail_path: str, image_array: Any) -> None:
+
+        image_height, image_width = image_array.shape[:2]
+        thumbnail_size = (self.thumbnail_width, max(1, round(image_height * self.thumbnail_width / image_width)))
+
+        # skip rows and columns first, so the area resize only averages about 2x2 pixels per thumbnail pixel
+        step = max(1, image_width // (self.thumbnail_width * 2))
+        thumbnail = cv2.resize(image_array[::step, ::step], thumbnail_size, interpolation=cv2.INTER_AREA)
+
+        success, encoded_image = cv2.imencode('.jpg', thumbnail, self.thumbnail_params)
+        if not success:
+            raise IOError(f'Unable to encode thumbnail: {thumbnail_path}')
+        # replaced as a whole: contact sheet updates may read thumbnails while the camera is running
+        temporary_path = f'{thumbnail_path}.tmp'
+        self._write_file(temporary_path, encoded_image.tobytes())
+        os.replace(temporary_path, thumbnail_path)
+
+        with self._stats_lock:
+            self.thumbnail_count += 1
+        self.metrics.inc('thumbnails_written')
+        if self.written_callback is not None:
+            self.written_callback(thumbnail_path, encoded_image.size, None)
@@ -0,0 +1,180 @@
+import bisect
+import logging
+import os
+import traceback
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+STAGE_CAPTURE = 'capture'
+STAGE_CROP = 'crop'
+STAGE_PREPROCESS = 'preprocess'
+STAGE_DIFF = 'diff'
+STAGE_SAVE_QUEUE = 'save_queue'
+STAGE_ENCODE = 'encode'
+STAGE_WRITE = 'write'
+STAGES = [STAGE_CAPTURE, STAGE_CROP, STAGE_PREPROCESS, STAGE_DIFF, STAGE_SAVE_QUEUE, STAGE_ENCODE, STAGE_WRITE]
+
+# seconds; from sub-millisecond crops on a desktop to multi-second captures on a Raspberry Pi Zero
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                                      2.5, 5.0, 10.0)
+METRIC_PREFIX = 'camknows'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets: Tuple[float, ...] = buckets
+        self.counts: List[int] = [0] * (len(buckets) + 1)  # the last count is the +Inf bucket
+        self.sum: float = 0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    stage latency histograms, counters and gauges, exported in the Prometheus text format
+    the text file is rewritten atomically every export_seconds (ex: for the node_exporter textfile collector),
+    and served over http when http_port is set
+    when disabled, observe() and inc() return immediately, so instrumented code can always call them
+    """
+
+    def __init__(self, enabled: bool = False, textfile_path: str = '', export_seconds: float = 15,
+                 http_host: str = '127.0.0.1', http_port: int = 0, log: Optional[Callable[..., None]] = None):
+        self.enabled: bool = enabled
+        self.textfile_path: str = textfile_path
+        self.export_seconds: float = max(1.0, export_seconds)
+        self.http_host: str = http_host
+        self.http_port: int = http_port
+        self._log: Callable[..., None] = log if log is not None else (lambda message, level=logging.NOTSET: None)
+
+        self._lock = Lock()
+        self._histograms: Dict[str, Histogram] = {stage: Histogram() for stage in STAGES}
+        self._counters: Dict[str, float] = {}
+        # gauges are read when exported, so they cost nothing between exports
+        self._gauges: Dict[str, Callable[[], float]] = {}
+        self._stop_event = Event()
+        self._export_thread: Optional[Thread] = None
+        self._http_server: Any = None
+
+    def observe(self, stage: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._histograms[stage].observe(seconds)
+
+    def inc(self, name: str, amount: float = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def add_gauge(self, name: str, read_value: Callable[[], float]) -> None:
+        self._gauges[name] = read_value
+
+    def start(self) -> None:
+        if not self.enabled or self._export_thread is not None:
+            return
+
+        self._stop_event.clear()
+        if self.textfile_path != '':
+            os.makedirs(os.path.dirname(os.path.abspath(self.textfile_path)), exist_ok=True)
+            self._export_thread = Thread(target=self._export_loop, name='metrics-export', daemon=True)
+            self._export_thread.start()
+
+        if self.http_port > 0:
+            from http.server import ThreadingHTTPServer  # deferred: slow to import, and only needed for http
+            self._http_server = ThreadingHTTPServer((self.http_host, self.http_port), self._create_handler())
+            self._http_server.daemon_threads = True
+            Thread(target=self._http_server.serve_forever, name='metrics-http', daemon=True).start()
+            self._log(f'Metrics available at http://{self.http_host}:{self.http_port}/metrics', logging.INFO)
+
+    def stop(self) -> None:
+        """
+        stop exporting; the text file is written one last time
+        """
+        if self._export_thread is not None:
+            self._stop_event.set()
+            self._export_thread.join()
+            self._export_thread = None
+
+        if self._http_server is not None:
+            self._http_server.shutdown()
+            self._http_server.server_close()
+            self._http_server = None
+
+    def render(self) -> str:
+        lines: List[str] = []
+
+        with self._lock:
+            histograms = [(stage, list(histogram.counts), histogram.sum, histogram.count, histogram.buckets)
+                          for stage, histogram in self._histograms.items()]
+            counters = sorted(self._counters.items())
+
+        name = f'{METRIC_PREFIX}_stage_seconds'
+        lines.append(f'# HELP {name} Time spent in each processing stage.')
+        lines.append(f'# TYPE {name} histogram')
+        for stage, counts, histogram_sum, histogram_count, buckets in histograms:
+            cumulative_count = 0
+            for upper_bound, count in zip(buckets, counts):
+                cumulative_count += count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{upper_bound}"}} {cumulative_count}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram_count}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {histogram_sum:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {histogram_count}')
+
+        for counter_name, value in counters:
+            name = f'{METRIC_PREFIX}_{counter_name}_total'
+            lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name} {value:g}')
+
+        for gauge_name, read_value in sorted(self._gauges.items()):
+            name = f'{METRIC_PREFIX}_{gauge_name}'
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {float(read_value()):g}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self) -> None:
+        # written to a temporary file and renamed, so readers never see a partial file
+        temporary_path = f'{self.textfile_path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w') as textfile:
+            textfile.write(self.render())
+        os.replace(temporary_path, self.textfile_path)
+
+    def _export_loop(self) -> None:
+        while True:
+            stopping = self._stop_event.wait(self.export_seconds)
+            try:
+                self.write_textfile()
+            except Exception:
+                self._log(traceback.format_exc(), logging.ERROR)
+            if stopping:
+                return
+
+    def _create_handler(self) -> type:
+        from http.server import BaseHTTPRequestHandler
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self) -> None:
+                if self.path.split('?')[0] not in ['/', '/metrics']:
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format_string: str, *args) -> None:
+                # requests are not logged
+                pass
+
+        return MetricsHandler
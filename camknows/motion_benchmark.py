@@ -0,0 +1,96 @@
+import resource
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, List, Tuple
+
+import cv2
+import numpy as np
+
+from frame_sources import SyntheticFrameSource
+from motion_detector import MotionDetector
+
+FRAME_COUNT = 200
+PATHS = ['legacy', 'buffered']
+
+
+def legacy_motion_check(motion_image_percent: float) -> Callable[[Any], Any]:
+    """
+    the allocating motion check used before MotionDetector: resize, gray, blur, absdiff and sum per frame
+    """
+    state = {'previous_image': None}
+
+    def check(image_array: Any) -> Any:
+        motion_image_width = int(image_array.shape[1] * (motion_image_percent / 100.0))
+        motion_image_height = int(image_array.shape[0] * (motion_image_width / float(image_array.shape[1])))
+        processed_image = cv2.resize(image_array, (motion_image_width, motion_image_height),
+                                     interpolation=cv2.INTER_AREA)
+        processed_image = cv2.cvtColor(processed_image, cv2.COLOR_BGR2GRAY)
+        processed_image = cv2.blur(processed_image, (21, 21))
+        diff_score = None
+        if state['previous_image'] is not None:
+            diff_score = np.sum(cv2.absdiff(state['previous_image'], processed_image))
+        state['previous_image'] = processed_image
+        return diff_score
+
+    return check
+
+
+def buffered_motion_check(motion_image_percent: float) -> Callable[[Any], Any]:
+    motion_detector = MotionDetector(motion_image_percent)
+
+    def check(image_array: Any) -> Any:
+        diff_score = motion_detector.process(image_array)
+        motion_detector.advance()
+        return diff_score
+
+    return check
+
+
+def measure(check: Callable[[Any], Any], frames: List[Any]) -> Tuple[List[float], int]:
+    """
+    return per-frame seconds and peak traced allocation bytes
+    """
+    frame_seconds: List[float] = []
+
+    tracemalloc.start()
+    for frame in frames:
+        perf_start_time = time.perf_counter()
+        check(frame)
+        frame_seconds.append(time.perf_counter() - perf_start_time)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return frame_seconds, peak_bytes
+
+
+def main() -> None:
+    resolution = (1024, 768)
+    motion_image_percent = float(sys.argv[1]) if len(sys.argv) > 1 else 100
+    # peak RSS only grows, so compare paths in separate runs, ex: python3 motion_benchmark.py 100 legacy
+    path_names = [sys.argv[2]] if len(sys.argv) > 2 and sys.argv[2] in PATHS else PATHS
+
+    motion_frames = [[FRAME_COUNT // 4, FRAME_COUNT // 2]]
+    frame_source = SyntheticFrameSource(resolution, FRAME_COUNT, motion_frames, max_speed=True)
+    with frame_source:
+        frames = list(frame_source.frames())
+    # ru_maxrss is reported in kilobytes on linux
+    frames_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f'Motion check benchmark: {FRAME_COUNT} frames at {resolution[0]}x{resolution[1]}, '
+          f'motion_image_percent {motion_image_percent}')
+    print('PATH\t\tMEAN MS\tP95 MS\tPEAK ALLOCATED MB')
+
+    check_factories = {'legacy': legacy_motion_check, 'buffered': buffered_motion_check}
+    for name in path_names:
+        check_factory = check_factories[name]
+        frame_seconds, peak_bytes = measure(check_factory(motion_image_percent), frames)
+        print(f'{name}\t\t{np.mean(frame_seconds) * 1000:0.3f}\t{np.percentile(frame_seconds, 95) * 1000:0.3f}\t'
+              f'{peak_bytes / 1024 / 1024:0.2f}')
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'Peak RSS: {peak_rss_mb:0.1f} MB, {peak_rss_mb - frames_rss_mb:0.1f} MB over the loaded frames')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,430 @@
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+BLUR_SIZE = (21, 21)
+MASK_INCLUDE = 'include'
+MASK_EXCLUDE = 'exclude'
+
+
+class MotionDetector:
+    """
+    motion scoring with a preallocated working set of buffers, sized from the first image and reused
+    the previous and current motion frames are swapped by advance() instead of being copied
+
+    optional regions: masks are include/exclude polygons in image coordinates; only the bounding box of
+    included pixels is processed. grid is (columns, rows); per-cell diff sums come from one integral image
+
+    optional coarse-to-fine: with pyramid_levels > 0, each frame is first scored at 1 / 2 ** pyramid_levels of the
+    motion image size. Frames whose scaled coarse score is outside escalation_band (multiples of diff_threshold;
+    an upper bound of 0 means no upper bound) return that estimate without the full diff. Their motion frame is only
+    computed when needed: for estimates over diff_threshold, or by finish_motion_image(). The source of an early exit
+    frame is copied, so an escalated frame is always compared with the full motion frame of the previous frame
+    """
+
+    def __init__(self, motion_image_percent: float = 100, grid: Tuple[int, int] = (0, 0),
+                 masks: Optional[List[Dict[str, Any]]] = None, cell_threshold: int = 0,
+                 cell_thresholds: Optional[List[List[int]]] = None, diff_threshold: int = 0,
+                 pyramid_levels: int = 0, escalation_band: Tuple[float, float] = (0.5, 0)):
+        self.motion_image_percent: float = motion_image_percent
+        self.grid: Tuple[int, int] = (grid[0], grid[1]) if grid[0] > 0 and grid[1] > 0 else (0, 0)
+        self.masks: List[Dict[str, Any]] = masks if masks is not None else []
+        self.cell_threshold: int = cell_threshold
+        self.cell_thresholds: Optional[List[List[int]]] = cell_thresholds
+        self.diff_threshold: int = diff_threshold
+        self.pyramid_levels: int = max(0, pyramid_levels)
+        self.escalation_band: Tuple[float, float] = (escalation_band[0], escalation_band[1])
+        self.image_shape: Optional[Tuple[int, ...]] = None
+        self.region: Tuple[int, int, int, int] = (0, 0, 0, 0)  # x, y, width, height of the processed image area
+        self.motion_size: Tuple[int, int] = (0, 0)
+        self.cell_scores: Any = None  # rows x columns diff sums for the last frame, when grid is configured
+        self.previous_image: Any = None  # None until the first frame has been advanced
+        self.current_image: Any = None
+        self._resized_image: Any = None
+        self._gray_image: Any = None
+        self._spare_image: Any = None
+        self._motion_mask: Any = None
+        self._diff_image: Any = None
+        self._integral_image: Any = None
+        self._cell_edges: Tuple[Any, Any] = (None, None)
+        self._cell_threshold_array: Any = None
+        self._coarse_size: Tuple[int, int] = (0, 0)
+        self._coarse_blur_size: Tuple[int, int] = BLUR_SIZE
+        self._coarse_score_scale: float = 1
+        self._coarse_full_gray_image: Any = None
+        self._coarse_gray_image: Any = None
+        self._coarse_mask: Any = None
+        self._previous_coarse_image: Any = None
+        self._current_coarse_image: Any = None
+        self._coarse_spare_image: Any = None
+        self._fine_image_processed: bool = False
+        self._fine_baseline_stale: bool = False  # previous_image is to be computed from _previous_region_image
+        self._previous_region_image: Any = None  # processed region of the previous frame, after an early exit
+        self._region_image: Any = None  # processed region of the current frame, for finish_motion_image()
+
+        self.frame_count: int = 0
+        # per-stage split of the last frame's time; the coarse score counts as preprocessing
+        self.last_preprocess_seconds: float = 0
+        self.last_diff_seconds: float = 0
+        self.seconds_total: float = 0
+        self.seconds_max: float = 0
+        self.early_exit_count: int = 0
+        self.escalated_count: int = 0
+
+    def process(self, image_array: Any) -> Optional[int]:
+        """
+        compute the motion frame for a BGR or grayscale (ex: YUV luma plane) image into current_image
+        returns the diff score against previous_image, or None for the first frame
+        """
+        perf_start_time = time.perf_counter()
+
+        if image_array.shape != self.image_shape:
+            self._allocate(image_array.shape)
+
+        region_x, region_y, region_width, region_height = self.region
+        image_array = image_array[region_y:region_y + region_height, region_x:region_x + region_width]
+
+        self._fine_image_processed = False
+        self._region_image = image_array
+        if self._coarse_gray_image is not None:
+            coarse_score = self._get_coarse_score(image_array)
+            if coarse_score is not None and self.previous_image is not None and self._is_outside_band(coarse_score):
+                self.early_exit_count += 1
+                if coarse_score > self.diff_threshold:
+                    # motion: the frame is hashed and saved, so current_image has to match the score
+                    self.finish_motion_image()
+                return self._get_coarse_result(coarse_score, perf_start_time)
+            self.escalated_count += 1
+            if self._fine_baseline_stale:
+                # the previous frame exited early; comparing with an older frame would add up slow changes
+                # (ex: daylight) to a motion score
+                self._finish_motion_frame(self._get_gray_image(self._previous_region_image), self.previous_image)
+                self._fine_baseline_stale = False
+
+        self._fine_image_processed = True
+        self._finish_motion_frame(self._get_gray_image(image_array), self.current_image)
+
+        perf_diff_start_time = time.perf_counter()
+        diff_score = self._get_diff_score(self.previous_image, self.current_image)
+        self.last_preprocess_seconds = perf_diff_start_time - perf_start_time
+        self.last_diff_seconds = time.perf_counter() - perf_diff_start_time
+        self._count_time(perf_start_time)
+
+        return diff_score
+
+    def advance(self) -> None:
+        """
+        make the current motion frame the previous one; the old previous buffer is reused for the next frame
+        """
+        if self._coarse_gray_image is not None:
+            self._previous_coarse_image, self._current_coarse_image = (self._current_coarse_image,
+                                                                       self._previous_coarse_image)
+
+        if not self._fine_image_processed:
+            if self._region_image is not None:
+                # early exit: a copy is much cheaper than the full motion frame, which is only needed if the next
+                # frame escalates; capture buffers are reused
+                np.copyto(self._previous_region_image, self._region_image)
+                self._fine_baseline_stale = True
+            self._region_image = None
+            return
+
+        self._fine_baseline_stale = False
+        self._region_image = None
+
+        if self.previous_image is None:
+            self.previous_image = self.current_image
+            self.current_image = self._spare_image
+            self._spare_image = None
+        else:
+            self.previous_image, self.current_image = self.current_image, self.previous_image
+
+    def finish_motion_image(self) -> Any:
+        """
+        current_image for the last processed frame, computing it after an early exit (ex: for a time-lapse image)
+        call before advance(); the frame then becomes the baseline for the next frame
+        """
+        if not self._fine_image_processed and self._region_image is not None:
+            self._finish_motion_frame(self._get_gray_image(self._region_image), self.current_image)
+            self._fine_image_processed = True
+        return self.current_image
+
+    def get_motion_shape(self, image_shape: Tuple[int, ...]) -> Tuple[int, int]:
+        """
+        (height, width) of motion frames for images of image_shape
+        """
+        if image_shape != self.image_shape:
+            self._allocate(image_shape)
+        return self.motion_size[1], self.motion_size[0]
+
+    def preprocess(self, image_array: Any, motion_image: Any) -> None:
+        """
+        compute the motion frame for image_array into motion_image, an array of get_motion_shape()
+        (ex: in shared memory); with score(), for callers that keep motion frames themselves
+        the coarse-to-fine path is not used
+        """
+        if image_array.shape != self.image_shape:
+            self._allocate(image_array.shape)
+
+        region_x, region_y, region_width, region_height = self.region
+        image_array = image_array[region_y:region_y + region_height, region_x:region_x + region_width]
+        self._finish_motion_frame(self._get_gray_image(image_array), motion_image)
+
+    def score(self, previous_image: Any, current_image: Any) -> int:
+        """
+        diff score between two motion frames from preprocess(); sets cell_scores when grid is configured
+        """
+        return self._get_diff_score(previous_image, current_image)
+
+    def restore_previous_image(self, image_shape: Tuple[int, ...], motion_image: Any) -> bool:
+        """
+        seed previous_image (ex: from a state snapshot) for images of image_shape
+        returns False if motion_image doesn't match the motion frame size for the current settings
+        """
+        if image_shape != self.image_shape:
+            self._allocate(image_shape)
+
+        if motion_image.shape != self.current_image.shape or motion_image.dtype != np.uint8:
+            return False
+
+        self._fine_baseline_stale = False
+
+        if self.previous_image is not None:
+            np.copyto(self.previous_image, motion_image)
+            return True
+
+        np.copyto(self._spare_image, motion_image)
+        self.previous_image = self._spare_image
+        self._spare_image = None
+        return True
+
+    def get_seconds_average(self) -> float:
+        return self.seconds_total / max(1, self.frame_count)
+
+    def get_hot_cells(self) -> List[Tuple[int, int, int]]:
+        """
+        (row, column, score) for grid cells over their threshold in the last frame
+        """
+        if self.cell_scores is None or self._cell_threshold_array is None:
+            return []
+
+        rows, columns = np.nonzero(self.cell_scores > self._cell_threshold_array)
+        return [(int(row), int(column), int(self.cell_scores[row, column])) for row, column in zip(rows, columns)]
+
+    def has_cell_thresholds(self) -> bool:
+        return self._cell_threshold_array is not None
+
+    def get_max_cell(self) -> Optional[Tuple[int, int, int]]:
+        if self.cell_scores is None:
+            return None
+
+        row, column = np.unravel_index(int(np.argmax(self.cell_scores)), self.cell_scores.shape)
+        return int(row), int(column), int(self.cell_scores[row, column])
+
+    def _allocate(self, image_shape: Tuple[int, ...]) -> None:
+        image_height, image_width = image_shape[:2]
+        image_mask = self._build_image_mask(image_width, image_height)
+
+        if image_mask is not None:
+            self.region = cv2.boundingRect(image_mask)
+            if self.region[2] == 0 or self.region[3] == 0:
+                raise ValueError('Motion masks exclude the entire image')
+        else:
+            self.region = (0, 0, image_width, image_height)
+
+        region_x, region_y, region_width, region_height = self.region
+        motion_width = int(region_width * (self.motion_image_percent / 100.0))
+        motion_height = int(region_height * (motion_width / float(region_width)))
+
+        self.image_shape = image_shape
+        self.motion_size = (motion_width, motion_height)
+        self._resized_image = (np.empty((motion_height, motion_width) + tuple(image_shape[2:]), dtype=np.uint8)
+                               if (motion_width, motion_height) != (region_width, region_height) else None)
+        self._gray_image = np.empty((motion_height, motion_width), dtype=np.uint8)
+        self.current_image = np.empty((motion_height, motion_width), dtype=np.uint8)
+        self._spare_image = np.empty((motion_height, motion_width), dtype=np.uint8)
+
+        self._motion_mask = None
+        if image_mask is not None:
+            region_mask = image_mask[region_y:region_y + region_height, region_x:region_x + region_width]
+            motion_mask = cv2.resize(region_mask, self.motion_size, interpolation=cv2.INTER_NEAREST)
+            if not np.all(motion_mask):
+                self._motion_mask = motion_mask
+
+        self.cell_scores = None
+        self._diff_image = None
+        self._integral_image = None
+        self._cell_threshold_array = None
+        if self.grid != (0, 0):
+            columns, rows = self.grid
+            self._diff_image = np.empty((motion_height, motion_width), dtype=np.uint8)
+            # float64 sums are exact for any image size a camera can produce
+            self._integral_image = np.empty((motion_height + 1, motion_width + 1), dtype=np.float64)
+            self._cell_edges = (np.linspace(0, motion_height, rows + 1).astype(int),
+                                np.linspace(0, motion_width, columns + 1).astype(int))
+            self._cell_threshold_array = self._build_cell_thresholds(rows, columns)
+
+        self._allocate_coarse(image_shape, image_mask)
+
+        # a new size has nothing to compare against
+        self.previous_image = None
+        self._fine_baseline_stale = False
+
+    def _allocate_coarse(self, image_shape: Tuple[int, ...], image_mask: Optional[Any]) -> None:
+        self._coarse_gray_image = None
+        self._previous_region_image = None
+        if self.pyramid_levels == 0:
+            return
+
+        motion_width, motion_height = self.motion_size
+        pyramid_scale = 2 ** self.pyramid_levels
+        coarse_width = max(1, motion_width // pyramid_scale)
+        coarse_height = max(1, motion_height // pyramid_scale)
+        # odd blur size, scaled down with the image
+        blur_size = max(3, (BLUR_SIZE[0] // pyramid_scale) | 1)
+
+        self._coarse_size = (coarse_width, coarse_height)
+        self._coarse_blur_size = (blur_size, blur_size)
+        self._coarse_score_scale = (motion_width * motion_height) / float(coarse_width * coarse_height)
+        # color images are converted before area averaging, which is much faster on one channel
+        self._coarse_full_gray_image = (np.empty((self.region[3], self.region[2]), dtype=np.uint8)
+                                        if len(image_shape) == 3 else None)
+        self._coarse_gray_image = np.empty((coarse_height, coarse_width), dtype=np.uint8)
+        self._previous_coarse_image = None
+        self._current_coarse_image = np.empty((coarse_height, coarse_width), dtype=np.uint8)
+        self._coarse_spare_image = np.empty((coarse_height, coarse_width), dtype=np.uint8)
+
+        self._previous_region_image = np.empty((self.region[3], self.region[2]) + tuple(image_shape[2:]),
+                                               dtype=np.uint8)
+
+        self._coarse_mask = None
+        if self._motion_mask is not None:
+            self._coarse_mask = cv2.resize(self._motion_mask, self._coarse_size, interpolation=cv2.INTER_NEAREST)
+
+    def _get_coarse_score(self, image_array: Any) -> Optional[int]:
+        """
+        area averaging smooths sensor noise like the full size blur, so coarse scores are comparable to full scores;
+        the coarse blur and score cost a fraction of full processing
+        returns the coarse score scaled to motion image size, or None without a previous coarse frame
+        """
+        if image_array.ndim == 3:
+            cv2.cvtColor(image_array, cv2.COLOR_BGR2GRAY, dst=self._coarse_full_gray_image)
+            image_array = self._coarse_full_gray_image
+        cv2.resize(image_array, self._coarse_size, dst=self._coarse_gray_image, interpolation=cv2.INTER_AREA)
+        coarse_gray_image = self._coarse_gray_image
+
+        if self._previous_coarse_image is None:
+            # first coarse frame: fill the spare buffer so advance() has two buffers to swap
+            self._previous_coarse_image = self._coarse_spare_image
+            cv2.blur(coarse_gray_image, self._coarse_blur_size, dst=self._current_coarse_image)
+            cv2.blur(coarse_gray_image, self._coarse_blur_size, dst=self._previous_coarse_image)
+            return None
+
+        cv2.blur(coarse_gray_image, self._coarse_blur_size, dst=self._current_coarse_image)
+        coarse_score = cv2.norm(self._previous_coarse_image, self._current_coarse_image, cv2.NORM_L1,
+                                mask=self._coarse_mask)
+
+        return int(coarse_score * self._coarse_score_scale)
+
+    def _get_coarse_result(self, coarse_score: int, perf_start_time: float) -> int:
+        self.cell_scores = None
+        self.last_preprocess_seconds = time.perf_counter() - perf_start_time
+        self.last_diff_seconds = 0
+        self._count_time(perf_start_time)
+        return coarse_score
+
+    def _is_outside_band(self, coarse_score: int) -> bool:
+        if self._cell_threshold_array is not None or self.diff_threshold <= 0:
+            # per-cell thresholds need full resolution cell scores
+            return False
+
+        lower_bound, upper_bound = self.escalation_band
+        if coarse_score < self.diff_threshold * lower_bound:
+            return True
+
+        return upper_bound > 0 and coarse_score > self.diff_threshold * upper_bound
+
+    def _build_image_mask(self, image_width: int, image_height: int) -> Optional[Any]:
+        """
+        255 for processed pixels; an exclude-only mask list starts from the whole image
+        """
+        if not self.masks:
+            return None
+
+        include_all = all(mask['mode'] == MASK_EXCLUDE for mask in self.masks)
+        image_mask = np.full((image_height, image_width), 255 if include_all else 0, dtype=np.uint8)
+
+        for mask in self.masks:
+            if mask['mode'] not in [MASK_INCLUDE, MASK_EXCLUDE]:
+                raise ValueError(f'Invalid motion mask mode: {mask["mode"]}')
+            polygon = np.array(mask['polygon'], dtype=np.int32).reshape((-1, 1, 2))
+            cv2.fillPoly(image_mask, [polygon], 255 if mask['mode'] == MASK_INCLUDE else 0)
+
+        return image_mask
+
+    def _build_cell_thresholds(self, rows: int, columns: int) -> Optional[Any]:
+        """
+        cell_thresholds (rows x columns) override cell_threshold; 0 uses cell_threshold
+        with no thresholds set, cells are scored for reporting only
+        """
+        if self.cell_threshold <= 0 and self.cell_thresholds is None:
+            return None
+
+        thresholds = np.full((rows, columns), self.cell_threshold, dtype=np.int64)
+        if self.cell_thresholds is not None:
+            overrides = np.array(self.cell_thresholds, dtype=np.int64)
+            if overrides.shape != (rows, columns):
+                raise ValueError(f'Motion cell thresholds must be {rows} rows of {columns} columns')
+            thresholds = np.where(overrides > 0, overrides, thresholds)
+
+        # cells with no threshold never trigger
+        return np.where(thresholds > 0, thresholds, np.iinfo(np.int64).max)
+
+    def _get_gray_image(self, image_array: Any) -> Any:
+        """
+        image_array (already limited to the processed region) resized and converted to gray, in reused buffers
+        """
+        source_image = image_array
+        if self._resized_image is not None:
+            cv2.resize(image_array, self.motion_size, dst=self._resized_image, interpolation=cv2.INTER_AREA)
+            source_image = self._resized_image
+
+        if source_image.ndim == 3:
+            cv2.cvtColor(source_image, cv2.COLOR_BGR2GRAY, dst=self._gray_image)
+            source_image = self._gray_image
+
+        return source_image
+
+    @staticmethod
+    def _finish_motion_frame(gray_image: Any, motion_image: Any) -> None:
+        cv2.blur(gray_image, BLUR_SIZE, dst=motion_image)
+
+    def _get_diff_score(self, previous_image: Any, current_image: Any) -> Optional[int]:
+        self.cell_scores = None
+
+        if previous_image is None:
+            return None
+
+        if self._integral_image is None:
+            # L1 norm of the difference: the sum of absdiff, without a diff image or int64 temporary
+            return int(cv2.norm(previous_image, current_image, cv2.NORM_L1, mask=self._motion_mask))
+
+        cv2.absdiff(previous_image, current_image, dst=self._diff_image)
+        if self._motion_mask is not None:
+            cv2.bitwise_and(self._diff_image, self._motion_mask, dst=self._diff_image)
+        cv2.integral(self._diff_image, sum=self._integral_image, sdepth=cv2.CV_64F)
+
+        # cell sum from the four integral image corners of every cell at once
+        row_edges, column_edges = self._cell_edges
+        corners = self._integral_image[np.ix_(row_edges, column_edges)].astype(np.int64)
+        self.cell_scores = corners[1:, 1:] - corners[:-1, 1:] - corners[1:, :-1] + corners[:-1, :-1]
+
+        return int(self._integral_image[-1, -1])
+
+    def _count_time(self, perf_start_time: float) -> None:
+        elapsed_seconds = time.perf_counter() - perf_start_time
+        self.frame_count += 1
+        self.seconds_total += elapsed_seconds
+        self.seconds_max = max(self.seconds_max, elapsed_seconds)
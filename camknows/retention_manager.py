@@ -0,0 +1,212 @@
+import datetime
+import logging
+import os
+import shutil
+import time
+import traceback
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, List, Optional, Set
+
+BYTES_PER_GB = 1000 * 1000 * 1000
+
+
+class RetentionManager:
+    """
+    keeps main_directory within a disk quota by deleting whole day directories (YYYY/MM/DD), oldest first
+    usage per day is scanned once at startup, then tracked as files are written, so the tree is never rescanned
+    policies (0 disables each): max_bytes of saved files, min_free_bytes on the disk, max_age_days
+    the current day is never deleted. existing day directories are cached, so saves don't check the file system
+    """
+
+    def __init__(self, main_directory: str, max_bytes: int = 0, min_free_bytes: int = 0, max_age_days: int = 0,
+                 check_seconds: float = 300, log: Optional[Callable[..., None]] = None,
+                 deleted_callback: Optional[Callable[[str], None]] = None):
+        self.main_directory: str = main_directory
+        self.max_bytes: int = max_bytes
+        self.min_free_bytes: int = min_free_bytes
+        self.max_age_days: int = max_age_days
+        self.check_seconds: float = max(1.0, check_seconds)
+        self._log: Callable[..., None] = log if log is not None else (lambda message, level=logging.NOTSET: None)
+        # called with the day ('YYYY/MM/DD') after its directory is deleted
+        self._deleted_callback: Optional[Callable[[str], None]] = deleted_callback
+
+        self._lock = Lock()
+        self._day_bytes: Dict[str, int] = {}
+        self._existing_directories: Set[str] = set()
+        self._stop_event = Event()
+        self._thread: Optional[Thread] = None
+
+        self.deleted_day_count: int = 0
+        self.deleted_bytes: int = 0
+
+    def is_enabled(self) -> bool:
+        return self.max_bytes > 0 or self.min_free_bytes > 0 or self.max_age_days > 0
+
+    def start(self) -> None:
+        if not self.is_enabled() or self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = Thread(target=self._run, name='retention-manager', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def get_day_directory(self, day: Optional[datetime.date] = None) -> str:
+        """
+        main_directory/YYYY/MM/DD for day (default today), created if needed
+        """
+        day = day if day is not None else datetime.date.today()
+        return self.ensure_directory(os.path.join(self.main_directory, day.strftime('%Y/%m/%d')))
+
+    def ensure_directory(self, directory_path: str) -> str:
+        if directory_path not in self._existing_directories:
+            os.makedirs(directory_path, exist_ok=True)
+            with self._lock:
+                self._existing_directories.add(directory_path)
+        return directory_path
+
+    def recreate_directory(self, directory_path: str) -> str:
+        """
+        ensure_directory() for a cached directory that was removed outside the retention sweep (ex: over a file share)
+        """
+        with self._lock:
+            self._existing_directories.discard(directory_path)
+        return self.ensure_directory(directory_path)
+
+    def add_file(self, file_path: str, size_bytes: int) -> None:
+        """
+        count a written file, including files in day subdirectories (ex: processed images)
+        """
+        day = self._get_day(file_path)
+        if day is None:
+            return
+        with self._lock:
+            self._day_bytes[day] = self._day_bytes.get(day, 0) + size_bytes
+
+    def get_total_bytes(self) -> int:
+        with self._lock:
+            return sum(self._day_bytes.values())
+
+    def enforce(self) -> None:
+        """
+        delete the oldest day directories until every policy is met
+        """
+        today = datetime.date.today().strftime('%Y/%m/%d')
+        oldest_kept_day = ((datetime.date.today() - datetime.timedelta(days=self.max_age_days)).strftime('%Y/%m/%d')
+                           if self.max_age_days > 0 else '')
+
+        while not self._stop_event.is_set():
+            with self._lock:
+                days = sorted(self._day_bytes)
+                total_bytes = sum(self._day_bytes.values())
+            if not days or days[0] >= today:
+                return
+
+            oldest_day = days[0]
+            reasons: List[str] = []
+            if self.max_bytes > 0 and total_bytes > self.max_bytes:
+                reasons.append(f'{total_bytes / BYTES_PER_GB:0.2f} GB used')
+            if self.min_free_bytes > 0:
+                free_bytes = shutil.disk_usage(self.main_directory).free
+                if free_bytes < self.min_free_bytes:
+                    reasons.append(f'{free_bytes / BYTES_PER_GB:0.2f} GB free')
+            if oldest_kept_day != '' and oldest_day < oldest_kept_day:
+                reasons.append(f'older than {self.max_age_days} days')
+            if not reasons:
+                return
+
+            self._delete_day(oldest_day, ', '.join(reasons))
+
+    def _run(self) -> None:
+        try:
+            # background work only: lower this thread's priority (threads have their own nice value on linux)
+            os.nice(10)
+        except (AttributeError, OSError):
+            pass
+
+        try:
+            self._scan_days()
+        except Exception:
+            self._log(traceback.format_exc(), logging.ERROR)
+
+        while True:
+            try:
+                self.enforce()
+            except Exception:
+                self._log(traceback.format_exc(), logging.ERROR)
+            if self._stop_event.wait(self.check_seconds):
+                return
+
+    def _scan_days(self) -> None:
+        """
+        one-time scan of existing day directories; files written during the scan may be counted twice,
+        which only makes deletion slightly early
+        """
+        perf_start_time = time.perf_counter()
+
+        for year_entry in _scan_numbered_directories(self.main_directory):
+            for month_entry in _scan_numbered_directories(year_entry.path):
+                for day_entry in _scan_numbered_directories(month_entry.path):
+                    day = f'{year_entry.name}/{month_entry.name}/{day_entry.name}'
+                    day_bytes = _get_directory_bytes(day_entry.path)
+                    with self._lock:
+                        self._day_bytes[day] = self._day_bytes.get(day, 0) + day_bytes
+
+        self._log(f'Retention: {len(self._day_bytes)} days, {self.get_total_bytes() / BYTES_PER_GB:0.2f} GB '
+                  f'scanned in {time.perf_counter() - perf_start_time:0.2f} seconds', logging.INFO)
+
+    def _delete_day(self, day: str, reason: str) -> None:
+        day_directory = os.path.join(self.main_directory, *day.split('/'))
+
+        with self._lock:
+            day_bytes = self._day_bytes.pop(day, 0)
+            self._existing_directories = {directory for directory in self._existing_directories
+                                          if not directory.startswith(day_directory)}
+
+        self._log(f'Retention: deleting {day} ({day_bytes / BYTES_PER_GB:0.2f} GB): {reason}', logging.INFO)
+        shutil.rmtree(day_directory, ignore_errors=True)
+        self.deleted_day_count += 1
+        self.deleted_bytes += day_bytes
+
+        # remove month and year directories left empty
+        for directory in [os.path.dirname(day_directory), os.path.dirname(os.path.dirname(day_directory))]:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+
+        if self._deleted_callback is not None:
+            try:
+                self._deleted_callback(day)
+            except Exception:
+                self._log(traceback.format_exc(), logging.ERROR)
+
+    def _get_day(self, file_path: str) -> Optional[str]:
+        relative_parts = os.path.relpath(file_path, self.main_directory).split(os.sep)
+        if len(relative_parts) < 4 or not all(part.isdigit() for part in relative_parts[:3]):
+            return None
+        return '/'.join(relative_parts[:3])
+
+
+def _scan_numbered_directories(directory: str) -> List[os.DirEntry]:
+    try:
+        with os.scandir(directory) as entries:
+            return [entry for entry in entries if entry.is_dir() and entry.name.isdigit()]
+    except FileNotFoundError:
+        return []
+
+
+def _get_directory_bytes(directory: str) -> int:
+    total_bytes = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                total_bytes += _get_directory_bytes(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                total_bytes += entry.stat(follow_symlinks=False).st_size
+    return total_bytes
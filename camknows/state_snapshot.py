@@ -0,0 +1,54 @@
+import json
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+SNAPSHOT_VERSION = 1
+
+
+def get_motion_image_path(snapshot_path: str) -> str:
+    return f'{os.path.splitext(snapshot_path)[0]}_motion.npy'
+
+
+def save_state_snapshot(snapshot_path: str, state: Dict[str, Any], motion_image: Any = None) -> None:
+    """
+    write state (json values) and the last motion frame; each file is replaced atomically
+    the motion frame is written first, so a snapshot never refers to an older frame
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(snapshot_path)), exist_ok=True)
+    motion_image_path = get_motion_image_path(snapshot_path)
+
+    if motion_image is not None:
+        temporary_path = f'{motion_image_path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as motion_image_file:
+            np.save(motion_image_file, motion_image, allow_pickle=False)
+        os.replace(temporary_path, motion_image_path)
+
+    snapshot = dict(state, version=SNAPSHOT_VERSION, saved_time=time.time(), has_motion_image=motion_image is not None)
+    temporary_path = f'{snapshot_path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w') as snapshot_file:
+        json.dump(snapshot, snapshot_file)
+    os.replace(temporary_path, snapshot_path)
+
+
+def load_state_snapshot(snapshot_path: str, max_age_seconds: float) -> Optional[Tuple[Dict[str, Any], Any]]:
+    """
+    (state, motion image or None) if the snapshot is no older than max_age_seconds, otherwise None
+    raises OSError or ValueError for unreadable snapshots
+    """
+    if not os.path.exists(snapshot_path):
+        return None
+
+    with open(snapshot_path) as snapshot_file:
+        state = json.load(snapshot_file)
+
+    if state.get('version') != SNAPSHOT_VERSION or time.time() - state.get('saved_time', 0) > max_age_seconds:
+        return None
+
+    motion_image = None
+    if state.get('has_motion_image', False):
+        motion_image = np.load(get_motion_image_path(snapshot_path), allow_pickle=False)
+
+    return state, motion_image
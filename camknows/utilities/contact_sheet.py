@@ -0,0 +1,269 @@
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+import cv2
+import numpy as np
+
+from image_sequence import iter_day_directories, parse_time_range
+from media_catalog import CONTACT_SHEET_DIRECTORY, THUMBNAIL_DIRECTORY, TIMESTAMP_FILENAME_PATTERN
+
+STATE_VERSION = 1
+LABEL_FONT_SCALE = 0.4
+LABEL_HEIGHT = 14
+
+
+class SheetLayout(NamedTuple):
+    name: str
+    tile_width: int
+    tile_height: int
+    columns: int
+    rows: int
+    labels: bool  # capture time on each tile
+
+
+LAYOUTS: Dict[str, SheetLayout] = {
+    'contact-sheet': SheetLayout('contact-sheet', 240, 180, 6, 8, True),
+    'mosaic': SheetLayout('mosaic', 80, 60, 24, 24, False),
+}
+
+
+class ContactSheetBuilder:
+    """
+    contact sheet pages for one day directory, built from the thumbnails written by the camera
+    updates are incremental: new thumbnails are appended, and only the last, partial page is rendered again
+    (from its thumbnails, so pages don't lose quality from repeated jpeg encoding). Full pages are never touched
+    """
+
+    def __init__(self, day_directory: str, layout: SheetLayout, jpeg_quality: int = 85):
+        self.day_directory = day_directory
+        self.layout = layout
+        self.jpeg_params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        self.thumbnail_directory = os.path.join(day_directory, THUMBNAIL_DIRECTORY)
+        self.sheet_directory = os.path.join(day_directory, CONTACT_SHEET_DIRECTORY)
+        self.state_path = os.path.join(self.sheet_directory, f'{layout.name}.json')
+        self.images: List[str] = []  # thumbnail file names, in tile order
+
+    def update(self) -> int:
+        """
+        append new thumbnails to the pages; returns the number of thumbnails added
+        """
+        if not os.path.isdir(self.thumbnail_directory):
+            return 0
+
+        self._load_state()
+        included_images = set(self.images)
+        new_images = sorted(file_name for file_name in os.listdir(self.thumbnail_directory)
+                            if file_name.endswith('.jpg') and file_name not in included_images)
+        if len(new_images) == 0:
+            return 0
+
+        os.makedirs(self.sheet_directory, exist_ok=True)
+        page_size = self.layout.columns * self.layout.rows
+        first_page = len(self.images) // page_size
+        self.images.extend(new_images)
+
+        for page in range(first_page, (len(self.images) - 1) // page_size + 1):
+            page_images = self.images[page * page_size:(page + 1) * page_size]
+            rendered_images = self._write_page(page, page_images)
+            if len(rendered_images) < len(page_images):
+                # unreadable thumbnails (ex: still being written) are left for the next update
+                self.images = self.images[:page * page_size] + rendered_images
+                self._save_state()
+                return len(self.images) - len(included_images)
+
+        self._save_state()
+        return len(new_images)
+
+    def get_page_path(self, page: int) -> str:
+        return os.path.join(self.sheet_directory, f'{self.layout.name}-{page + 1:03d}.jpg')
+
+    def _write_page(self, page: int, page_images: List[str]) -> List[str]:
+        """
+        render the page from its thumbnails; returns the thumbnails rendered, stopping at the first unreadable one
+        """
+        layout = self.layout
+        page_image = np.zeros((layout.rows * layout.tile_height, layout.columns * layout.tile_width, 3),
+                              dtype=np.uint8)
+        rendered_images: List[str] = []
+
+        for index, file_name in enumerate(page_images):
+            thumbnail = cv2.imread(os.path.join(self.thumbnail_directory, file_name), cv2.IMREAD_COLOR)
+            if thumbnail is None:
+                print('Unreadable thumbnail; skipped until the next update:', file_name)
+                break
+            row, column = divmod(index, layout.columns)
+            tile = page_image[row * layout.tile_height:(row + 1) * layout.tile_height,
+                              column * layout.tile_width:(column + 1) * layout.tile_width]
+            self._draw_tile(tile, thumbnail, file_name)
+            rendered_images.append(file_name)
+
+        if len(rendered_images) > 0:
+            _write_image_atomic(self.get_page_path(page), page_image, self.jpeg_params)
+        return rendered_images
+
+    def _draw_tile(self, tile: Any, thumbnail: Any, file_name: str) -> None:
+
+        # fit inside the tile, keeping the aspect ratio
+        tile_height, tile_width = tile.shape[:2]
+        thumbnail_height, thumbnail_width = thumbnail.shape[:2]
+        fit_scale = min(tile_width / thumbnail_width, tile_height / thumbnail_height)
+        fit_width = max(1, int(thumbnail_width * fit_scale))
+        fit_height = max(1, int(thumbnail_height * fit_scale))
+        offset_x = (tile_width - fit_width) // 2
+        offset_y = (tile_height - fit_height) // 2
+        tile[offset_y:offset_y + fit_height, offset_x:offset_x + fit_width] = cv2.resize(
+            thumbnail, (fit_width, fit_height), interpolation=cv2.INTER_AREA)
+
+        if not self.layout.labels:
+            return
+
+        label = get_time_label(file_name)
+        if label != '':
+            tile[tile_height - LABEL_HEIGHT:, :] //= 3
+            cv2.putText(tile, label, (4, tile_height - 4), cv2.FONT_HERSHEY_SIMPLEX, LABEL_FONT_SCALE,
+                        (255, 255, 255), 1, cv2.LINE_AA)
+
+    def _load_state(self) -> None:
+        self.images = []
+        if not os.path.exists(self.state_path):
+            return
+
+        try:
+            with open(self.state_path) as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            print('Unreadable contact sheet state; rebuilding:', self.state_path)
+            return
+
+        if state.get('version') == STATE_VERSION and state.get('layout') == list(self.layout):
+            self.images = state.get('images', [])
+        else:
+            print(f'Contact sheet layout changed; rebuilding {self.layout.name} pages')
+            self._remove_pages()
+
+    def _save_state(self) -> None:
+        state = {'version': STATE_VERSION, 'layout': list(self.layout), 'images': self.images}
+        temporary_path = f'{self.state_path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(temporary_path, self.state_path)
+
+    def _remove_pages(self) -> None:
+        if not os.path.isdir(self.sheet_directory):
+            return
+        for file_name in os.listdir(self.sheet_directory):
+            if file_name.startswith(f'{self.layout.name}-') and file_name.endswith('.jpg'):
+                os.remove(os.path.join(self.sheet_directory, file_name))
+
+
+def get_time_label(file_name: str) -> str:
+    """
+    capture time from a timestamp_filename_format file name, ex: 13:45:22
+    """
+    match = TIMESTAMP_FILENAME_PATTERN.search(file_name)
+    return f'{match.group(4)}:{match.group(5)}:{match.group(6)}' if match is not None else ''
+
+
+def _write_image_atomic(image_path: str, image: Any, params: List[int]) -> None:
+    # readers on the file share never see a partial page
+    success, encoded_image = cv2.imencode('.jpg', image, params)
+    if not success:
+        raise IOError(f'Unable to encode image: {image_path}')
+    temporary_path = f'{image_path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as image_file:
+        image_file.write(encoded_image.tobytes())
+    os.replace(temporary_path, image_path)
+
+
+def update_contact_sheets(day_directories: List[str], layouts: List[SheetLayout], jpeg_quality: int = 85) -> None:
+    perf_start_time = time.perf_counter()
+    added_count = 0
+
+    for day_directory in day_directories:
+        for layout in layouts:
+            day_added_count = ContactSheetBuilder(day_directory, layout, jpeg_quality).update()
+            if day_added_count > 0:
+                print(f'{day_directory}: {day_added_count} thumbnails added to {layout.name} pages')
+            added_count += day_added_count
+
+    print(f'{added_count} thumbnails added in {time.perf_counter() - perf_start_time:0.2f} seconds')
+
+
+def parse_args(args: List[str]) -> Tuple[List[str], List[SheetLayout], Dict[str, str]]:
+    format_message = ('\nUSAGE:\n'
+                      '$ python3 contact_sheet.py day-directory [day-directory ...] [options]\n'
+                      '$ python3 contact_sheet.py main-directory --from=date [options]\n'
+                      'OPTIONS:\n'
+                      f'--layout=all\t\t{", ".join(LAYOUTS)} or all\n'
+                      '--quality=85\t\tjpeg quality of the pages\n'
+                      '--from=2021-07-19\tstart date in main-directory/YYYY/MM/DD\n'
+                      '--to=2021-07-25\t\tend date (inclusive); default is now\n'
+                      'EXAMPLES:\n'
+                      '$ python3 contact_sheet.py media-files/2021/07/25\n'
+                      '$ python3 contact_sheet.py media-files --from=2021-07-19 --layout=mosaic')
+    valid_options = ['layout', 'quality', 'from', 'to']
+
+    options: Dict[str, str] = {}
+    for arg in [arg for arg in args if arg.startswith('--')]:
+        name, _, value = arg[2:].partition('=')
+        if name not in valid_options:
+            print('Invalid option:', arg)
+            print(format_message)
+            return [], [], {}
+        options[name] = value
+    args = [arg for arg in args if not arg.startswith('--')]
+
+    if len(args) < 1:
+        print('Invalid number of arguments')
+        print(format_message)
+        return [], [], {}
+
+    layout_name = options.get('layout', 'all')
+    if (layout_name not in LAYOUTS and layout_name != 'all'
+            or not options.get('quality', '85').isdigit()
+            or ('to' in options and 'from' not in options)):
+        print('Invalid option value')
+        print(format_message)
+        return [], [], {}
+    layouts = list(LAYOUTS.values()) if layout_name == 'all' else [LAYOUTS[layout_name]]
+
+    directories = [_get_directory_path(directory) for directory in args]
+    if '' in directories:
+        print('Invalid directory argument:', args[directories.index('')])
+        print(format_message)
+        return [], [], {}
+
+    if 'from' in options:
+        try:
+            start_time, end_time = parse_time_range(options['from'], options.get('to', ''))
+        except ValueError:
+            print('Invalid date range:', options['from'], options.get('to', ''))
+            print(format_message)
+            return [], [], {}
+        directories = [day_directory for main_directory in directories
+                       for day_directory in iter_day_directories(main_directory, start_time, end_time)]
+
+    return directories, layouts, options
+
+
+def _get_directory_path(directory_path: str) -> str:
+    if os.path.isdir(directory_path):
+        return directory_path
+
+    script_directory_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), directory_path.lstrip('/'))
+    return script_directory_path if os.path.isdir(script_directory_path) else ''
+
+
+def main() -> None:
+    directories, layouts, options = parse_args(sys.argv[1:])
+    if len(directories) == 0:
+        return
+
+    update_contact_sheets(directories, layouts, int(options.get('quality', '85')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+from typing import Any, List, Tuple
+
+import cv2
+import numpy as np
+
+from image_decoder import DECODE_FULL, DECODE_REDUCED, read_grayscale
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+SCALES = [1, 2, 4, 8]
+DEFAULT_DIFF_THRESHOLD = 3000000
+
+
+class DecodeBenchmark:
+    """
+    compare decode time and motion diff score agreement between full and reduced decode strategies
+    scores at every scale are compared against full resolution scores from the full decode strategy
+    """
+
+    def __init__(self, diff_threshold: int = DEFAULT_DIFF_THRESHOLD):
+        self.diff_threshold = diff_threshold
+
+    def run(self, images_directory: str, extension: str, image_limit: int) -> None:
+
+        images_list = sorted(file_name for file_name in os.listdir(images_directory)
+                             if file_name.endswith(f'.{extension}'))[:image_limit]
+        image_paths = [os.path.join(images_directory, file_name) for file_name in images_list]
+
+        if len(image_paths) < 2:
+            print('At least 2 images are required')
+            return
+
+        print(f'Benchmarking {len(image_paths)} images')
+
+        _, reference_scores = self._measure(image_paths, 1, DECODE_FULL)
+
+        print('STRATEGY\tSCALE\tMS/IMAGE\tSPEEDUP\tSCORE CORRELATION\tHIT AGREEMENT')
+        baseline_seconds = 0.0
+        for decode_strategy in [DECODE_FULL, DECODE_REDUCED]:
+            for scale in SCALES:
+                seconds_per_image, scores = self._measure(image_paths, scale, decode_strategy)
+                if baseline_seconds == 0:
+                    baseline_seconds = seconds_per_image
+                correlation = float(np.corrcoef(reference_scores, scores)[0, 1]) if np.std(scores) > 0 else 0.0
+                hit_agreement = np.mean((reference_scores > self.diff_threshold) == (scores > self.diff_threshold))
+                print(f'{decode_strategy}\t\t{scale}\t{seconds_per_image * 1000:0.2f}\t\t'
+                      f'{baseline_seconds / seconds_per_image:0.2f}x\t{correlation:0.4f}\t\t\t{hit_agreement:0.2%}')
+
+    @staticmethod
+    def _measure(image_paths: List[str], scale: int, decode_strategy: str) -> Tuple[float, Any]:
+        """
+        return decode seconds per image, and full resolution equivalent diff scores for consecutive images
+        """
+        images: List[Any] = []
+
+        perf_start_time = time.perf_counter()
+        for image_path in image_paths:
+            images.append(read_grayscale(image_path, scale, decode_strategy))
+        seconds_per_image = (time.perf_counter() - perf_start_time) / len(image_paths)
+
+        blur_size = max(1, round(20 / scale))
+        images = [cv2.blur(image, (blur_size, blur_size)) for image in images]
+        scores = np.array([int(np.sum(cv2.absdiff(previous_image, image))) * scale * scale
+                           for previous_image, image in zip(images, images[1:])], dtype=np.int64)
+
+        return seconds_per_image, scores
+
+
+def parse_args(args: List[str]) -> Tuple[str, str, int]:
+    format_message = 'USAGE: python3 decode_benchmark.py images-directory jpg [image-limit]'
+
+    if len(args) not in [2, 3]:
+        print('Invalid number of arguments')
+        print(format_message)
+        return '', '', 0
+
+    images_directory = os.path.join(SCRIPT_DIRECTORY, args[0])
+    extension = args[1]
+    image_limit = int(args[2]) if len(args) == 3 and args[2].isdigit() else 200
+
+    if not os.path.exists(images_directory):
+        print('Invalid directory argument:', images_directory)
+        print(format_message)
+        return '', '', 0
+
+    return images_directory, extension, image_limit
+
+
+def main() -> None:
+    images_directory, extension, image_limit = parse_args(sys.argv[1:])
+    if images_directory == '':
+        return
+
+    DecodeBenchmark().run(images_directory, extension, image_limit)
+
+
+if __name__ == '__main__':
+    main()
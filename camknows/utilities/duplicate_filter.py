@@ -0,0 +1,92 @@
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+import cv2
+import numpy as np
+
+HASH_SIZE = 8  # 8x8 gradient bits: a 64 bit hash
+
+
+def get_image_hash(image: Any) -> int:
+    """
+    difference hash of a grayscale image: one bit per horizontal gradient of a tiny resize
+    small changes (noise, rain, flicker) change few bits; a different scene changes about half
+    """
+    small_image = cv2.resize(image, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    gradient_bits = small_image[:, 1:] > small_image[:, :-1]
+    return int.from_bytes(np.packbits(gradient_bits).tobytes(), 'big')
+
+
+def get_hash_distance(first_hash: int, second_hash: int) -> int:
+    return bin(first_hash ^ second_hash).count('1')
+
+
+class DuplicateFilter:
+    """
+    suppress saves of images nearly identical to a recently saved image
+    hashes of saved images are kept in a small LRU cache; an image within max_distance bits of a hash saved
+    less than window_seconds ago is a duplicate. With keep_every, every Nth duplicate of a saved image is kept
+    """
+
+    def __init__(self, max_distance: int = 4, window_seconds: float = 30, cache_size: int = 16, keep_every: int = 0):
+        self.max_distance: int = max_distance
+        self.window_seconds: float = window_seconds
+        self.cache_size: int = max(1, cache_size)
+        self.keep_every: int = keep_every  # 0: suppress every duplicate within the window
+        self.suppressed_count: int = 0
+        # image hash: [saved time, duplicates since saved], least recently matched first
+        self._saved_hashes: OrderedDict = OrderedDict()
+
+    def check(self, image: Any, now: Optional[float] = None) -> bool:
+        """
+        True if the grayscale image should be saved; its hash is then cached as saved
+        """
+        return self.check_hash(get_image_hash(image), now)
+
+    def check_hash(self, image_hash: int, now: Optional[float] = None) -> bool:
+        """
+        check() for an image hash from get_image_hash()
+        """
+        now = now if now is not None else time.time()
+
+        match = self._find_match(image_hash, now)
+        if match is not None:
+            entry = self._saved_hashes[match]
+            entry[1] += 1
+            self._saved_hashes.move_to_end(match)
+            if self.keep_every <= 0 or entry[1] % self.keep_every != 0:
+                self.suppressed_count += 1
+                return False
+
+        self.add(image_hash, now)
+        return True
+
+    def add(self, image_hash: int, now: Optional[float] = None) -> None:
+        """
+        cache the hash of an image saved without check() (ex: time-lapse images)
+        """
+        self._saved_hashes.pop(image_hash, None)
+        self._saved_hashes[image_hash] = [now if now is not None else time.time(), 0]
+        while len(self._saved_hashes) > self.cache_size:
+            self._saved_hashes.popitem(last=False)
+
+    def _find_match(self, image_hash: int, now: float) -> Optional[int]:
+
+        expired_hashes: List[int] = []
+        match = None
+        best_distance = self.max_distance + 1
+
+        for saved_hash, (saved_time, _) in self._saved_hashes.items():
+            if now - saved_time > self.window_seconds:
+                expired_hashes.append(saved_hash)
+                continue
+            distance = get_hash_distance(image_hash, saved_hash)
+            if distance < best_distance:
+                match = saved_hash
+                best_distance = distance
+
+        for expired_hash in expired_hashes:
+            del self._saved_hashes[expired_hash]
+
+        return match
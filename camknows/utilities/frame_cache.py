@@ -0,0 +1,179 @@
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+CACHE_DIRECTORY = '.camknows_cache'
+CACHE_VERSION = 1
+# new frames held in memory before they are appended to disk; a first run can add tens of thousands of frames
+FLUSH_FRAME_COUNT = 64
+
+
+class FrameCache:
+    """
+    motion-ready frames and pair diff scores for one image directory, scale and decode strategy
+    frames are stored in a memory-mapped .npy file, indexed by file name, mtime and size in a json file
+    new frames are appended to a raw file every FLUSH_FRAME_COUNT frames, and moved into the .npy file by save()
+    delete the cache directory to rebuild from scratch
+    """
+
+    def __init__(self, images_directory: str, scale: int, decode_strategy: str):
+        self.cache_directory = os.path.join(images_directory, CACHE_DIRECTORY)
+        self.scale = scale
+        self.decode_strategy = decode_strategy
+        self.index_path = os.path.join(self.cache_directory, f'index-{decode_strategy}-x{scale}.json')
+        self.frames_path = os.path.join(self.cache_directory, f'frames-{decode_strategy}-x{scale}.npy')
+        self.appended_frames_path = os.path.join(self.cache_directory, f'frames-{decode_strategy}-x{scale}.new')
+        self.frame_shape: Optional[Tuple[int, ...]] = None
+        self.frames: Dict[str, List[int]] = {}  # file name: [mtime_ns, size, slot]
+        self.scores: Dict[str, List[Any]] = {}  # file name: [previous file name, diff score]
+        self._stored_frames: Any = None
+        self._appended_frames: Any = None  # memory map of the appended frames file
+        self._new_frames: List[Any] = []
+        self._load()
+
+    @staticmethod
+    def get_file_key(image_path: str) -> List[int]:
+        file_stat = os.stat(image_path)
+        return [file_stat.st_mtime_ns, file_stat.st_size]
+
+    def get_frame(self, image_file: str, file_key: List[int]) -> Optional[Any]:
+        entry = self.frames.get(image_file)
+        if entry is None or entry[:2] != file_key:
+            return None
+
+        return self._get_slot_frame(entry[2])
+
+    def put_frame(self, image_file: str, file_key: List[int], frame: Any) -> None:
+        if self.frame_shape is None:
+            self.frame_shape = frame.shape
+
+        if frame.shape != self.frame_shape:
+            # resolution changed; score is still cached, but the frame is not
+            self.frames.pop(image_file, None)
+            return
+
+        self.frames[image_file] = file_key + [self._get_stored_count() + self._get_appended_count()
+                                              + len(self._new_frames)]
+        self._new_frames.append(frame)
+        if len(self._new_frames) >= FLUSH_FRAME_COUNT:
+            self._flush_new_frames()
+
+    def get_score(self, previous_image_file: str, image_file: str) -> Optional[int]:
+        entry = self.scores.get(image_file)
+        return entry[1] if entry is not None and entry[0] == previous_image_file else None
+
+    def put_score(self, previous_image_file: str, image_file: str, diff_score: int) -> None:
+        self.scores[image_file] = [previous_image_file, int(diff_score)]
+
+    def prune(self, image_files: Iterable[str]) -> None:
+        """
+        drop entries for files that no longer exist
+        """
+        image_files = set(image_files)
+        self.frames = {key: value for key, value in self.frames.items() if key in image_files}
+        self.scores = {key: value for key, value in self.scores.items() if key in image_files}
+
+    def save(self) -> None:
+        os.makedirs(self.cache_directory, exist_ok=True)
+
+        live_slots = sorted(entry[2] for entry in self.frames.values())
+
+        if self._new_frames or self._appended_frames is not None or live_slots != list(range(len(live_slots))):
+            # rewrite frames compactly, one frame at a time: live stored frames first, then new frames
+            temp_frames_path = self.frames_path + '.tmp'
+            frames_array = np.lib.format.open_memmap(temp_frames_path, mode='w+', dtype=np.uint8,
+                                                     shape=(len(live_slots),) + tuple(self.frame_shape or (0, 0)))
+            new_slots: Dict[int, int] = {}
+            for new_slot, old_slot in enumerate(live_slots):
+                frames_array[new_slot] = self._get_slot_frame(old_slot)
+                new_slots[old_slot] = new_slot
+            frames_array.flush()
+            del frames_array
+
+            self._stored_frames = None
+            self._appended_frames = None
+            os.replace(temp_frames_path, self.frames_path)
+            self._remove_appended_frames()
+            for entry in self.frames.values():
+                entry[2] = new_slots[entry[2]]
+            self._new_frames = []
+            self._open_stored_frames()
+
+        index = {
+            'version': CACHE_VERSION,
+            'scale': self.scale,
+            'frame_shape': list(self.frame_shape) if self.frame_shape is not None else None,
+            'frames': self.frames,
+            'scores': self.scores,
+        }
+        temp_index_path = self.index_path + '.tmp'
+        with open(temp_index_path, 'w') as index_file:
+            json.dump(index, index_file)
+        os.replace(temp_index_path, self.index_path)
+
+    def _load(self) -> None:
+        # frames appended by a run that ended before save() are not in the index
+        self._remove_appended_frames()
+
+        if not os.path.exists(self.index_path):
+            return
+
+        try:
+            with open(self.index_path) as index_file:
+                index = json.load(index_file)
+
+            if index.get('version') != CACHE_VERSION or index.get('scale') != self.scale:
+                print('Cache version or scale changed; rebuilding cache')
+                return
+
+            self.frame_shape = tuple(index['frame_shape']) if index['frame_shape'] is not None else None
+            self.frames = index['frames']
+            self.scores = index['scores']
+            self._open_stored_frames()
+
+            if self._get_stored_count() < len(self.frames):
+                raise ValueError('Cache frames missing')
+        except (ValueError, KeyError, OSError):
+            print('Invalid cache; rebuilding cache')
+            self.frame_shape = None
+            self.frames = {}
+            self.scores = {}
+            self._stored_frames = None
+
+    def _open_stored_frames(self) -> None:
+        if os.path.exists(self.frames_path):
+            self._stored_frames = np.load(self.frames_path, mmap_mode='r')
+
+    def _get_stored_count(self) -> int:
+        return 0 if self._stored_frames is None else self._stored_frames.shape[0]
+
+    def _get_appended_count(self) -> int:
+        return 0 if self._appended_frames is None else self._appended_frames.shape[0]
+
+    def _get_slot_frame(self, slot: int) -> Any:
+        stored_count = self._get_stored_count()
+        if slot < stored_count:
+            return self._stored_frames[slot]
+
+        appended_count = self._get_appended_count()
+        if slot < stored_count + appended_count:
+            return self._appended_frames[slot - stored_count]
+
+        return self._new_frames[slot - stored_count - appended_count]
+
+    def _flush_new_frames(self) -> None:
+        os.makedirs(self.cache_directory, exist_ok=True)
+        with open(self.appended_frames_path, 'ab') as frames_file:
+            for frame in self._new_frames:
+                frames_file.write(np.ascontiguousarray(frame).tobytes())
+
+        appended_count = self._get_appended_count() + len(self._new_frames)
+        self._appended_frames = np.memmap(self.appended_frames_path, dtype=np.uint8, mode='r',
+                                          shape=(appended_count,) + tuple(self.frame_shape))
+        self._new_frames = []
+
+    def _remove_appended_frames(self) -> None:
+        if os.path.exists(self.appended_frames_path):
+            os.remove(self.appended_frames_path)
@@ -0,0 +1,56 @@
+from typing import Any, Dict
+
+import cv2
+
+DECODE_FULL = 'full'
+DECODE_REDUCED = 'reduced'
+DECODE_STRATEGIES = [DECODE_FULL, DECODE_REDUCED]
+
+# the jpeg decoder can skip work by decoding directly at these reduced scales
+REDUCED_GRAYSCALE_FLAGS: Dict[int, int] = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                                           4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+REDUCED_COLOR_FLAGS: Dict[int, int] = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                                       4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+def read_grayscale(image_path: str, scale: int = 1, strategy: str = DECODE_FULL) -> Any:
+    """
+    read an image as grayscale, downscaled by scale
+    full: decode at full resolution, then convert and resize
+    reduced: let the decoder produce a reduced grayscale image; resize only what the decoder can't reduce
+    """
+    if strategy == DECODE_REDUCED:
+        return _read_reduced(image_path, scale, REDUCED_GRAYSCALE_FLAGS)
+
+    image = _read(image_path, cv2.IMREAD_COLOR)
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return _resize(image, scale)
+
+
+def read_color(image_path: str, scale: int = 1, strategy: str = DECODE_FULL) -> Any:
+    """
+    read a color image downscaled by scale; see read_grayscale
+    """
+    if strategy == DECODE_REDUCED:
+        return _read_reduced(image_path, scale, REDUCED_COLOR_FLAGS)
+
+    return _resize(_read(image_path, cv2.IMREAD_COLOR), scale)
+
+
+def _read_reduced(image_path: str, scale: int, flags: Dict[int, int]) -> Any:
+    reduced_scale = max(factor for factor in flags if scale % factor == 0)
+    image = _read(image_path, flags[reduced_scale])
+    return _resize(image, scale // reduced_scale)
+
+
+def _read(image_path: str, flag: int) -> Any:
+    image = cv2.imread(image_path, flag)
+    if image is None:
+        raise IOError(f'Unable to read image: {image_path}')
+    return image
+
+
+def _resize(image: Any, scale: int) -> Any:
+    if scale <= 1:
+        return image
+    return cv2.resize(image, (image.shape[1] // scale, image.shape[0] // scale), interpolation=cv2.INTER_AREA)
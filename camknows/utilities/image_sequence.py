@@ -0,0 +1,96 @@
+import datetime
+import os
+from typing import Iterable, Iterator, Optional, Tuple
+
+from media_catalog import MediaRecord, get_image_timestamp
+
+
+def iter_day_directories(main_directory: str, start_time: datetime.datetime,
+                         end_time: datetime.datetime) -> Iterator[str]:
+    """
+    yield existing main_directory/YYYY/MM/DD directories for the days from start_time to end_time
+    """
+    day = start_time.date()
+    while datetime.datetime.combine(day, datetime.time()) < end_time:
+        directory_path = os.path.join(main_directory, day.strftime('%Y/%m/%d'))
+        if os.path.isdir(directory_path):
+            yield directory_path
+        day += datetime.timedelta(days=1)
+
+
+def iter_images(directories: Iterable[str], extension: str, start_time: Optional[datetime.datetime] = None,
+                end_time: Optional[datetime.datetime] = None) -> Iterator[Tuple[str, datetime.datetime]]:
+    """
+    yield (path, timestamp) for images in [start_time, end_time), one directory at a time, in file name order
+    only one directory is listed at a time, so long ranges start streaming immediately
+    the timestamp comes from the file name, or the modified time for other file names
+    """
+    for directory in directories:
+        with os.scandir(directory) as entries:
+            image_entries = sorted((entry for entry in entries
+                                    if entry.name.endswith(f'.{extension}') and entry.is_file()),
+                                   key=lambda entry: entry.name)
+
+        for entry in image_entries:
+            timestamp = get_image_timestamp(entry.name)
+            if timestamp is None:
+                timestamp = datetime.datetime.fromtimestamp(entry.stat().st_mtime)
+            if start_time is not None and timestamp < start_time:
+                continue
+            if end_time is not None and timestamp >= end_time:
+                continue
+            yield entry.path, timestamp
+
+
+def subsample(images: Iterable[Tuple[str, datetime.datetime]], every_nth: int = 1,
+              interval_seconds: float = 0) -> Iterator[str]:
+    """
+    yield every_nth image path, and at most one image per interval_seconds
+    """
+    every_nth = max(1, every_nth)
+    last_timestamp: Optional[datetime.datetime] = None
+
+    for image_index, (image_path, timestamp) in enumerate(images):
+        if image_index % every_nth != 0:
+            continue
+        if (interval_seconds > 0 and last_timestamp is not None
+                and (timestamp - last_timestamp).total_seconds() < interval_seconds):
+            continue
+        last_timestamp = timestamp
+        yield image_path
+
+
+def parse_time_range(start_value: str, end_value: str = '') -> Tuple[datetime.datetime, datetime.datetime]:
+    """
+    parse ISO 8601 dates or date times, ex: 2021-07-19 or 2021-07-19T08:30
+    a date only end includes the whole day; no end means now
+    raises ValueError for invalid values
+    """
+    start_time = datetime.datetime.fromisoformat(start_value)
+
+    if end_value == '':
+        end_time = datetime.datetime.now()
+    else:
+        end_time = datetime.datetime.fromisoformat(end_value)
+        if len(end_value) == len('YYYY-MM-DD'):
+            end_time += datetime.timedelta(days=1)
+
+    if end_time <= start_time:
+        raise ValueError(f'Invalid time range: {start_value} to {end_value}')
+
+    return start_time, end_time
+
+
+def iter_catalog_images(records: Iterable[MediaRecord],
+                        main_directory: str) -> Iterator[Tuple[str, datetime.datetime]]:
+    """
+    (path, timestamp) for catalog records, for subsample()
+    """
+    for record in records:
+        yield os.path.join(main_directory, record.path), datetime.datetime.fromtimestamp(record.timestamp)
+
+
+def get_image_paths(directories: Iterable[str], extension: str, start_time: Optional[datetime.datetime] = None,
+                    end_time: Optional[datetime.datetime] = None, every_nth: int = 1,
+                    interval_seconds: float = 0) -> Iterator[str]:
+    return subsample(iter_images(directories, extension, start_time, end_time), every_nth, interval_seconds)
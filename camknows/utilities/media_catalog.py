@@ -0,0 +1,346 @@
+import datetime
+import logging
+import os
+import queue
+import re
+import sqlite3
+import sys
+import time
+import traceback
+from threading import Thread
+from typing import Any, Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+CATALOG_FILE_NAME = 'camknows_catalog.db'
+TRIGGER_FIRST_IMAGE = 'first_image'
+TRIGGER_MOTION = 'motion'
+TRIGGER_TIME_LAPSE = 'time_lapse'
+TRIGGER_UNKNOWN = 'unknown'
+THUMBNAIL_DIRECTORY = 'thumbnails'
+CONTACT_SHEET_DIRECTORY = 'contact_sheets'
+# subdirectories of saved images that are not camera images
+SKIPPED_DIRECTORIES = ['processed', 'motion_detected', THUMBNAIL_DIRECTORY, CONTACT_SHEET_DIRECTORY]
+
+# timestamp_filename_format in image file names, ex: camknows-2021-07-25-13-45-22-123456-4.156.094.jpg
+TIMESTAMP_FILENAME_PATTERN = re.compile(r'(\d{4})-(\d{2})-(\d{2})-(\d{2})-(\d{2})-(\d{2})-(\d{6})')
+# diff score suffix written with diff_score_in_filename, ex: 4.156.094
+DIFF_SCORE_FILENAME_PATTERN = re.compile(r'^-(\d{1,3}(?:\.\d{3})*)(?:-|$)')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    path TEXT PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    diff_score INTEGER,
+    trigger TEXT NOT NULL,
+    width INTEGER,
+    height INTEGER
+);
+CREATE INDEX IF NOT EXISTS media_timestamp ON media (timestamp);
+CREATE INDEX IF NOT EXISTS media_diff_score ON media (diff_score);
+"""
+INSERT_SQL = ('INSERT OR REPLACE INTO media (path, timestamp, diff_score, trigger, width, height) '
+              'VALUES (?, ?, ?, ?, ?, ?)')
+
+
+class MediaRecord(NamedTuple):
+    path: str  # relative to the main directory, ex: 2021/07/25/camknows-2021-07-25-13-45-22-123456-4.156.094.jpg
+    timestamp: float
+    diff_score: Optional[int]
+    trigger: str
+    width: Optional[int]
+    height: Optional[int]
+
+
+def get_image_timestamp(file_name: str) -> Optional[datetime.datetime]:
+    match = TIMESTAMP_FILENAME_PATTERN.search(file_name)
+    if match is None:
+        return None
+    try:
+        return datetime.datetime(*[int(value) for value in match.groups()])
+    except ValueError:
+        return None
+
+
+def get_image_diff_score(file_name: str) -> Optional[int]:
+    """
+    diff score from an image file name, or None for first and time-lapse images, which use a random suffix
+    """
+    match = TIMESTAMP_FILENAME_PATTERN.search(file_name)
+    if match is None:
+        return None
+    score_match = DIFF_SCORE_FILENAME_PATTERN.match(os.path.splitext(file_name[match.end():])[0])
+    return int(score_match.group(1).replace('.', '')) if score_match is not None else None
+
+
+class MediaCatalog:
+    """
+    SQLite index of saved images: path, capture time, diff score, trigger and dimensions
+    the camera adds records as images are saved; they are written in batches by a background thread (WAL mode),
+    so saves never wait on the database. tools query by time range or score instead of listing directories
+    the catalog file is kept in the main directory, and paths are relative to it
+    """
+
+    def __init__(self, catalog_path: str, batch_size: int = 50, flush_seconds: float = 5,
+                 log: Optional[Callable[..., None]] = None):
+        self.catalog_path: str = catalog_path
+        self.main_directory: str = os.path.dirname(os.path.abspath(catalog_path))
+        self.batch_size: int = max(1, batch_size)
+        self.flush_seconds: float = flush_seconds
+        self._log: Callable[..., None] = log if log is not None else (lambda message, level=logging.NOTSET: None)
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[Thread] = None
+
+        self.record_count: int = 0
+        self.error_count: int = 0
+
+    @staticmethod
+    def find(directory: str) -> Optional[str]:
+        """
+        catalog path in directory or its parents, ex: media-files/camknows_catalog.db for media-files/2021/07/25
+        """
+        directory = os.path.abspath(directory)
+        while True:
+            catalog_path = os.path.join(directory, CATALOG_FILE_NAME)
+            if os.path.isfile(catalog_path):
+                return catalog_path
+            parent_directory = os.path.dirname(directory)
+            if parent_directory == directory:
+                return None
+            directory = parent_directory
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = Thread(target=self._writer, name='media-catalog', daemon=True)
+        self._thread.start()
+
+    def add(self, image_path: str, timestamp: float, diff_score: Optional[int], trigger: str,
+            width: Optional[int], height: Optional[int]) -> None:
+        """
+        queue a record for an image in the main directory; returns immediately
+        """
+        if self._thread is None:
+            self.start()
+        relative_path = os.path.relpath(image_path, self.main_directory).replace(os.sep, '/')
+        self._queue.put(MediaRecord(relative_path, timestamp, None if diff_score is None else int(diff_score),
+                                    trigger, width, height))
+
+    def stop(self) -> None:
+        """
+        write queued records and stop the writer thread
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def query(self, start_time: Optional[datetime.datetime] = None, end_time: Optional[datetime.datetime] = None,
+              min_score: Optional[int] = None, trigger: Optional[str] = None, directory: str = '',
+              extension: str = '') -> List[MediaRecord]:
+        """
+        records in [start_time, end_time) in time order, optionally with diff_score >= min_score, a trigger,
+        under a directory (relative to the main directory, ex: 2021/07/25) or with a file extension
+        """
+        conditions: List[str] = []
+        parameters: List[Any] = []
+
+        if start_time is not None:
+            conditions.append('timestamp >= ?')
+            parameters.append(start_time.timestamp())
+        if end_time is not None:
+            conditions.append('timestamp < ?')
+            parameters.append(end_time.timestamp())
+        if min_score is not None:
+            conditions.append('diff_score >= ?')
+            parameters.append(min_score)
+        if trigger is not None:
+            conditions.append('trigger = ?')
+            parameters.append(trigger)
+        if directory not in ['', '.']:
+            # % and _ in directory names are matched literally
+            conditions.append("path LIKE ? ESCAPE '\\'")
+            parameters.append(_escape_like(directory.strip('/')) + '/%')
+        if extension != '':
+            conditions.append('path LIKE ?')
+            parameters.append(f'%.{extension}')
+
+        where_clause = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+        connection = self._connect()
+        try:
+            rows = connection.execute(f'SELECT {", ".join(MediaRecord._fields)} FROM media{where_clause} '
+                                      'ORDER BY timestamp, path', parameters).fetchall()
+        finally:
+            connection.close()
+
+        return [MediaRecord(*row) for row in rows]
+
+    def remove_directory(self, directory: str) -> int:
+        """
+        delete records under a directory relative to the main directory (ex: a day deleted by retention)
+        """
+        connection = self._connect()
+        try:
+            with connection:
+                cursor = connection.execute("DELETE FROM media WHERE path LIKE ? ESCAPE '\\'",
+                                            [_escape_like(directory.strip('/')) + '/%'])
+            return cursor.rowcount
+        finally:
+            connection.close()
+
+    def get_image_paths(self, records: List[MediaRecord]) -> List[str]:
+        return [os.path.join(self.main_directory, record.path) for record in records]
+
+    def rebuild(self, get_image_size: Optional[Callable[[str], Optional[Tuple[int, int]]]] = None) -> int:
+        """
+        reindex every image under the main directory, replacing existing records
+        capture times and diff scores come from file names; the trigger of images without a score is unknown
+        get_image_size reads (width, height) for an image path, if given
+        """
+        record_count = 0
+        connection = self._connect()
+        try:
+            connection.execute('DELETE FROM media')
+            batch: List[MediaRecord] = []
+
+            for image_path in self._walk_image_paths(self.main_directory):
+                file_name = os.path.basename(image_path)
+                timestamp = get_image_timestamp(file_name)
+                diff_score = get_image_diff_score(file_name)
+                image_size = get_image_size(image_path) if get_image_size is not None else None
+                batch.append(MediaRecord(
+                    os.path.relpath(image_path, self.main_directory).replace(os.sep, '/'),
+                    timestamp.timestamp() if timestamp is not None else os.path.getmtime(image_path),
+                    diff_score, TRIGGER_MOTION if diff_score is not None else TRIGGER_UNKNOWN,
+                    image_size[0] if image_size is not None else None,
+                    image_size[1] if image_size is not None else None))
+
+                if len(batch) >= 1000:
+                    connection.executemany(INSERT_SQL, batch)
+                    record_count += len(batch)
+                    batch = []
+
+            connection.executemany(INSERT_SQL, batch)
+            record_count += len(batch)
+            # one transaction: readers see the old catalog until the rebuild is complete
+            connection.commit()
+        finally:
+            connection.close()
+
+        return record_count
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.catalog_path, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        # WAL with normal sync: durable across application crashes, and one sync per checkpoint, not per commit
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.executescript(SCHEMA)
+        return connection
+
+    def _writer(self) -> None:
+        connection = None
+        try:
+            os.makedirs(self.main_directory, exist_ok=True)
+            connection = self._connect()
+        except Exception:
+            self._log(traceback.format_exc(), logging.ERROR)
+
+        stopping = False
+        while not stopping:
+            batch: List[MediaRecord] = []
+            flush_time = time.monotonic() + self.flush_seconds
+
+            # collect a batch, until it is full, flush_seconds pass, or stop() is called
+            while len(batch) < self.batch_size:
+                try:
+                    record = self._queue.get(timeout=max(0.0, flush_time - time.monotonic()))
+                except queue.Empty:
+                    break
+                if record is None:
+                    stopping = True
+                    break
+                batch.append(record)
+
+            if not batch or connection is None:
+                continue
+
+            try:
+                with connection:
+                    connection.executemany(INSERT_SQL, batch)
+                self.record_count += len(batch)
+            except Exception:
+                self.error_count += 1
+                self._log(traceback.format_exc(), logging.ERROR)
+
+        if connection is not None:
+            connection.close()
+
+    def _walk_image_paths(self, directory: str) -> Iterator[str]:
+        entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(('.jpg', '.jpeg', '.png')):
+                yield entry.path
+
+        for entry in entries:
+            if entry.is_dir() and entry.name not in SKIPPED_DIRECTORIES and not entry.name.startswith('.'):
+                yield from self._walk_image_paths(entry.path)
+
+
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def main() -> None:
+    format_message = ('USAGE:\n'
+                      '$ python3 media_catalog.py rebuild main-directory\n'
+                      '$ python3 media_catalog.py query main-directory [--from=date] [--to=date] [--min-score=N] '
+                      '[--trigger=motion]\n'
+                      'EXAMPLES:\n'
+                      '$ python3 media_catalog.py rebuild media-files\n'
+                      '$ python3 media_catalog.py query media-files --from=2021-07-19 --to=2021-07-25 '
+                      '--min-score=5000000')
+    valid_options = ['from', 'to', 'min-score', 'trigger']
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    options = dict(arg[2:].partition('=')[::2] for arg in sys.argv[1:] if arg.startswith('--'))
+
+    if len(args) != 2 or args[0] not in ['rebuild', 'query'] or any(name not in valid_options for name in options):
+        print('Invalid arguments')
+        print(format_message)
+        return
+    if not os.path.isdir(args[1]):
+        print('Invalid directory argument:', args[1])
+        print(format_message)
+        return
+
+    catalog = MediaCatalog(os.path.join(args[1], CATALOG_FILE_NAME))
+
+    if args[0] == 'rebuild':
+        from mjpeg_avi_writer import get_jpeg_size
+
+        def get_image_size(image_path: str) -> Optional[Tuple[int, int]]:
+            # the frame header is near the start of the file, after any exif data
+            with open(image_path, 'rb') as image_file:
+                return get_jpeg_size(image_file.read(128 * 1024))
+
+        perf_start_time = time.perf_counter()
+        record_count = catalog.rebuild(get_image_size)
+        print(f'Cataloged {record_count} images in {time.perf_counter() - perf_start_time:0.2f} seconds')
+        return
+
+    try:
+        start_time = datetime.datetime.fromisoformat(options['from']) if 'from' in options else None
+        end_time = datetime.datetime.fromisoformat(options['to']) if 'to' in options else None
+        min_score = int(options['min-score']) if 'min-score' in options else None
+    except ValueError:
+        print('Invalid option value')
+        print(format_message)
+        return
+
+    for record in catalog.query(start_time, end_time, min_score, options.get('trigger')):
+        timestamp = datetime.datetime.fromtimestamp(record.timestamp).strftime('%Y-%m-%d %H:%M:%S')
+        diff_score = '' if record.diff_score is None else f'{record.diff_score:,d}'
+        print(f'{timestamp}\t{record.trigger}\t{diff_score}\t{record.path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import struct
+from typing import BinaryIO, List, Optional, Tuple
+
+AVIF_HASINDEX = 0x10
+AVIIF_KEYFRAME = 0x10
+
+# start of frame markers carry the image dimensions; C4 (DHT), C8 (JPG) and CC (DAC) are not frame headers
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+JPEG_STANDALONE_MARKERS = set(range(0xD0, 0xDA)) | {0x01}
+
+
+def get_jpeg_size(jpeg_data: bytes) -> Optional[Tuple[int, int]]:
+    """
+    return (width, height) from the jpeg frame header without decoding, or None if it is not found
+    """
+    if jpeg_data[:2] != b'\xff\xd8':
+        return None
+
+    index = 2
+    while index + 9 < len(jpeg_data):
+        if jpeg_data[index] != 0xFF:
+            index += 1
+            continue
+
+        marker = jpeg_data[index + 1]
+        if marker == 0xFF:
+            # fill byte
+            index += 1
+        elif marker in JPEG_STANDALONE_MARKERS:
+            index += 2
+        elif marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>HH', jpeg_data[index + 5:index + 9])
+            return width, height
+        else:
+            segment_length = struct.unpack('>H', jpeg_data[index + 2:index + 4])[0]
+            index += 2 + segment_length
+
+    return None
+
+
+class MjpegAviWriter:
+    """
+    write jpeg files into an MJPEG AVI (AVI 1.0 with an idx1 index) as they are, without decoding or encoding
+    headers are written with placeholder counts and sizes, which are filled in by release()
+    """
+
+    def __init__(self, path: str, frame_size: Tuple[int, int], frames_per_second: float):
+        self.path: str = path
+        self.frame_size: Tuple[int, int] = frame_size
+        self.frames_per_second: float = frames_per_second
+        self.frame_count: int = 0
+        self.bytes_written: int = 0
+
+        self._file: BinaryIO = open(path, 'wb')
+        # (offset from the movi fourcc, size) for idx1
+        self._index: List[Tuple[int, int]] = []
+        self._max_frame_bytes: int = 0
+        self._write_headers()
+
+    def write(self, jpeg_data: bytes) -> None:
+        self._index.append((self._file.tell() - self._movi_position, len(jpeg_data)))
+        self._file.write(b'00dc' + struct.pack('<I', len(jpeg_data)) + jpeg_data)
+        if len(jpeg_data) % 2 == 1:
+            # chunks are word aligned
+            self._file.write(b'\0')
+
+        self.frame_count += 1
+        self._max_frame_bytes = max(self._max_frame_bytes, len(jpeg_data))
+        self.bytes_written = self._file.tell()
+
+    def release(self) -> None:
+        if self._file.closed:
+            return
+
+        try:
+            movi_end = self._file.tell()
+
+            index_data = b''.join(struct.pack('<4sIII', b'00dc', AVIIF_KEYFRAME, offset, size)
+                                  for offset, size in self._index)
+            self._file.write(b'idx1' + struct.pack('<I', len(index_data)) + index_data)
+            file_end = self._file.tell()
+
+            self._patch(4, file_end - 8)
+            self._patch(self._movi_position - 4, movi_end - self._movi_position)
+            self._patch(self._avih_position + 16, self.frame_count)
+            self._patch(self._avih_position + 28, self._max_frame_bytes + 8)
+            self._patch(self._strh_position + 32, self.frame_count)
+            self._patch(self._strh_position + 36, self._max_frame_bytes + 8)
+        finally:
+            self._file.close()
+
+    def _patch(self, position: int, value: int) -> None:
+        self._file.seek(position)
+        self._file.write(struct.pack('<I', value))
+        self._file.seek(0, 2)
+
+    def _write_headers(self) -> None:
+        width, height = self.frame_size
+        # rate / scale is the frame rate, so fractional rates (ex: 0.5 fps) are exact to 1/1000
+        rate_scale = 1000
+        rate = max(1, round(self.frames_per_second * rate_scale))
+
+        avih = struct.pack('<IIIIIIIIII16x', round(1000000 / self.frames_per_second), 0, 0, AVIF_HASINDEX,
+                           0, 0, 1, 0, width, height)
+        strh = struct.pack('<4s4sIHHIIIIIIIIhhhh', b'vids', b'MJPG', 0, 0, 0, 0, rate_scale, rate, 0,
+                           0, 0, 0xFFFFFFFF, 0, 0, 0, width, height)
+        strf = struct.pack('<IiiHH4sIiiII', 40, width, height, 1, 24, b'MJPG', width * height * 3, 0, 0, 0, 0)
+
+        strl = b'strl' + _chunk(b'strh', strh) + _chunk(b'strf', strf)
+        hdrl = b'hdrl' + _chunk(b'avih', avih) + _chunk(b'LIST', strl)
+
+        self._file.write(b'RIFF' + struct.pack('<I', 0) + b'AVI ')
+        hdrl_position = self._file.tell()
+        self._file.write(_chunk(b'LIST', hdrl))
+
+        # chunk data positions, for patching counts in release()
+        self._avih_position = hdrl_position + 12 + 8
+        self._strh_position = self._avih_position + len(avih) + 12 + 8
+
+        self._file.write(b'LIST' + struct.pack('<I', 0) + b'movi')
+        self._movi_position = self._file.tell() - 4
+
+
+def _chunk(fourcc: bytes, data: bytes) -> bytes:
+    return fourcc + struct.pack('<I', len(data)) + data
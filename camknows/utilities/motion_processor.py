@@ -1,93 +1,512 @@
 import os
 import sys
-from typing import List, Tuple, Optional
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Tuple, Optional, Set
 
 import cv2
 import numpy as np
 
+from duplicate_filter import DuplicateFilter, get_image_hash
+from frame_cache import FrameCache
+from image_decoder import DECODE_FULL, DECODE_STRATEGIES, read_grayscale
+from media_catalog import MediaCatalog
+
 SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_DIRECTORY = 'motion_detected'
+# images decoded per worker per batch by cached scans
+LOAD_BATCH_PER_WORKER = 32
+
+# image list shared with pool workers once, so chunk tasks only pass indexes
+_worker_images_directory: str = ''
+_worker_images_list: List[str] = []
+_worker_diff_threshold: int = 0
+_worker_scale: int = 1
+_worker_decode_strategy: str = DECODE_FULL
+_worker_dedup_distance: int = -1
+_worker_dedup_window_seconds: float = 30
 
 
 class MotionProcessor:
 
-    def __init__(self):
+    def __init__(self, worker_count: int = 1, chunk_size: int = 0, scale: int = 1,
+                 decode_strategy: str = DECODE_FULL, use_catalog: bool = False, dedup_distance: int = -1,
+                 dedup_window_seconds: float = 30):
         self.diff_threshold = 3000000
+        self.motion_frames_threshold = 1
+        self.worker_count = max(1, worker_count)
+        self.chunk_size = chunk_size  # 0: sized from image and worker counts
+        # motion frames are downscaled by this factor; diff scores are scaled back up to stay comparable
+        self.scale = max(1, scale)
+        # reduced: decode jpeg files directly to reduced grayscale, skipping full resolution decode and conversion
+        self.decode_strategy = decode_strategy
+        # list images from the media catalog instead of the directory
+        self.use_catalog = use_catalog
+        # skip writing hit images within this many hash bits of an image written in the window; -1 to disable
+        self.dedup_distance = dedup_distance
+        self.dedup_window_seconds = dedup_window_seconds
 
     def detect_motion_from_images(self, directory: str, extension: str) -> None:
 
-        images_directory = os.path.join(SCRIPT_DIRECTORY, directory)
-        images_list: List[str] = []
-
-        if not os.path.exists(images_directory):
-            print('Invalid directory:', images_directory)
+        images_directory, images_list = self._get_images_list(directory, extension)
+        if images_directory == '':
             return
 
-        for file_name in os.listdir(images_directory):
-            if file_name.endswith(f'.{extension}'):
-                images_list.append(file_name)
+        image_count = len(images_list)
 
-        images_list.sort()
+        print(f'Processing {image_count} images with {self.worker_count} worker(s)')
+
+        perf_start_time = time.perf_counter()
+
+        if self.worker_count == 1 or image_count < 2:
+            chunk_results = [_scan_chunk(images_directory, images_list, 0, image_count, self.diff_threshold,
+                                         self.scale, self.decode_strategy, show_progress=True,
+                                         dedup_distance=self.dedup_distance,
+                                         dedup_window_seconds=self.dedup_window_seconds)]
+        else:
+            chunk_results = self._scan_chunks_parallel(images_directory, images_list, perf_start_time)
+
+        self._merge_chunk_results(images_directory, chunk_results, self.scale, self.decode_strategy,
+                                  self._create_duplicate_filter())
+
+        elapsed_seconds = time.perf_counter() - perf_start_time
+        print(f'Processed {image_count} images in {elapsed_seconds:0.2f} seconds '
+              f'({image_count / max(elapsed_seconds, 1e-9):0.1f} images/second)')
+
+    def _scan_chunks_parallel(self, images_directory: str, images_list: List[str],
+                              perf_start_time: float) -> List[Dict[str, Any]]:
+        """
+        scan chunks of the sorted image list on a process pool, returning results in list order
+        each chunk diffs its first image against the last image before it, so pairwise diffs match the serial scan
+        """
         image_count = len(images_list)
+        chunk_size = self.chunk_size or max(50, -(-image_count // (self.worker_count * 4)))
+        chunk_ranges = [(start, min(start + chunk_size, image_count)) for start in range(0, image_count, chunk_size)]
+        chunk_results: List[Optional[Dict[str, Any]]] = [None] * len(chunk_ranges)
+
+        with ProcessPoolExecutor(max_workers=self.worker_count, initializer=_init_worker,
+                                 initargs=(images_directory, images_list, self.diff_threshold, self.scale,
+                                           self.decode_strategy, self.dedup_distance,
+                                           self.dedup_window_seconds)) as executor:
+            futures = {executor.submit(_scan_chunk_in_worker, start, end): index
+                       for index, (start, end) in enumerate(chunk_ranges)}
+
+            processed_count = 0
+            for future in as_completed(futures):
+                result = future.result()
+                chunk_results[futures[future]] = result
+                processed_count += result['processed_count']
+                elapsed_seconds = time.perf_counter() - perf_start_time
+                print(f'Processed {processed_count} of {image_count} images '
+                      f'({processed_count / max(elapsed_seconds, 1e-9):0.1f} images/second)')
+
+        return [result for result in chunk_results if result is not None]
+
+    def detect_motion_with_cache(self, directory: str, extension: str,
+                                 sweep_thresholds: Optional[List[int]] = None) -> None:
+        """
+        detect motion using cached motion frames and diff scores; only new or changed images are decoded
+        with sweep_thresholds, print hit counts for each threshold instead of writing images
+        """
+        images_directory, images_list = self._get_images_list(directory, extension)
+        if images_directory == '':
+            return
 
-        print(f'Processing {image_count} images')
+        perf_start_time = time.perf_counter()
+        cache = FrameCache(images_directory, self.scale, self.decode_strategy)
+        scores = self._update_cache(cache, images_directory, images_list)
+        print(f'Cache updated in {time.perf_counter() - perf_start_time:0.2f} seconds')
 
-        previous_image = None
-        previous_image_file: str = ''
+        if sweep_thresholds:
+            print('THRESHOLD\tHITS')
+            for diff_threshold in sweep_thresholds:
+                print(f'{diff_threshold:,d}\t{len(self._find_hits(scores, diff_threshold))}')
+            return
+
+        output_directory = os.path.join(images_directory, OUTPUT_DIRECTORY)
+        written_files: Set[str] = set()
+        duplicate_filter = self._create_duplicate_filter()
 
-        progress_counter = 0
+        for previous_image_file, image_file, diff_score in self._find_hits(scores, self.diff_threshold):
+            print('motion detected:', image_file, 'diff score:', diff_score)
+            for hit_file in [previous_image_file, image_file]:
+                if hit_file in written_files:
+                    continue
+                hit_path = os.path.join(images_directory, hit_file)
+                frame = cache.get_frame(hit_file, cache.get_file_key(hit_path))
+                if frame is None:
+                    frame = _load_processed_image(hit_path, self.scale, self.decode_strategy)
+                written_files.add(hit_file)
+                if duplicate_filter is not None and not duplicate_filter.check(frame, os.path.getmtime(hit_path)):
+                    continue
+                _write_processed_image(output_directory, hit_file, frame)
+
+        _print_duplicate_count(duplicate_filter)
+
+    def _update_cache(self, cache: FrameCache, images_directory: str,
+                      images_list: List[str]) -> List[Tuple[str, str, int]]:
+        """
+        load or compute the motion frame for each image, and return diff scores for consecutive loadable images
+        frames are handled in list order, so only the previous frame and a batch of decoded frames are in memory
+        """
+        file_keys: Dict[str, List[int]] = {}
+        missing_files: List[str] = []
 
         for image_file in images_list:
+            file_keys[image_file] = cache.get_file_key(os.path.join(images_directory, image_file))
+            if cache.get_frame(image_file, file_keys[image_file]) is None:
+                missing_files.append(image_file)
 
-            try:
-                progress_counter += 1
-                if progress_counter % 10 == 0:
-                    print(f'Processing image {progress_counter} of {image_count}: {image_file}')
+        print(f'{len(images_list) - len(missing_files)} images cached; processing {len(missing_files)} images')
 
-                current_image = cv2.imread(os.path.join(images_directory, image_file))
+        # missing_files is in list order, so computed frames arrive in the order they are needed
+        computed_frames = self._load_processed_images(images_directory, missing_files)
+        missing_file_set = set(missing_files)
 
-                current_image = cv2.cvtColor(current_image, cv2.COLOR_BGR2GRAY)
-                current_image = cv2.blur(current_image, (20, 20))
+        scores: List[Tuple[str, str, int]] = []
+        previous_image = None
+        previous_image_file = ''
+        previous_image_computed = False
 
-                if previous_image is None:
-                    previous_image = current_image
-                    previous_image_file = image_file
-                    continue
+        for image_file in images_list:
+            image_computed = image_file in missing_file_set
+            if image_computed:
+                current_image = next(computed_frames)
+                if current_image is not None:
+                    cache.put_frame(image_file, file_keys[image_file], current_image)
+            else:
+                current_image = cache.get_frame(image_file, file_keys[image_file])
+            if current_image is None:
+                continue  # unreadable image
+
+            if previous_image is not None:
+                diff_score = None
+                if not image_computed and not previous_image_computed:
+                    diff_score = cache.get_score(previous_image_file, image_file)
+                if diff_score is None:
+                    diff_score = _get_diff_score(previous_image, current_image, self.scale)
+                    cache.put_score(previous_image_file, image_file, diff_score)
+                scores.append((previous_image_file, image_file, diff_score))
+
+            previous_image = current_image
+            previous_image_file = image_file
+            previous_image_computed = image_computed
+
+        cache.prune(images_list)
+        cache.save()
+
+        return scores
+
+    def _load_processed_images(self, images_directory: str, images_list: List[str]) -> Iterator[Optional[Any]]:
+        image_paths = [os.path.join(images_directory, image_file) for image_file in images_list]
+
+        if self.worker_count == 1:
+            for image_path in image_paths:
+                yield _try_load_processed_image(image_path, self.scale, self.decode_strategy)
+            return
 
-                images_diff = cv2.absdiff(previous_image, current_image)
-                diff_score = np.sum(images_diff)
-
-                if diff_score > self.diff_threshold:
-                    print('motion detected:', image_file, 'diff score:', diff_score)
-                    # TODO AEO output to TAB DELIMITED log file for DIFF SCORE reference, with formatted diff_score
-                    # EXAMPLE
-                    # TIMESTAMP \t EVENT \t FILE \t SCORE
-                    # TIMESTAMP \t Motion Detected \t camknows-2021-07-19-07-11-57-c7fdda3d.jpg \t 52,807,976
-                    # TIMESTAMP \t ERROR DETAILS
-                    output_directory = os.path.join(images_directory, 'motion_detected')
-                    # print(output_directory)
-                    if not os.path.exists(output_directory):
-                        os.makedirs(output_directory)
-                    cv2.imwrite(os.path.join(output_directory, previous_image_file), previous_image)
-                    cv2.imwrite(os.path.join(output_directory, image_file), current_image)
+        # map() submits every image at once, and results pile up if they are not consumed as fast; batches bound
+        # the decoded frames held in memory
+        batch_size = self.worker_count * LOAD_BATCH_PER_WORKER
+        with ProcessPoolExecutor(max_workers=self.worker_count) as executor:
+            for batch_start in range(0, len(image_paths), batch_size):
+                batch_paths = image_paths[batch_start:batch_start + batch_size]
+                yield from executor.map(_try_load_processed_image, batch_paths, [self.scale] * len(batch_paths),
+                                        [self.decode_strategy] * len(batch_paths),
+                                        chunksize=max(1, len(batch_paths) // (self.worker_count * 4)))
+
+    def _find_hits(self, scores: List[Tuple[str, str, int]], diff_threshold: int) -> List[Tuple[str, str, int]]:
+        """
+        hits require motion_frames_threshold consecutive diff scores over diff_threshold, as in the camera
+        """
+        hits: List[Tuple[str, str, int]] = []
+        motion_frame_count = 0
+
+        for previous_image_file, image_file, diff_score in scores:
+            if diff_score > diff_threshold:
+                motion_frame_count += 1
+                if motion_frame_count >= self.motion_frames_threshold:
+                    hits.append((previous_image_file, image_file, diff_score))
+                    motion_frame_count = 0
+            else:
+                motion_frame_count = 0
+
+        return hits
+
+    def _create_duplicate_filter(self) -> Optional[DuplicateFilter]:
+        if self.dedup_distance < 0:
+            return None
+        return DuplicateFilter(max_distance=self.dedup_distance, window_seconds=self.dedup_window_seconds)
+
+    def _get_images_list(self, directory: str, extension: str) -> Tuple[str, List[str]]:
 
-                previous_image = current_image
-                previous_image_file = image_file
+        images_directory = os.path.join(SCRIPT_DIRECTORY, directory)
+        images_list: List[str] = []
+
+        if not os.path.exists(images_directory):
+            print('Invalid directory:', images_directory)
+            return '', []
 
-            except Exception:
-                print('ERROR:', sys.exc_info())
+        if self.use_catalog:
+            return images_directory, self._get_catalog_images_list(images_directory, extension)
 
+        for file_name in os.listdir(images_directory):
+            if file_name.endswith(f'.{extension}'):
+                images_list.append(file_name)
 
-def parse_args(args: List[str]) -> Tuple[str, str]:
-    format_message = 'USAGE: python3 motion.py images-directory jpg'
-    args_length = 2
+        images_list.sort()
 
-    if len(args) != args_length:
+        return images_directory, images_list
+
+    @staticmethod
+    def _get_catalog_images_list(images_directory: str, extension: str) -> List[str]:
+        """
+        cataloged file names directly in images_directory, in capture time order
+        """
+        catalog_path = MediaCatalog.find(images_directory)
+        if catalog_path is None:
+            print('Media catalog not found; listing directory instead')
+            return sorted(file_name for file_name in os.listdir(images_directory)
+                          if file_name.endswith(f'.{extension}'))
+
+        catalog = MediaCatalog(catalog_path)
+        relative_directory = os.path.relpath(os.path.abspath(images_directory), catalog.main_directory)
+        records = catalog.query(directory=relative_directory, extension=extension)
+
+        # the query includes subdirectories
+        prefix_length = 0 if relative_directory == '.' else len(relative_directory.replace(os.sep, '/')) + 1
+        return [record.path[prefix_length:] for record in records if '/' not in record.path[prefix_length:]]
+
+    @staticmethod
+    def _merge_chunk_results(images_directory: str, chunk_results: List[Dict[str, Any]], scale: int,
+                             decode_strategy: str, duplicate_filter: Optional[DuplicateFilter] = None) -> None:
+        """
+        report results in list order and write the hit image before each chunk, which its chunk leaves to the caller
+        with duplicate_filter, chunks filter their own hit images, but start without the images written before them;
+        their written image hashes are checked again here in list order, and near-duplicates are removed
+        """
+        checked_files: Set[str] = set()  # hit images written or filtered out by earlier chunks
+        output_directory = os.path.join(images_directory, OUTPUT_DIRECTORY)
+
+        for result in chunk_results:
+            for error in result['errors']:
+                print('ERROR:', error)
+            for _, image_file, diff_score in result['hits']:
+                print('motion detected:', image_file, 'diff score:', diff_score)
+
+            boundary_file = result['boundary_file']
+            if boundary_file != '' and boundary_file not in checked_files:
+                boundary_path = os.path.join(images_directory, boundary_file)
+                if duplicate_filter is None or duplicate_filter.check_hash(result['boundary_hash'],
+                                                                           os.path.getmtime(boundary_path)):
+                    _write_processed_image(output_directory, boundary_file,
+                                           _load_processed_image(boundary_path, scale, decode_strategy))
+
+            if duplicate_filter is not None:
+                for written_file, written_hash, written_time in result['written_hashes']:
+                    if not duplicate_filter.check_hash(written_hash, written_time):
+                        os.remove(os.path.join(output_directory, written_file))
+                duplicate_filter.suppressed_count += result['suppressed_count']
+
+            checked_files.update(result['checked_files'])
+
+        _print_duplicate_count(duplicate_filter)
+
+
+def _init_worker(images_directory: str, images_list: List[str], diff_threshold: int, scale: int,
+                 decode_strategy: str, dedup_distance: int, dedup_window_seconds: float) -> None:
+    global _worker_images_directory, _worker_images_list, _worker_diff_threshold, _worker_scale
+    global _worker_decode_strategy, _worker_dedup_distance, _worker_dedup_window_seconds
+    _worker_images_directory = images_directory
+    _worker_images_list = images_list
+    _worker_diff_threshold = diff_threshold
+    _worker_scale = scale
+    _worker_decode_strategy = decode_strategy
+    _worker_dedup_distance = dedup_distance
+    _worker_dedup_window_seconds = dedup_window_seconds
+
+
+def _scan_chunk_in_worker(start: int, end: int) -> Dict[str, Any]:
+    return _scan_chunk(_worker_images_directory, _worker_images_list, start, end, _worker_diff_threshold,
+                       _worker_scale, _worker_decode_strategy, dedup_distance=_worker_dedup_distance,
+                       dedup_window_seconds=_worker_dedup_window_seconds)
+
+
+def _print_duplicate_count(duplicate_filter: Optional[DuplicateFilter]) -> None:
+    if duplicate_filter is not None:
+        print(f'{duplicate_filter.suppressed_count} near-duplicate images not written')
+
+
+def _load_processed_image(image_path: str, scale: int = 1, decode_strategy: str = DECODE_FULL) -> Any:
+    image = read_grayscale(image_path, scale, decode_strategy)
+    blur_size = max(1, round(20 / scale))
+    return cv2.blur(image, (blur_size, blur_size))
+
+
+def _try_load_processed_image(image_path: str, scale: int, decode_strategy: str) -> Optional[Any]:
+    try:
+        return _load_processed_image(image_path, scale, decode_strategy)
+    except Exception:
+        print('ERROR:', os.path.basename(image_path), sys.exc_info())
+        return None
+
+
+def _get_diff_score(previous_image: Any, current_image: Any, scale: int) -> int:
+    # each pixel at a reduced scale stands in for scale * scale full resolution pixels
+    return int(np.sum(cv2.absdiff(previous_image, current_image))) * scale * scale
+
+
+def _write_processed_image(output_directory: str, image_file: str, image: Any) -> None:
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory, exist_ok=True)
+    cv2.imwrite(os.path.join(output_directory, image_file), image)
+
+
+def _scan_chunk(images_directory: str, images_list: List[str], start: int, end: int, diff_threshold: int,
+                scale: int = 1, decode_strategy: str = DECODE_FULL, show_progress: bool = False,
+                dedup_distance: int = -1, dedup_window_seconds: float = 30) -> Dict[str, Any]:
+    """
+    diff each image in images_list[start:end] against the previous loadable image
+    hit images owned by this chunk are written once; the image before start is left to the caller
+    with dedup_distance >= 0, near-duplicates of images written by this chunk are skipped, and written images are
+    hashed, so the caller can check them against images written before the chunk
+    """
+    hits: List[Tuple[str, str, Any]] = []
+    errors: List[str] = []
+    checked_files: Set[str] = set()
+    written_hashes: List[Tuple[str, int, float]] = []  # file name, hash and modified time, in write order
+    boundary_file = ''
+    boundary_hash = 0
+    duplicate_filter = (DuplicateFilter(max_distance=dedup_distance, window_seconds=dedup_window_seconds)
+                        if dedup_distance >= 0 else None)
+    output_directory = os.path.join(images_directory, OUTPUT_DIRECTORY)
+    image_count = len(images_list)
+
+    previous_image = None
+    previous_image_file: str = ''
+    previous_image_index = -1
+
+    # find the image the serial scan would diff against: the last loadable image before this chunk
+    for previous_index in range(start - 1, -1, -1):
+        try:
+            previous_image = _load_processed_image(os.path.join(images_directory, images_list[previous_index]),
+                                                   scale, decode_strategy)
+            previous_image_file = images_list[previous_index]
+            previous_image_index = previous_index
+            break
+        except Exception:
+            continue
+
+    progress_counter = start
+
+    for image_index in range(start, end):
+        image_file = images_list[image_index]
+
+        try:
+            progress_counter += 1
+            if show_progress and progress_counter % 10 == 0:
+                print(f'Processing image {progress_counter} of {image_count}: {image_file}')
+
+            current_image = _load_processed_image(os.path.join(images_directory, image_file), scale, decode_strategy)
+
+            if previous_image is None:
+                previous_image = current_image
+                previous_image_file = image_file
+                previous_image_index = image_index
+                continue
+
+            diff_score = _get_diff_score(previous_image, current_image, scale)
+
+            if diff_score > diff_threshold:
+                hits.append((previous_image_file, image_file, diff_score))
+                # TODO AEO output to TAB DELIMITED log file for DIFF SCORE reference, with formatted diff_score
+                # EXAMPLE
+                # TIMESTAMP \t EVENT \t FILE \t SCORE
+                # TIMESTAMP \t Motion Detected \t camknows-2021-07-19-07-11-57-c7fdda3d.jpg \t 52,807,976
+                # TIMESTAMP \t ERROR DETAILS
+                for hit_file, hit_image, hit_index in [(previous_image_file, previous_image, previous_image_index),
+                                                       (image_file, current_image, image_index)]:
+                    if hit_file in checked_files:
+                        continue
+                    checked_files.add(hit_file)
+                    if hit_index < start:
+                        boundary_file = hit_file
+                        boundary_hash = get_image_hash(hit_image) if duplicate_filter is not None else 0
+                        continue
+                    if duplicate_filter is not None:
+                        hit_hash = get_image_hash(hit_image)
+                        hit_time = os.path.getmtime(os.path.join(images_directory, hit_file))
+                        if not duplicate_filter.check_hash(hit_hash, hit_time):
+                            continue
+                        written_hashes.append((hit_file, hit_hash, hit_time))
+                    _write_processed_image(output_directory, hit_file, hit_image)
+
+            previous_image = current_image
+            previous_image_file = image_file
+            previous_image_index = image_index
+
+        except Exception:
+            errors.append(f'{image_file}: {sys.exc_info()}')
+
+    return {'hits': hits, 'errors': errors, 'checked_files': checked_files, 'written_hashes': written_hashes,
+            'boundary_file': boundary_file, 'boundary_hash': boundary_hash,
+            'suppressed_count': duplicate_filter.suppressed_count if duplicate_filter is not None else 0,
+            'processed_count': end - start}
+
+
+def parse_args(args: List[str]) -> Tuple[str, str, int, Dict[str, str]]:
+    format_message = ('USAGE: python3 motion.py images-directory jpg [worker-count] [options]\n'
+                      'OPTIONS:\n'
+                      '--threshold=3000000\tdiff score threshold\n'
+                      '--frames-threshold=1\tconsecutive motion frames required (cached scans only)\n'
+                      '--scale=1\t\tdownscale factor for motion frames\n'
+                      '--decode=full\t\tfull or reduced: decode jpeg files directly at the reduced scale\n'
+                      '--cache\t\t\tuse and update the motion frame cache in the images directory\n'
+                      '--catalog\t\tlist images from the media catalog instead of the images directory\n'
+                      '--sweep=1000000,2000000\tprint hit counts for each threshold from the cache\n'
+                      '--dedup=4\t\tskip writing hit images within this many hash bits of a recent one\n'
+                      '--dedup-window=30\tseconds (file modified times) a written image suppresses duplicates')
+    valid_options = ['threshold', 'frames-threshold', 'scale', 'decode', 'cache', 'sweep', 'catalog', 'dedup',
+                     'dedup-window']
+
+    options: Dict[str, str] = {}
+    for arg in [arg for arg in args if arg.startswith('--')]:
+        name, _, value = arg[2:].partition('=')
+        if name not in valid_options:
+            print('Invalid option:', arg)
+            print(format_message)
+            return '', '', 0, {}
+        options[name] = value
+    args = [arg for arg in args if not arg.startswith('--')]
+
+    if len(args) not in [2, 3]:
         print('Invalid number of arguments')
         print(format_message)
-        return '', ''
+        return '', '', 0, {}
 
     images_directory = args[0]
     extension = args[1]
+    worker_count = 1
+
+    if len(args) == 3:
+        if not args[2].isdigit() or int(args[2]) < 1:
+            print('Invalid worker count')
+            print(format_message)
+            return '', '', 0, {}
+        worker_count = int(args[2])
+
+    numeric_values = [options.get(name, '1') for name in ['threshold', 'frames-threshold', 'scale', 'dedup',
+                                                          'dedup-window']]
+    numeric_values += options.get('sweep', '1').split(',')
+    if not all(value.isdigit() for value in numeric_values):
+        print('Invalid option value')
+        print(format_message)
+        return '', '', 0, {}
+
+    if options.get('decode', DECODE_FULL) not in DECODE_STRATEGIES:
+        print('Invalid decode option')
+        print(format_message)
+        return '', '', 0, {}
 
     # remove starting / if given
     if images_directory[0] == '/':
@@ -97,23 +516,35 @@ def parse_args(args: List[str]) -> Tuple[str, str]:
     if not os.path.exists(full_path):
         print('Invalid directory argument:', full_path)
         print(format_message)
-        return '', ''
+        return '', '', 0, {}
 
     if extension not in ['jpg', 'png']:
         print('Invalid extension')
         print(format_message)
-        return '', ''
+        return '', '', 0, {}
 
-    return images_directory, extension
+    return images_directory, extension, worker_count, options
 
 
 def main() -> None:
-    images_directory, extension = parse_args(sys.argv[1:])
+    images_directory, extension, worker_count, options = parse_args(sys.argv[1:])
     if images_directory == '':
         return
 
-    motion = MotionProcessor()
-    motion.detect_motion_from_images(images_directory, extension)
+    motion = MotionProcessor(worker_count, scale=int(options.get('scale', '1')),
+                             decode_strategy=options.get('decode', DECODE_FULL), use_catalog='catalog' in options,
+                             dedup_distance=int(options.get('dedup', '-1')),
+                             dedup_window_seconds=int(options.get('dedup-window', '30')))
+    motion.diff_threshold = int(options.get('threshold', motion.diff_threshold))
+    motion.motion_frames_threshold = int(options.get('frames-threshold', motion.motion_frames_threshold))
+
+    if 'sweep' in options:
+        motion.detect_motion_with_cache(images_directory, extension,
+                                        [int(value) for value in options['sweep'].split(',')])
+    elif 'cache' in options:
+        motion.detect_motion_with_cache(images_directory, extension)
+    else:
+        motion.detect_motion_from_images(images_directory, extension)
 
 
 if __name__ == '__main__':
@@ -1,95 +1,390 @@
 # THIS SCRIPT IS BASED ON:
 # https://github.com/simonmonk/raspberrypi_cookbook_ed3/blob/master/python/ch_08_detect_motion.py
 
+import collections
 import datetime
+import json
 import os
+import queue
+import sys
+import time
+import traceback
 import uuid
-from time import sleep
-from threading import Thread
-from typing import Any, Tuple
+from threading import Condition, Thread
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
 
 import cv2
 import numpy as np
-from imutils import resize
-from imutils.video import VideoStream
-
-print('Script Executing...')
-
-diff_threshold = 500000
-script_directory = os.path.dirname(os.path.abspath(__file__))
-images_folder = os.path.join(script_directory, 'simple_motion_images')
-image_file_prefix = 'motion'
-image_file_suffix_old = '0-old'
-image_file_suffix = '1-new'
-save_raw_enabled = True
-save_old_enabled = True
-log_only = False
-resolution_width = 640
-resolution_height = 480
-video_framerate = 32
-
-if not os.path.exists(images_folder):
-    os.makedirs(images_folder)
-
-print('Begin Video Stream')
-
-vs = VideoStream(src=0, usePiCamera=True, resolution=(resolution_width, resolution_height),
-                 framerate=video_framerate).start()
-# allow for camera warmup
-sleep(3)
-
-
-def get_image() -> Tuple[Any, Any]:
-    raw_image = vs.read()
-    my_image = cv2.cvtColor(raw_image, cv2.COLOR_BGR2GRAY)
-    my_image = cv2.blur(my_image, (20, 20))
-    # print('raw_image is:', type(raw_image), 'my_image is:', type(my_image))
-    return my_image, raw_image
-
-
-def save_image(new_image: Any, diff_score: Any, timestamp_filename: str, suffix: str = image_file_suffix) -> None:
-    diff_score_formatted = '{0:,d}'.format(diff_score).replace(',', '.')
-    filename = f'{image_file_prefix}-{timestamp_filename}-{diff_score_formatted}-{suffix}-{str(uuid.uuid4())[:8]}.jpg'
-    print(f'Saving File: {filename}')
-    if log_only:
-        return
-    image_full_path = os.path.join(images_folder, filename)
-    # use threading for disk io latency
-    image_data = new_image.copy()
-    thread = Thread(target=cv2.imwrite, args=(image_full_path, image_data))
-    thread.start()
 
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+SOURCE_PICAMERA = 'picamera'
+IMAGE_FILE_SUFFIX_OLD = '0-old'
+IMAGE_FILE_SUFFIX = '1-new'
+FRAME_TIMEOUT_SECONDS = 5
+LATENCY_WINDOW = 1000  # latest decisions used for latency percentiles
 
-def main() -> None:
-    print('Get First Image')
+DEFAULT_CONFIG: Dict[str, Any] = {
+    'diff_threshold': 500000,
+    'images_directory': 'simple_motion_images',  # relative to this script's directory, or absolute
+    'image_file_prefix': 'motion',
+    'save_raw_enabled': True,  # save the color frame; otherwise the processed (gray, blurred) frames
+    'save_old_enabled': True,  # with processed frames, also save the frame before motion started
+    'log_only': False,
+    'blur_size': 20,
+    'resolution_width': 640,
+    'resolution_height': 480,
+    'video_framerate': 32,
+    'warmup_seconds': 3,
+    'write_queue_size': 8,  # images waiting to be written; new images are dropped when full
+    'report_seconds': 60,
+}
+
+
+class LatestFrameReader:
+    """
+    reads frames on a background thread, keeping only the latest one
+    frames are numbered, so a consumer never processes the same frame twice, and frames it was too slow for
+    show up as gaps in the sequence
+    """
+
+    def __init__(self, read_frame: Callable[[], Optional[Any]], close: Optional[Callable[[], None]] = None):
+        """
+        read_frame: blocks until the next BGR frame, or returns None at the end of the stream
+        """
+        self._read_frame = read_frame
+        self._close = close
+        self._condition = Condition()
+        self._thread: Optional[Thread] = None
+        self._running = False
+        self._ended = False
+        self._sequence = 0
+        self._capture_time: float = 0
+        self._frame: Any = None
+        self.error = ''
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+
+        self._running = True
+        self._thread = Thread(target=self._run, name='frame-reader', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=FRAME_TIMEOUT_SECONDS)
+            self._thread = None
+        if self._close is not None:
+            self._close()
+            self._close = None
+
+    def get_latest(self, after_sequence: int,
+                   timeout: float = FRAME_TIMEOUT_SECONDS) -> Optional[Tuple[int, float, Any]]:
+        """
+        (sequence, capture perf_counter time, frame) for the latest frame after after_sequence
+        None on timeout, or when the stream has ended
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._sequence > after_sequence or self._ended, timeout)
+            if self._sequence <= after_sequence:
+                return None
+            return self._sequence, self._capture_time, self._frame
+
+    def has_ended(self) -> bool:
+        with self._condition:
+            return self._ended
+
+    def _run(self) -> None:
+        try:
+            while self._running:
+                frame = self._read_frame()
+                capture_time = time.perf_counter()
+                if frame is None:
+                    break
+                with self._condition:
+                    self._frame = frame
+                    self._capture_time = capture_time
+                    self._sequence += 1
+                    self._condition.notify_all()
+        except Exception:
+            self.error = traceback.format_exc()
+        finally:
+            with self._condition:
+                self._ended = True
+                self._condition.notify_all()
+
+
+class BoundedImageWriter:
+    """
+    writes images on one background thread from a bounded queue; images are dropped instead of waiting when full
+    """
 
-    prior_saved = False  # avoids saving redundant images for prior/old image
-    old_image, _ = get_image()
+    def __init__(self, queue_size: int = 8):
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+        self._thread: Optional[Thread] = None
+        self.written_count = 0
+        self.dropped_count = 0
+        self.error_count = 0
 
-    print('Monitoring for Motion')
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name='image-writer', daemon=True)
+            self._thread.start()
 
-    while True:
-        new_image, raw_image = get_image()
-        # print('new_image is:', type(new_image))  # , 'raw_image is:', type(raw_image))
+    def submit(self, image_full_path: str, image: Any) -> bool:
+        """
+        queue an image that is not changed after submitting; returns False if it was dropped
+        """
+        try:
+            self._queue.put_nowait((image_full_path, image))
+            return True
+        except queue.Full:
+            self.dropped_count += 1
+            print('Write queue full; dropped file:', os.path.basename(image_full_path))
+            return False
 
-        diff = cv2.absdiff(old_image, new_image)
-        diff_score = np.sum(diff)
-        # print(diff_score)
+    def stop(self) -> None:
+        """
+        write queued images and stop
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
 
-        if diff_score > diff_threshold:
-            # print(f"Movement detected; Diff Score:{diff_score}")
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            image_full_path, image = item
+            try:
+                if not cv2.imwrite(image_full_path, image):
+                    raise IOError(f'Unable to write image: {image_full_path}')
+                self.written_count += 1
+            except Exception:
+                self.error_count += 1
+                print('ERROR:', traceback.format_exc())
+
+
+class StreamingMotionDetector:
+    """
+    diff each new frame against the previous processed frame, always using the latest frame
+    reports dropped frames and the latency from frame capture to motion decision
+    """
+
+    def __init__(self, frame_reader: LatestFrameReader, config: Optional[Dict[str, Any]] = None):
+        self.frame_reader = frame_reader
+        self.config: Dict[str, Any] = dict(DEFAULT_CONFIG, **(config if config is not None else {}))
+        self.images_directory = os.path.join(SCRIPT_DIRECTORY, self.config['images_directory'])
+        self.image_writer = BoundedImageWriter(self.config['write_queue_size'])
+        self.previous_image: Any = None
+        self.prior_saved = False  # avoids saving redundant images for prior/old image
+
+        self.frame_count = 0
+        self.dropped_count = 0
+        self.motion_count = 0
+        self.latencies: Deque[float] = collections.deque(maxlen=LATENCY_WINDOW)
+        self.last_report_time = time.perf_counter()
+
+    def run(self, max_frames: int = 0) -> None:
+        """
+        process frames until the stream ends, max_frames (0: no limit) are processed, or ctrl-c
+        """
+        self.frame_reader.start()
+        self.image_writer.start()
+        print('Monitoring for Motion')
+
+        try:
+            last_sequence = 0
+            while max_frames <= 0 or self.frame_count < max_frames:
+                latest_frame = self.frame_reader.get_latest(last_sequence)
+                if latest_frame is None:
+                    if self.frame_reader.has_ended():
+                        break
+                    print(f'No new frame in {FRAME_TIMEOUT_SECONDS} seconds')
+                    continue
+
+                sequence, capture_time, frame = latest_frame
+                if last_sequence > 0:
+                    # frames replaced by newer ones before they could be processed
+                    self.dropped_count += sequence - last_sequence - 1
+                last_sequence = sequence
+
+                self.process_frame(frame, capture_time)
+                self._report_if_due()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.frame_reader.stop()
+            if self.frame_reader.error != '':
+                print('ERROR:', self.frame_reader.error)
+            self.image_writer.stop()
+            self.report()
+
+    def process_frame(self, frame: Any, capture_time: float) -> Optional[int]:
+        """
+        returns the diff score against the previous frame, or None for the first frame
+        """
+        blur_size = self.config['blur_size']
+        new_image = cv2.blur(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (blur_size, blur_size))
+        self.frame_count += 1
+
+        if self.previous_image is None:
+            self.previous_image = new_image
+            return None
+
+        diff_score = int(np.sum(cv2.absdiff(self.previous_image, new_image)))
+        motion_detected = diff_score > self.config['diff_threshold']
+        self.latencies.append(time.perf_counter() - capture_time)
+
+        if motion_detected:
+            self.motion_count += 1
             timestamp_filename = datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S-%f')
-            if save_raw_enabled:
-                save_image(raw_image, diff_score, timestamp_filename)
+            if self.config['save_raw_enabled']:
+                self._save_image(frame, diff_score, timestamp_filename)
             else:
-                if not prior_saved and save_old_enabled:
-                    save_image(old_image, diff_score, timestamp_filename, image_file_suffix_old)
-                save_image(new_image, diff_score, timestamp_filename)
-            prior_saved = True
+                if not self.prior_saved and self.config['save_old_enabled']:
+                    self._save_image(self.previous_image, diff_score, timestamp_filename, IMAGE_FILE_SUFFIX_OLD)
+                self._save_image(new_image, diff_score, timestamp_filename)
+            self.prior_saved = True
         else:
-            prior_saved = False
+            self.prior_saved = False
+
+        self.previous_image = new_image
+        return diff_score
+
+    def get_stats(self) -> Dict[str, Any]:
+        latencies = np.array(self.latencies) if len(self.latencies) > 0 else np.zeros(1)
+        return {
+            'frames': self.frame_count,
+            'dropped': self.dropped_count,
+            'motion': self.motion_count,
+            'written': self.image_writer.written_count,
+            'writes_dropped': self.image_writer.dropped_count,
+            'latency_p50': float(np.percentile(latencies, 50)),
+            'latency_p95': float(np.percentile(latencies, 95)),
+            'latency_max': float(np.max(latencies)),
+        }
+
+    def report(self) -> None:
+        stats = self.get_stats()
+        print(f'Frames {stats["frames"]}, dropped {stats["dropped"]}, motion {stats["motion"]}, '
+              f'written {stats["written"]}, writes dropped {stats["writes_dropped"]}, '
+              f'capture to decision p50/p95/max {stats["latency_p50"] * 1000:0.1f}/'
+              f'{stats["latency_p95"] * 1000:0.1f}/{stats["latency_max"] * 1000:0.1f} ms')
+
+    def _report_if_due(self) -> None:
+        report_seconds = self.config['report_seconds']
+        if report_seconds > 0 and time.perf_counter() - self.last_report_time >= report_seconds:
+            self.last_report_time = time.perf_counter()
+            self.report()
+
+    def _save_image(self, image: Any, diff_score: int, timestamp_filename: str,
+                    suffix: str = IMAGE_FILE_SUFFIX) -> None:
+        diff_score_formatted = '{0:,d}'.format(diff_score).replace(',', '.')
+        filename = (f'{self.config["image_file_prefix"]}-{timestamp_filename}-{diff_score_formatted}-{suffix}-'
+                    f'{str(uuid.uuid4())[:8]}.jpg')
+        print(f'Saving File: {filename}')
+        if self.config['log_only']:
+            return
+
+        if not os.path.exists(self.images_directory):
+            os.makedirs(self.images_directory)
+        # frames and processed images are new arrays for every frame, so no copy is needed
+        self.image_writer.submit(os.path.join(self.images_directory, filename), image)
+
+
+def create_picamera_reader(config: Dict[str, Any]) -> LatestFrameReader:
+    # deferred: only needed with camera hardware
+    from picamera import PiCamera
+    from picamera.array import PiRGBArray
+
+    resolution = (config['resolution_width'], config['resolution_height'])
+    camera = PiCamera(resolution=resolution, framerate=config['video_framerate'])
+    raw_capture = PiRGBArray(camera, size=resolution)
+    frames = camera.capture_continuous(raw_capture, format='bgr', use_video_port=True)
+    # allow for camera warmup
+    time.sleep(config['warmup_seconds'])
+
+    def read_frame() -> Any:
+        frame = next(frames).array
+        raw_capture.truncate(0)
+        return frame
+
+    def close() -> None:
+        frames.close()
+        camera.close()
+
+    return LatestFrameReader(read_frame, close)
+
+
+def create_video_capture_reader(source: str) -> LatestFrameReader:
+    """
+    frames from an OpenCV camera index (ex: 0 for a USB camera) or a video file
+    """
+    capture = cv2.VideoCapture(int(source) if source.isdigit() else source)
+    if not capture.isOpened():
+        raise IOError(f'Unable to open video source: {source}')
+
+    def read_frame() -> Any:
+        success, frame = capture.read()
+        return frame if success else None
+
+    return LatestFrameReader(read_frame, capture.release)
+
+
+def parse_args(args: List[str]) -> Tuple[Optional[Dict[str, Any]], str, int]:
+    format_message = ('USAGE: python3 simple_motion.py [options]\n'
+                      'OPTIONS:\n'
+                      '--config=simple_motion.json\tjson file with settings to change (see DEFAULT_CONFIG)\n'
+                      '--threshold=500000\t\tdiff score threshold\n'
+                      '--source=picamera\t\tpicamera, an OpenCV camera index, or a video file\n'
+                      '--frames=0\t\t\tstop after this many frames; 0 runs until stopped\n'
+                      '--log-only\t\t\tlog motion without saving images')
+    valid_options = ['config', 'threshold', 'source', 'frames', 'log-only']
+
+    options: Dict[str, str] = {}
+    for arg in args:
+        name, _, value = arg[2:].partition('=')
+        if not arg.startswith('--') or name not in valid_options:
+            print('Invalid option:', arg)
+            print(format_message)
+            return None, '', 0
+        options[name] = value
+
+    if not all(value.isdigit() for value in [options.get('threshold', '1'), options.get('frames', '0')]):
+        print('Invalid option value')
+        print(format_message)
+        return None, '', 0
+
+    config: Dict[str, Any] = {}
+    if 'config' in options:
+        try:
+            with open(options['config']) as config_file:
+                config = json.load(config_file)
+        except (OSError, ValueError) as error:
+            print('Invalid config file:', error)
+            return None, '', 0
+    if 'threshold' in options:
+        config['diff_threshold'] = int(options['threshold'])
+    if 'log-only' in options:
+        config['log_only'] = True
+
+    return config, options.get('source', SOURCE_PICAMERA), int(options.get('frames', '0'))
+
+
+def main() -> None:
+    config, source, max_frames = parse_args(sys.argv[1:])
+    if config is None:
+        return
 
-        old_image = new_image
+    print('Begin Video Stream')
+    frame_reader = (create_picamera_reader(dict(DEFAULT_CONFIG, **config)) if source == SOURCE_PICAMERA
+                    else create_video_capture_reader(source))
+    StreamingMotionDetector(frame_reader, config).run(max_frames)
 
 
 if __name__ == '__main__':
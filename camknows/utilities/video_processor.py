@@ -1,78 +1,287 @@
+import collections
 import datetime
+import itertools
 import os
 import sys
-from typing import List, Tuple
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import cv2
+import numpy as np
+
+from image_decoder import DECODE_FULL, DECODE_STRATEGIES, read_color
+from image_sequence import get_image_paths, iter_catalog_images, iter_day_directories, parse_time_range, subsample
+from media_catalog import MediaCatalog
+from mjpeg_avi_writer import MjpegAviWriter, get_jpeg_size
+
+VIDEO_FORMAT_MP4 = 'mp4'
+VIDEO_FORMAT_AVI = 'avi'
+VIDEO_FORMATS = [VIDEO_FORMAT_MP4, VIDEO_FORMAT_AVI]
+
+# AVI 1.0 sizes are 32 bit and many players stop at 1 GB, so longer passthrough videos are split into parts
+MAX_AVI_FILE_BYTES = 1000 * 1000 * 1000
 
 
 class VideoProcessor:
 
-    def __init__(self):
+    def __init__(self, worker_count: int = 2, prefetch_depth: int = 8):
         self.script_directory = os.path.dirname(os.path.abspath(__file__))
+        # decoding runs on a thread pool (OpenCV releases the GIL) while frames are written in order
+        self.worker_count = max(1, worker_count)
+        self.prefetch_depth = max(1, prefetch_depth)
 
-    # noinspection PyMethodMayBeStatic
-    def convert_to_video(self, images_directory: str, output_file: str, extension: str) -> None:
+    def convert_to_video(self, image_paths: Iterable[str], output_file: str, scale: int = 1,
+                         decode_strategy: str = DECODE_FULL, video_format: str = VIDEO_FORMAT_MP4,
+                         frames_per_second: float = 1) -> None:
+        """
+        image_paths are consumed lazily, in order; see image_sequence.get_image_paths
+        mp4: decode and transcode every image; scale > 1 creates a reduced size preview video,
+        and the reduced decode strategy makes this much faster
+        avi: mjpeg passthrough, copying jpeg files into the video without decoding
+        """
 
-        images_list: List[str] = []
-        for image in os.listdir(images_directory):
-            if image.endswith(f'.{extension}'):
-                images_list.append(image)
+        print('Processing images')
 
-        images_list.sort()
+        if video_format == VIDEO_FORMAT_AVI:
+            self._write_mjpeg_avi(iter(image_paths), output_file, frames_per_second)
+        else:
+            self._write_mp4(iter(image_paths), output_file, scale, decode_strategy, frames_per_second)
 
-        print(f'Processing {len(images_list)} images')
+    def _write_mp4(self, image_paths: Iterator[str], output_file: str, scale: int, decode_strategy: str,
+                   frames_per_second: float) -> None:
 
         character_code = cv2.VideoWriter_fourcc(*'MP4V')
-        frames_per_second = 1
 
-        frame_image = cv2.imread(os.path.join(images_directory, images_list[0]))
+        frame_image = None
+        first_image_path = None
+        for first_image_path in image_paths:
+            try:
+                frame_image = read_color(first_image_path, scale, decode_strategy)
+                break
+            except IOError:
+                print('ERROR: unable to read image:', first_image_path)
+
+        if first_image_path is None:
+            print('No images found')
+            return
+        if frame_image is None:
+            print('ERROR: no readable images')
+            return
+
         frame_height, frame_width, _ = frame_image.shape
 
-        video = cv2.VideoWriter(output_file + '.mp4', character_code, frames_per_second, (frame_width, frame_height))
+        frame_size = (frame_width, frame_height)
+
+        video = cv2.VideoWriter(output_file + '.mp4', character_code, frames_per_second, frame_size)
 
         image_index = 0
+        perf_start_time = time.perf_counter()
 
         try:
-            for image in images_list:
-                image_index += 1
-                timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                if image_index % 10 == 0:
-                    print(f'{timestamp}\t\tprocessing image {image_index}')
-                video.write(cv2.imread(os.path.join(images_directory, image)))
+            with ThreadPoolExecutor(max_workers=self.worker_count) as executor:
+                # bounded queue of decodes in file order: at most prefetch_depth frames are held in memory
+                pending_frames: Deque[Tuple[str, Future]] = collections.deque()
+                images_iterator = itertools.chain([first_image_path], image_paths)
+
+                while True:
+                    while len(pending_frames) < self.prefetch_depth:
+                        image_path = next(images_iterator, None)
+                        if image_path is None:
+                            break
+                        pending_frames.append((image_path, executor.submit(
+                            _decode_frame, image_path, scale, decode_strategy, frame_size)))
+
+                    if not pending_frames:
+                        break
+
+                    image_path, future = pending_frames.popleft()
+                    image_index += 1
+                    if image_index % 10 == 0:
+                        timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                        frames_per_second_processed = image_index / max(time.perf_counter() - perf_start_time, 1e-9)
+                        print(f'{timestamp}\t\tprocessing image {image_index} '
+                              f'({frames_per_second_processed:0.1f} frames/second)')
+
+                    frame = future.result()
+                    if frame is None:
+                        print('ERROR: unable to read image:', image_path)
+                        continue
+                    video.write(frame)
         finally:
             cv2.destroyAllWindows()
             video.release()
 
+        _print_summary(image_index, perf_start_time)
+
+    # noinspection PyMethodMayBeStatic
+    def _write_mjpeg_avi(self, image_paths: Iterator[str], output_file: str, frames_per_second: float) -> None:
+        """
+        only the first frame's header is read for the video size; files are streamed one at a time
+        """
+        frame_size: Optional[Tuple[int, int]] = None
+        first_image_path = ''
+        for first_image_path in image_paths:
+            with open(first_image_path, 'rb') as image_file:
+                frame_size = get_jpeg_size(image_file.read())
+            if frame_size is not None:
+                break
+
+        if frame_size is None:
+            print('ERROR: no readable jpeg images')
+            return
+
+        part_number = 0
+        video = MjpegAviWriter(output_file + '.avi', frame_size, frames_per_second)
+
+        image_index = 0
+        perf_start_time = time.perf_counter()
+
+        try:
+            for image_path in itertools.chain([first_image_path], image_paths):
+                image_index += 1
+                if image_index % 100 == 0:
+                    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                    frames_per_second_processed = image_index / max(time.perf_counter() - perf_start_time, 1e-9)
+                    print(f'{timestamp}\t\tprocessing image {image_index} '
+                          f'({frames_per_second_processed:0.1f} frames/second)')
+
+                with open(image_path, 'rb') as image_file:
+                    jpeg_data = image_file.read()
+
+                image_size = get_jpeg_size(jpeg_data)
+                if image_size is None:
+                    print('ERROR: unable to read image:', image_path)
+                    continue
+                if image_size != frame_size:
+                    # rare (ex: resolution changed during the day), so only these frames are transcoded
+                    jpeg_data = _transcode_frame(jpeg_data, frame_size)
+
+                if video.bytes_written + len(jpeg_data) > MAX_AVI_FILE_BYTES and video.frame_count > 0:
+                    video.release()
+                    part_number += 1
+                    video = MjpegAviWriter(f'{output_file}-{part_number}.avi', frame_size, frames_per_second)
+
+                video.write(jpeg_data)
+        finally:
+            video.release()
 
-def parse_args(args: List[str]) -> Tuple[str, str, str]:
+        _print_summary(image_index, perf_start_time)
+
+
+def _print_summary(image_count: int, perf_start_time: float) -> None:
+    elapsed_seconds = time.perf_counter() - perf_start_time
+    print(f'Processed {image_count} images in {elapsed_seconds:0.2f} seconds '
+          f'({image_count / max(elapsed_seconds, 1e-9):0.1f} frames/second)')
+
+
+def _transcode_frame(jpeg_data: bytes, frame_size: Tuple[int, int]) -> bytes:
+    frame = cv2.imdecode(np.frombuffer(jpeg_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    frame = cv2.resize(frame, frame_size, interpolation=cv2.INTER_AREA)
+    return cv2.imencode('.jpg', frame)[1].tobytes()
+
+
+def _decode_frame(image_path: str, scale: int, decode_strategy: str, frame_size: Tuple[int, int]) -> Optional[Any]:
+    """
+    decode a frame, resized to the video frame size if needed (ex: resolution changed during the day)
+    """
+    try:
+        frame = read_color(image_path, scale, decode_strategy)
+    except IOError:
+        return None
+
+    if (frame.shape[1], frame.shape[0]) != frame_size:
+        frame = cv2.resize(frame, frame_size, interpolation=cv2.INTER_AREA)
+
+    return frame
+
+
+def parse_args(args: List[str]) -> Tuple[List[str], str, str, Dict[str, str]]:
     format_message = (f'\nUSAGE:\n' 
-                      '$ python3 video_processor.py images-directory video-file-name jpg\n'
-                      'EXAMPLE:\n'
-                      '$ python3 video_processor.py media-files/2021/07/25 video-20210725 jpg')
-    args_length = 3
+                      '$ python3 video_processor.py images-directory [images-directory ...] video-file-name jpg '
+                      '[options]\n'
+                      '$ python3 video_processor.py main-directory video-file-name jpg --from=date [options]\n'
+                      'OPTIONS:\n'
+                      '--scale=1\t\tdownscale factor for preview videos\n'
+                      '--decode=full\t\tfull or reduced: decode jpeg files directly at the reduced scale\n'
+                      '--workers=2\t\tdecode threads\n'
+                      '--prefetch=8\t\tmaximum decoded frames waiting to be written\n'
+                      '--format=mp4\t\tmp4, or avi: mjpeg passthrough without decoding (jpg only, scale 1)\n'
+                      '--fps=1\t\t\tvideo frame rate\n'
+                      '--from=2021-07-19\tstart date or date time (ex: 2021-07-19T08:30) in main-directory/YYYY/MM/DD\n'
+                      '--to=2021-07-25\t\tend date (inclusive) or date time (exclusive); default is now\n'
+                      '--every=1\t\tuse every Nth image\n'
+                      '--interval=0\t\tuse at most one image per interval seconds\n'
+                      '--catalog\t\tfind images in the main-directory media catalog instead of listing directories\n'
+                      '--min-score=0\t\twith --catalog, only images with at least this diff score\n'
+                      'EXAMPLES:\n'
+                      '$ python3 video_processor.py media-files/2021/07/25 video-20210725 jpg\n'
+                      '$ python3 video_processor.py media-files video-week jpg --from=2021-07-19 --to=2021-07-25 '
+                      '--interval=60 --format=avi --fps=30')
+    args_minimum_length = 3
+    valid_options = ['scale', 'decode', 'workers', 'prefetch', 'format', 'fps', 'from', 'to', 'every', 'interval',
+                     'catalog', 'min-score']
 
-    if len(args) != args_length:
+    options: Dict[str, str] = {}
+    for arg in [arg for arg in args if arg.startswith('--')]:
+        name, _, value = arg[2:].partition('=')
+        if name not in valid_options:
+            print('Invalid option:', arg)
+            print(format_message)
+            return [], '', '', {}
+        options[name] = value
+    args = [arg for arg in args if not arg.startswith('--')]
+
+    if len(args) < args_minimum_length:
         print('Invalid number of arguments')
         print(format_message)
-        return '', '', ''
+        return [], '', '', {}
+
+    numeric_values = [options.get(name, '1') for name in ['scale', 'workers', 'prefetch', 'every', 'interval',
+                                                          'min-score']]
+    if (not all(value.isdigit() for value in numeric_values)
+            or options.get('decode', DECODE_FULL) not in DECODE_STRATEGIES
+            or options.get('format', VIDEO_FORMAT_MP4) not in VIDEO_FORMATS
+            or not _is_positive_number(options.get('fps', '1'))
+            or ('to' in options and 'from' not in options)
+            or ('min-score' in options and 'catalog' not in options)):
+        print('Invalid option value')
+        print(format_message)
+        return [], '', '', {}
 
-    images_directory = args[0]
-    output_file = args[1]
-    extension = args[2]
-    full_path = parse_directory_path(images_directory)
+    if 'from' in options:
+        try:
+            parse_time_range(options['from'], options.get('to', ''))
+        except ValueError:
+            print('Invalid date range:', options['from'], options.get('to', ''))
+            print(format_message)
+            return [], '', '', {}
+
+    images_directories = args[:-2]
+    output_file = args[-2]
+    extension = args[-1]
+    full_paths = [parse_directory_path(images_directory) for images_directory in images_directories]
 
-    if full_path == '':
-        print('Invalid directory argument:', images_directory)
+    if '' in full_paths:
+        print('Invalid directory argument:', images_directories[full_paths.index('')])
         print(format_message)
-        return '', '', ''
+        return [], '', '', {}
+
+    if 'catalog' in options and any(MediaCatalog.find(full_path) is None for full_path in full_paths):
+        print('Media catalog not found; create it with: python3 media_catalog.py rebuild main-directory')
+        return [], '', '', {}
 
     if extension not in ['jpg', 'png']:
         print('Invalid extension: must be jpg or png')
         print(format_message)
-        return '', '', ''
+        return [], '', '', {}
 
-    return full_path, output_file, extension
+    if options.get('format') == VIDEO_FORMAT_AVI and (extension != 'jpg' or options.get('scale', '1') != '1'):
+        print('Invalid options: avi passthrough requires jpg images at scale 1')
+        print(format_message)
+        return [], '', '', {}
+
+    return full_paths, output_file, extension, options
 
 
 def parse_directory_path(directory_path: str) -> str:
@@ -92,13 +301,55 @@ def parse_directory_path(directory_path: str) -> str:
     return parsed_path
 
 
+def _query_catalog(images_directory: str, extension: str, start_time: Optional[datetime.datetime],
+                   end_time: Optional[datetime.datetime],
+                   min_score: Optional[str]) -> Iterator[Tuple[str, datetime.datetime]]:
+    """
+    cataloged images under images_directory, which is a main directory or one of its day directories
+    """
+    catalog = MediaCatalog(MediaCatalog.find(images_directory))
+    relative_directory = os.path.relpath(os.path.abspath(images_directory), catalog.main_directory)
+    records = catalog.query(start_time, end_time, int(min_score) if min_score is not None else None,
+                            directory=relative_directory, extension=extension)
+    return iter_catalog_images(records, catalog.main_directory)
+
+
+def _is_positive_number(value: str) -> bool:
+    try:
+        return float(value) > 0
+    except ValueError:
+        return False
+
+
 def main() -> None:
-    images_directory, output_file, extension = parse_args(sys.argv[1:])
-    if images_directory == '':
+    images_directories, output_file, extension, options = parse_args(sys.argv[1:])
+    if not images_directories:
         return
 
-    processor = VideoProcessor()
-    processor.convert_to_video(images_directory, output_file, extension)
+    start_time: Optional[datetime.datetime] = None
+    end_time: Optional[datetime.datetime] = None
+    if 'from' in options:
+        start_time, end_time = parse_time_range(options['from'], options.get('to', ''))
+
+    every_nth = int(options.get('every', '1'))
+    interval_seconds = int(options.get('interval', '0'))
+
+    if 'catalog' in options:
+        image_paths = subsample(itertools.chain.from_iterable(
+            _query_catalog(images_directory, extension, start_time, end_time, options.get('min-score'))
+            for images_directory in images_directories), every_nth, interval_seconds)
+    else:
+        if start_time is not None:
+            # directories are main directories, resolved to their YYYY/MM/DD day directories in the range
+            images_directories = itertools.chain.from_iterable(
+                iter_day_directories(main_directory, start_time, end_time) for main_directory in images_directories)
+        image_paths = get_image_paths(images_directories, extension, start_time, end_time, every_nth,
+                                      interval_seconds)
+
+    processor = VideoProcessor(int(options.get('workers', '2')), int(options.get('prefetch', '8')))
+    processor.convert_to_video(image_paths, output_file, int(options.get('scale', '1')),
+                               options.get('decode', DECODE_FULL), options.get('format', VIDEO_FORMAT_MP4),
+                               float(options.get('fps', '1')))
 
 
 if __name__ == '__main__':
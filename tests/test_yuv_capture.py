@@ -0,0 +1,82 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+
+from camera import CAPTURE_FORMAT_YUV, Camera  # noqa: E402
+from frame_sources import YuvFrame, get_yuv_capture_size  # noqa: E402
+
+# not multiples of 32 (width) or 16 (height), so the capture buffer is padded
+RESOLUTION = (1000, 750)
+PADDING_VALUE = 255
+
+
+def create_mock_camera(crop_dimensions):
+    # only the capture settings used by _get_captured_image and _crop_image; no hardware, logger or writer
+    camera = Camera.__new__(Camera)
+    camera.resolution_width, camera.resolution_height = RESOLUTION
+    camera.crop_dimensions = crop_dimensions
+    camera.capture_format = CAPTURE_FORMAT_YUV
+    return camera
+
+
+def create_yuv_buffer():
+    """
+    synthetic I420 capture: a luma gradient below PADDING_VALUE, padding set to PADDING_VALUE, neutral chroma
+    """
+    padded_width, padded_height = get_yuv_capture_size(RESOLUTION)
+    yuv_buffer = YuvFrame.allocate((padded_width, padded_height))
+    yuv_buffer[:] = 128
+
+    luma = yuv_buffer[:padded_width * padded_height].reshape((padded_height, padded_width))
+    luma[:] = PADDING_VALUE
+    rows, columns = np.indices((RESOLUTION[1], RESOLUTION[0]))
+    luma[:RESOLUTION[1], :RESOLUTION[0]] = (rows + columns) % 200
+
+    return yuv_buffer, luma[:RESOLUTION[1], :RESOLUTION[0]].copy()
+
+
+def test_yuv_capture_size_is_padded():
+    assert get_yuv_capture_size(RESOLUTION) == (1024, 752)
+    assert get_yuv_capture_size((1024, 768)) == (1024, 768)
+
+
+def test_luma_is_unpadded_zero_copy_view():
+    yuv_buffer, expected_luma = create_yuv_buffer()
+
+    frame = create_mock_camera([0, 0, 0, 0])._get_captured_image(yuv_buffer, use_video_port=True)
+
+    assert np.shares_memory(frame.luma, yuv_buffer)
+    assert frame.luma.shape == (RESOLUTION[1], RESOLUTION[0])
+    assert np.array_equal(frame.luma, expected_luma)
+
+
+def test_luma_is_cropped():
+    yuv_buffer, expected_luma = create_yuv_buffer()
+    # 1-based x1, x2, y1, y2
+    crop_dimensions = [101, 900, 51, 700]
+
+    frame = create_mock_camera(crop_dimensions)._get_captured_image(yuv_buffer, use_video_port=True)
+
+    assert np.shares_memory(frame.luma, yuv_buffer)
+    assert frame.luma.shape == (650, 800)
+    assert np.array_equal(frame.luma, expected_luma[50:700, 100:900])
+
+
+def test_to_bgr_is_unpadded_and_cropped():
+    yuv_buffer, _ = create_yuv_buffer()
+
+    uncropped_frame = create_mock_camera([0, 0, 0, 0])._get_captured_image(yuv_buffer, use_video_port=True)
+    cropped_frame = create_mock_camera([101, 900, 51, 700])._get_captured_image(yuv_buffer, use_video_port=True)
+
+    uncropped_image = uncropped_frame.to_bgr()
+    assert uncropped_image.shape == (RESOLUTION[1], RESOLUTION[0], 3)
+    assert uncropped_image.dtype == np.uint8
+    # neutral chroma: gray pixels, none from the padding
+    assert int(uncropped_image.max()) < PADDING_VALUE
+    assert np.array_equal(uncropped_image[:, :, 0], uncropped_image[:, :, 2])
+
+    cropped_image = cropped_frame.to_bgr()
+    assert cropped_image.shape == (650, 800, 3)
+    assert np.array_equal(cropped_image, uncropped_image[50:700, 100:900])
+    assert cropped_frame.to_bgr() is cropped_image